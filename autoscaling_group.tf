@@ -22,7 +22,7 @@ resource "aws_autoscaling_group" "sensor_asg" {
     lifecycle_transition = "autoscaling:EC2_INSTANCE_LAUNCHING"
     name                 = var.asg_lifecycle_hook_name
     default_result       = "ABANDON"
-    heartbeat_timeout    = 300
+    heartbeat_timeout    = var.asg_lifecycle_hook_timeout
   }
 
   tag {
@@ -71,7 +71,7 @@ resource "awscc_cloudwatch_alarm" "sensor_asg_high_cpu_alarm" {
   dimensions = [
     {
       name  = "AutoScalingGroupName"
-      value = "SensorAutoScalingGroup"
+      value = aws_autoscaling_group.sensor_asg.name
     }
   ]
   metric_name = "CPUUtilization"
@@ -105,4 +105,16 @@ resource "awscc_cloudwatch_alarm" "sensor_asg_low_cpu_alarm" {
     }
   ]
   metric_name = "CPUUtilization"
-}
\ No newline at end of file
+}
+
+# Managed on its own rather than as an initial_lifecycle_hook, so it is also added to groups that already exist. It
+# only has to exist by the time an instance terminates
+resource "aws_autoscaling_lifecycle_hook" "sensor_terminate_hook" {
+  count = var.asg_terminate_lifecycle_hook_enabled ? 1 : 0
+
+  name                   = var.asg_terminate_lifecycle_hook_name
+  autoscaling_group_name = aws_autoscaling_group.sensor_asg.name
+  lifecycle_transition   = "autoscaling:EC2_INSTANCE_TERMINATING"
+  default_result         = "CONTINUE"
+  heartbeat_timeout      = var.asg_terminate_lifecycle_hook_timeout
+}
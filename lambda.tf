@@ -1,5 +1,28 @@
 locals {
   script_name = "corelight_sensor_asg_nic_manager.py"
+
+  # API operations the ENI management lambda reports AwsCallLatency for
+  nic_manager_alarm_operations = [
+    "DescribeInstances",
+    "CreateNetworkInterface",
+    "AttachNetworkInterface",
+    "ModifyNetworkInterfaceAttribute",
+    "CompleteLifecycleAction",
+  ]
+
+  # Lifecycle events reach this module's Lambda unless another deployment's Lambda handles the group
+  lifecycle_event_target_enabled = !var.lifecycle_events_handled_by_shared_lambda
+
+  # Hooks of this deployment's group, also those of additional fleets that do not list their own
+  lifecycle_hook_names = concat(
+    [var.asg_lifecycle_hook_name],
+    var.asg_terminate_lifecycle_hook_enabled ? [var.asg_terminate_lifecycle_hook_name] : []
+  )
+  # The rule matches the hooks of every group, the Lambda ignores events whose hook is not one of their own group's
+  rule_lifecycle_hook_names = distinct(concat(
+    local.lifecycle_hook_names,
+    flatten([for fleet in values(var.lambda_additional_fleets) : fleet.lifecycle_hook_names])
+  ))
 }
 
 resource "aws_lambda_function" "auto_scaling_lambda" {
@@ -13,10 +36,32 @@ resource "aws_lambda_function" "auto_scaling_lambda" {
   source_code_hash = filebase64sha256(data.archive_file.aws_lambda_code.output_path)
 
   environment {
-    variables = {
-      TARGET_SUBNETS           = jsonencode({ for subnet in data.aws_subnet.management_subnets : subnet.availability_zone => subnet.id })
+    variables = merge({
+      TARGET_SUBNETS           = jsonencode({ for subnet in data.aws_subnet.management_subnets : subnet.availability_zone => subnet.id... })
       TARGET_SECURITY_GROUP_ID = aws_security_group.management.id
-    }
+      MAX_CONCURRENCY          = var.lambda_max_concurrency
+      ENI_WARM_POOL_SIZE       = var.eni_warm_pool_size
+      ENI_WARM_POOL_TTL        = var.eni_warm_pool_ttl
+      ATTACHMENT_WAIT_TIMEOUT  = var.lambda_attachment_wait_timeout
+      METRICS_ENABLED          = var.lambda_metrics_enabled
+      METRICS_NAMESPACE        = var.lambda_metrics_namespace
+      IDEMPOTENCY_TABLE_NAME   = try(aws_dynamodb_table.lifecycle_event_idempotency[0].name, "")
+      ORPHAN_MIN_AGE           = var.orphaned_interface_min_age
+      ORPHAN_DELETE_BATCH_SIZE = var.orphaned_interface_delete_batch_size
+      ORPHAN_DELETE_RATE       = var.orphaned_interface_delete_rate
+      SUBNET_CAPACITY_TTL      = var.lambda_subnet_capacity_ttl
+      TRUST_EVENT_DATA         = var.lambda_trust_event_data
+      MONITORING_SUBNETS       = jsonencode({ for subnet in data.aws_subnet.monitoring_subnets : subnet.id => subnet.availability_zone })
+      ASYNC_PIPELINE           = var.lambda_async_pipeline
+      LIFECYCLE_HOOK_TIMEOUT   = var.asg_lifecycle_hook_timeout
+      TARGET_VPC_ID            = data.aws_vpc.provided.id
+      PREFLIGHT_TTL            = var.lambda_preflight_ttl
+      FLEETS                   = jsonencode(var.lambda_additional_fleets)
+      LIFECYCLE_HOOK_NAMES     = jsonencode(local.lifecycle_hook_names)
+      TRACE_ENABLED            = var.lambda_trace_enabled
+      TRACE_OTLP_ENDPOINT      = var.lambda_trace_otlp_endpoint
+      # Trimmed service models shipped in an optimized payload are found before the runtime's botocore models
+    }, var.lambda_payload_dir == "" ? {} : { AWS_DATA_PATH = "/var/task/data" })
   }
 
   tags = var.tags
@@ -28,7 +73,8 @@ resource "aws_lambda_function" "auto_scaling_lambda" {
 
 data "archive_file" "aws_lambda_code" {
   output_path = "lambda_payload.zip"
-  source_file = "${path.module}/scripts/${local.script_name}"
+  source_file = var.lambda_payload_dir == "" ? "${path.module}/scripts/${local.script_name}" : null
+  source_dir  = var.lambda_payload_dir == "" ? null : var.lambda_payload_dir
   type        = "zip"
 }
 
@@ -36,10 +82,13 @@ resource "aws_cloudwatch_event_rule" "asg_lifecycle_rule" {
   name = var.eventbridge_lifecycle_rule_name
   event_pattern = jsonencode({
     "source" : ["aws.autoscaling"],
-    "detail-type" : ["EC2 Instance-launch Lifecycle Action"],
+    "detail-type" : concat(
+      ["EC2 Instance-launch Lifecycle Action"],
+      var.asg_terminate_lifecycle_hook_enabled ? ["EC2 Instance-terminate Lifecycle Action"] : []
+    ),
     "detail" : {
-      "AutoScalingGroupName" : [var.sensor_asg_name],
-      "LifecycleHookName" : [var.asg_lifecycle_hook_name]
+      "AutoScalingGroupName" : concat([var.sensor_asg_name], keys(var.lambda_additional_fleets)),
+      "LifecycleHookName" : local.rule_lifecycle_hook_names
     }
   })
 
@@ -54,13 +103,202 @@ resource "aws_cloudwatch_log_group" "log_group" {
 }
 
 resource "aws_cloudwatch_event_target" "ec2_state_change_rule_lambda_target" {
+  count = local.lifecycle_event_target_enabled && !var.lifecycle_event_batching_enabled ? 1 : 0
+
   arn  = aws_lambda_function.auto_scaling_lambda.arn
   rule = aws_cloudwatch_event_rule.asg_lifecycle_rule.name
 }
 
 resource "aws_lambda_permission" "ec2_state_change_event_bridge_trigger_permission" {
+  count = local.lifecycle_event_target_enabled && !var.lifecycle_event_batching_enabled ? 1 : 0
+
   action        = "lambda:InvokeFunction"
   function_name = aws_lambda_function.auto_scaling_lambda.function_name
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.asg_lifecycle_rule.arn
 }
+
+moved {
+  from = aws_cloudwatch_event_target.ec2_state_change_rule_lambda_target
+  to   = aws_cloudwatch_event_target.ec2_state_change_rule_lambda_target[0]
+}
+
+moved {
+  from = aws_lambda_permission.ec2_state_change_event_bridge_trigger_permission
+  to   = aws_lambda_permission.ec2_state_change_event_bridge_trigger_permission[0]
+}
+
+# Scheduled sweep deleting managed interfaces left behind by invocations that timed out before cleaning up
+resource "aws_cloudwatch_event_rule" "orphaned_interface_sweep_rule" {
+  count = var.orphaned_interface_sweep_enabled ? 1 : 0
+
+  name                = "${var.lambda_function_name}-orphaned-interface-sweep"
+  schedule_expression = var.orphaned_interface_sweep_schedule
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "orphaned_interface_sweep_target" {
+  count = var.orphaned_interface_sweep_enabled ? 1 : 0
+
+  arn   = aws_lambda_function.auto_scaling_lambda.arn
+  rule  = aws_cloudwatch_event_rule.orphaned_interface_sweep_rule[0].name
+  input = jsonencode({ action = "sweep_orphaned_interfaces" })
+}
+
+resource "aws_lambda_permission" "orphaned_interface_sweep_trigger_permission" {
+  count = var.orphaned_interface_sweep_enabled ? 1 : 0
+
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.auto_scaling_lambda.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.orphaned_interface_sweep_rule[0].arn
+}
+
+# Optional SQS queue between EventBridge and the Lambda so lifecycle events from a burst scale-out
+# are processed in batches rather than one invocation per instance
+resource "aws_sqs_queue" "lifecycle_event_dlq" {
+  count = var.lifecycle_event_batching_enabled ? 1 : 0
+
+  name                    = "${var.lifecycle_event_queue_name}-dlq"
+  sqs_managed_sse_enabled = true
+
+  tags = var.tags
+}
+
+resource "aws_sqs_queue" "lifecycle_event_queue" {
+  count = var.lifecycle_event_batching_enabled ? 1 : 0
+
+  name                       = var.lifecycle_event_queue_name
+  visibility_timeout_seconds = aws_lambda_function.auto_scaling_lambda.timeout * 2
+  sqs_managed_sse_enabled    = true
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.lifecycle_event_dlq[0].arn
+    maxReceiveCount     = 3
+  })
+
+  tags = var.tags
+}
+
+data "aws_iam_policy_document" "lifecycle_event_queue_policy" {
+  count = var.lifecycle_event_batching_enabled ? 1 : 0
+
+  statement {
+    effect    = "Allow"
+    actions   = ["sqs:SendMessage"]
+    resources = [aws_sqs_queue.lifecycle_event_queue[0].arn]
+    principals {
+      identifiers = ["events.amazonaws.com"]
+      type        = "Service"
+    }
+    condition {
+      test     = "ArnEquals"
+      values   = [aws_cloudwatch_event_rule.asg_lifecycle_rule.arn]
+      variable = "aws:SourceArn"
+    }
+  }
+}
+
+resource "aws_sqs_queue_policy" "lifecycle_event_queue_policy" {
+  count = var.lifecycle_event_batching_enabled ? 1 : 0
+
+  queue_url = aws_sqs_queue.lifecycle_event_queue[0].id
+  policy    = data.aws_iam_policy_document.lifecycle_event_queue_policy[0].json
+}
+
+resource "aws_cloudwatch_event_target" "asg_lifecycle_rule_queue_target" {
+  count = local.lifecycle_event_target_enabled && var.lifecycle_event_batching_enabled ? 1 : 0
+
+  arn  = aws_sqs_queue.lifecycle_event_queue[0].arn
+  rule = aws_cloudwatch_event_rule.asg_lifecycle_rule.name
+}
+
+resource "aws_lambda_event_source_mapping" "lifecycle_event_queue_mapping" {
+  count = var.lifecycle_event_batching_enabled ? 1 : 0
+
+  event_source_arn                   = aws_sqs_queue.lifecycle_event_queue[0].arn
+  function_name                      = aws_lambda_function.auto_scaling_lambda.arn
+  batch_size                         = var.lifecycle_event_batch_size
+  maximum_batching_window_in_seconds = var.lifecycle_event_batch_window
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
+# Optional table shared by every Lambda container so replayed lifecycle events are only processed once
+resource "aws_dynamodb_table" "lifecycle_event_idempotency" {
+  count = var.lambda_idempotency_table_enabled ? 1 : 0
+
+  name         = var.lambda_idempotency_table_name
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "token"
+
+  attribute {
+    name = "token"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  server_side_encryption {
+    enabled = true
+  }
+
+  point_in_time_recovery {
+    enabled = true
+  }
+
+  tags = var.tags
+}
+
+resource "awscc_cloudwatch_alarm" "nic_manager_launch_to_continue_latency_alarm" {
+  count = var.lambda_latency_alarms_enabled ? 1 : 0
+
+  alarm_name          = "${var.lambda_function_name}-launch-to-continue-p95"
+  alarm_description   = "p95 time from sensor launch to the lifecycle action being continued"
+  namespace           = var.lambda_metrics_namespace
+  metric_name         = "LaunchToContinueLatency"
+  extended_statistic  = "p95"
+  threshold           = var.lambda_launch_to_continue_p95_threshold
+  comparison_operator = "GreaterThanThreshold"
+  evaluation_periods  = 1
+  period              = 300
+  treat_missing_data  = "notBreaching"
+  alarm_actions       = var.lambda_latency_alarm_actions
+  dimensions = [
+    {
+      name  = "AutoScalingGroupName"
+      value = var.sensor_asg_name
+    }
+  ]
+
+  lifecycle {
+    precondition {
+      condition     = var.lambda_metrics_enabled
+      error_message = "lambda_metrics_enabled must be true when lambda_latency_alarms_enabled is true."
+    }
+  }
+}
+
+resource "awscc_cloudwatch_alarm" "nic_manager_aws_call_latency_alarm" {
+  for_each = var.lambda_latency_alarms_enabled ? toset(local.nic_manager_alarm_operations) : toset([])
+
+  alarm_name          = "${var.lambda_function_name}-${each.value}-p95"
+  alarm_description   = "p95 latency of ${each.value} call attempts made by the ENI management lambda"
+  namespace           = var.lambda_metrics_namespace
+  metric_name         = "AwsCallLatency"
+  extended_statistic  = "p95"
+  threshold           = var.lambda_aws_call_p95_threshold
+  comparison_operator = "GreaterThanThreshold"
+  evaluation_periods  = 1
+  period              = 300
+  treat_missing_data  = "notBreaching"
+  alarm_actions       = var.lambda_latency_alarm_actions
+  dimensions = [
+    {
+      name  = "Operation"
+      value = each.value
+    }
+  ]
+}
@@ -34,6 +34,15 @@ resource "aws_launch_template" "sensor_launch_template" {
     }
   }
 
+  # One minute EC2 metrics, the traffic metrics publisher fits its trend over per-minute packet counts
+  dynamic "monitoring" {
+    for_each = var.traffic_metrics_publisher_enabled ? toset([1]) : toset([])
+
+    content {
+      enabled = true
+    }
+  }
+
   network_interfaces {
     device_index          = 0
     security_groups       = [aws_security_group.monitoring.id]
@@ -1,5 +1,9 @@
 data "aws_partition" "current" {}
 
+locals {
+  sensor_autoscaling_group_arns = concat([var.sensor_autoscaling_group_arn], var.additional_sensor_autoscaling_group_arns)
+}
+
 data "aws_iam_policy_document" "lambda_nic_manager_policy" {
   statement {
     effect = "Allow"
@@ -18,6 +22,7 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
       "ec2:DescribeNetworkInterfaces",
       "ec2:DescribeInstances",
       "ec2:DescribeSubnets",
+      "ec2:DescribeSecurityGroups",
       "autoscaling:DescribeAutoScalingGroups"
     ]
     resources = ["*"]
@@ -26,17 +31,17 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
   statement {
     effect = "Allow"
     actions = [
-      "autoscaling:CompleteLifecycleAction"
-    ]
-    resources = [
-      var.sensor_autoscaling_group_arn
+      "autoscaling:CompleteLifecycleAction",
+      "autoscaling:RecordLifecycleActionHeartbeat"
     ]
+    resources = local.sensor_autoscaling_group_arns
   }
 
   statement {
     effect = "Allow"
     actions = [
       "ec2:AttachNetworkInterface",
+      "ec2:DetachNetworkInterface",
       "ec2:ModifyNetworkInterfaceAttribute",
     ]
     resources = [
@@ -44,7 +49,7 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
     ]
     condition {
       test     = "StringEquals"
-      values   = [split("/", var.sensor_autoscaling_group_arn)[1]]
+      values   = [for arn in local.sensor_autoscaling_group_arns : split("/", arn)[1]]
       variable = "aws:ResourceTag/aws:autoscaling:groupName"
     }
   }
@@ -56,6 +61,7 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
       "ec2:DeleteNetworkInterface",
       "ec2:AttachNetworkInterface",
       "ec2:ModifyNetworkInterfaceAttribute",
+      "ec2:DeleteTags",
     ]
     resources = [
       "arn:${data.aws_partition.current.partition}:ec2:*:*:network-interface/*"
@@ -67,6 +73,31 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
     }
   }
 
+  dynamic "statement" {
+    for_each = var.lifecycle_event_queue_arn == "" ? [] : [var.lifecycle_event_queue_arn]
+    content {
+      effect = "Allow"
+      actions = [
+        "sqs:ReceiveMessage",
+        "sqs:DeleteMessage",
+        "sqs:GetQueueAttributes"
+      ]
+      resources = [statement.value]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = var.idempotency_table_arn == "" ? [] : [var.idempotency_table_arn]
+    content {
+      effect = "Allow"
+      actions = [
+        "dynamodb:PutItem",
+        "dynamodb:DeleteItem"
+      ]
+      resources = [statement.value]
+    }
+  }
+
   statement {
     effect = "Allow"
     actions = [
@@ -75,10 +106,10 @@ data "aws_iam_policy_document" "lambda_nic_manager_policy" {
     ]
     resources = concat(
       var.subnet_arns,
-      [
-        var.security_group_arn,
-        "arn:${data.aws_partition.current.partition}:ec2:*:*:network-interface/*"
-      ]
+      var.additional_subnet_arns,
+      [var.security_group_arn],
+      var.additional_security_group_arns,
+      ["arn:${data.aws_partition.current.partition}:ec2:*:*:network-interface/*"]
     )
   }
 }
@@ -9,7 +9,7 @@ variable "sensor_autoscaling_group_arn" {
 }
 
 variable "subnet_arns" {
-  description = "ARNs of the subnets where new ENIs should be created (management), one per availability zone"
+  description = "ARNs of the subnets where new ENIs should be created (management), at least one per availability zone"
   type        = list(string)
 }
 
@@ -18,6 +18,24 @@ variable "security_group_arn" {
   type        = string
 }
 
+variable "additional_sensor_autoscaling_group_arns" {
+  description = "(optional) ARNs of the other sensor autoscaling groups the Lambda handles, see lambda_additional_fleets of the sensor module"
+  type        = list(string)
+  default     = []
+}
+
+variable "additional_subnet_arns" {
+  description = "(optional) ARNs of the management subnets of the other sensor autoscaling groups the Lambda handles"
+  type        = list(string)
+  default     = []
+}
+
+variable "additional_security_group_arns" {
+  description = "(optional) ARNs of the management security groups of the other sensor autoscaling groups the Lambda handles"
+  type        = list(string)
+  default     = []
+}
+
 variable "lambda_role_name" {
   description = "Name of the ENI management lambda role"
   type        = string
@@ -25,6 +43,18 @@ variable "lambda_role_name" {
 }
 
 # Variables with defaults
+variable "lifecycle_event_queue_arn" {
+  description = "(optional) ARN of the SQS queue buffering lifecycle events when the sensor module has batching enabled"
+  type        = string
+  default     = ""
+}
+
+variable "idempotency_table_arn" {
+  description = "(optional) ARN of the DynamoDB table used to deduplicate lifecycle events when the sensor module has it enabled"
+  type        = string
+  default     = ""
+}
+
 variable "lambda_policy_name" {
   description = "Name of the policy granting permission to the ENI management lambda"
   type        = string
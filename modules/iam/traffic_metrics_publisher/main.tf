@@ -0,0 +1,51 @@
+data "aws_iam_policy_document" "traffic_metrics_publisher_policy" {
+  statement {
+    effect = "Allow"
+    actions = [
+      "logs:CreateLogStream",
+      "logs:PutLogEvents"
+    ]
+    resources = [
+      "${var.traffic_metrics_publisher_log_group_arn}:*"
+    ]
+  }
+
+  # GetMetricData does not support resource level permissions. Metrics are published as Embedded Metric Format
+  # records through the log group, so PutMetricData is not needed
+  statement {
+    effect = "Allow"
+    actions = [
+      "cloudwatch:GetMetricData"
+    ]
+    resources = ["*"]
+  }
+}
+
+resource "aws_iam_policy" "traffic_metrics_publisher_policy" {
+  name   = var.policy_name
+  policy = data.aws_iam_policy_document.traffic_metrics_publisher_policy.json
+
+  tags = var.tags
+}
+
+data "aws_iam_policy_document" "traffic_metrics_publisher_assume_role_policy" {
+  statement {
+    effect  = "Allow"
+    actions = ["sts:AssumeRole"]
+    principals {
+      identifiers = ["lambda.amazonaws.com"]
+      type        = "Service"
+    }
+  }
+}
+
+resource "aws_iam_role" "traffic_metrics_publisher_role" {
+  name               = var.role_name
+  assume_role_policy = data.aws_iam_policy_document.traffic_metrics_publisher_assume_role_policy.json
+  tags               = var.tags
+}
+
+resource "aws_iam_role_policy_attachment" "traffic_metrics_publisher_attach" {
+  policy_arn = aws_iam_policy.traffic_metrics_publisher_policy.arn
+  role       = aws_iam_role.traffic_metrics_publisher_role.name
+}
@@ -0,0 +1,11 @@
+output "role_arn" {
+  value = aws_iam_role.traffic_metrics_publisher_role.arn
+}
+
+output "role_name" {
+  value = aws_iam_role.traffic_metrics_publisher_role.name
+}
+
+output "policy_arn" {
+  value = aws_iam_policy.traffic_metrics_publisher_policy.arn
+}
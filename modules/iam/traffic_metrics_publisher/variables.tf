@@ -0,0 +1,23 @@
+variable "traffic_metrics_publisher_log_group_arn" {
+  description = "ARN of the log group the traffic metrics publisher Lambda will use to create streams and write logs"
+  type        = string
+}
+
+# Variables with defaults
+variable "role_name" {
+  description = "Name of the traffic metrics publisher lambda role"
+  type        = string
+  default     = "corelight-sensor-traffic-metrics-publisher-lambda-role"
+}
+
+variable "policy_name" {
+  description = "Name of the policy granting permission to the traffic metrics publisher lambda"
+  type        = string
+  default     = "corelight-sensor-traffic-metrics-publisher-lambda-policy"
+}
+
+variable "tags" {
+  description = "(optional) Any tags that should be applied to resources deployed by the module"
+  type        = object({})
+  default     = {}
+}
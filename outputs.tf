@@ -50,6 +50,18 @@ output "cloudwatch_log_group_arn" {
   value = aws_cloudwatch_log_group.log_group.arn
 }
 
+output "traffic_metrics_publisher_log_group_arn" {
+  value = try(aws_cloudwatch_log_group.traffic_metrics_publisher_log_group[0].arn, "")
+}
+
+output "lifecycle_event_queue_arn" {
+  value = try(aws_sqs_queue.lifecycle_event_queue[0].arn, "")
+}
+
+output "lifecycle_event_idempotency_table_arn" {
+  value = try(aws_dynamodb_table.lifecycle_event_idempotency[0].arn, "")
+}
+
 output "vpc_endpoint_service_name" {
   value = aws_vpc_endpoint_service.gwlb_service.service_name
 }
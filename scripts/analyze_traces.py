@@ -0,0 +1,186 @@
+"""
+Aggregates the lifecycle event traces written by the NIC manager Lambda with `lambda_trace_enabled` into per-step
+latency histograms.
+
+Each step's time is split into the time its EC2 / Auto Scaling calls took, as measured around the HTTP request, and
+the rest, spent in the Lambda itself: retry backoff, rate limiting, polling delays and our own code. A slow step with
+most of its time in AWS calls points at the control plane, one with most of it outside them at the Lambda.
+
+Input is any text holding one trace per line, e.g. the Lambda's log group exported with
+
+    aws logs filter-log-events --log-group-name /aws/lambda/<function> --filter-pattern '{ $.trace = "lifecycle_event" }' \\
+        --query 'events[].message' --output text | tr '\\t' '\\n' > traces.jsonl
+    python scripts/analyze_traces.py traces.jsonl
+"""
+import argparse
+import bisect
+import json
+import math
+import sys
+from collections import defaultdict
+from typing import Iterable, Iterator, List, Optional
+
+from corelight_sensor_asg_nic_manager import TRACE_RECORD_TYPE
+
+# Upper bounds in milliseconds of the histogram buckets, the last bucket is unbounded
+HISTOGRAM_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+HISTOGRAM_WIDTH = 40
+
+
+def read_traces(lines: Iterable[str], autoscaling_group_name: Optional[str] = None) -> Iterator[dict]:
+    # Log lines may carry a timestamp and request ID before the record, anything that is not a trace is skipped
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(record, dict) or record.get("trace") != TRACE_RECORD_TYPE:
+            continue
+        if autoscaling_group_name and record.get("autoscaling_group_name") != autoscaling_group_name:
+            continue
+        yield record
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    # Nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: List[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+def histogram(values: List[float]) -> List[int]:
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for value in values:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+    return counts
+
+
+def aggregate(traces: Iterable[dict]) -> dict:
+    steps = defaultdict(lambda: {"total": [], "aws": [], "lambda": []})
+    operations = defaultdict(lambda: {"latency": [], "errors": 0, "retries": 0})
+    events = {"count": 0, "duration": [], "actions": defaultdict(int)}
+
+    def add_call(call: dict):
+        operation = operations[call["operation"]]
+        operation["latency"].append(call["latency_ms"])
+        operation["errors"] += call["outcome"] != "Success"
+        operation["retries"] += call.get("retries", 0)
+
+    for trace in traces:
+        events["count"] += 1
+        events["duration"].append(trace["duration_ms"])
+        events["actions"]["DUPLICATE" if trace.get("duplicate") else trace.get("action") or "NONE"] += 1
+        for call in trace.get("calls", []):
+            add_call(call)
+        for span in trace.get("spans", []):
+            aws_ms = sum(call["latency_ms"] for call in span.get("calls", []))
+            step = steps[span["name"]]
+            step["total"].append(span["duration_ms"])
+            step["aws"].append(aws_ms)
+            # Calls running in parallel within a step can add up to more than its duration
+            step["lambda"].append(max(0.0, span["duration_ms"] - aws_ms))
+            for call in span.get("calls", []):
+                add_call(call)
+
+    return {
+        "events": {
+            "count": events["count"],
+            "duration_ms": summarize(events["duration"]),
+            "actions": dict(events["actions"]),
+        },
+        "steps": {
+            name: {
+                "total_ms": summarize(step["total"]),
+                "aws_ms": summarize(step["aws"]),
+                "lambda_ms": summarize(step["lambda"]),
+                "aws_share": round(sum(step["aws"]) / sum(step["total"]), 3) if sum(step["total"]) else 0.0,
+                "histogram": histogram(step["total"]),
+            }
+            for name, step in steps.items()
+        },
+        "operations": {
+            name: {
+                "latency_ms": summarize(operation["latency"]),
+                "errors": operation["errors"],
+                "retries": operation["retries"],
+            }
+            for name, operation in operations.items()
+        },
+    }
+
+
+def bucket_label(index: int) -> str:
+    if index == len(HISTOGRAM_BUCKETS):
+        return f">{HISTOGRAM_BUCKETS[-1]}ms"
+    return f"<={HISTOGRAM_BUCKETS[index]}ms"
+
+
+def format_report(report: dict) -> str:
+    events = report["events"]
+    lines = [
+        f"{events['count']} events, p50 {events['duration_ms']['p50']:.0f}ms p99 {events['duration_ms']['p99']:.0f}ms, "
+        + " ".join(f"{action}={count}" for action, count in sorted(events["actions"].items())),
+        "",
+        f"{'step':<28} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'aws p50':>9} {'lambda p50':>11} "
+        f"{'aws share':>9}",
+    ]
+    for name, step in report["steps"].items():
+        total = step["total_ms"]
+        lines.append(
+            f"{name:<28} {total['count']:>6} {total['p50']:>9.1f} {total['p90']:>9.1f} {total['p99']:>9.1f} "
+            f"{total['max']:>9.1f} {step['aws_ms']['p50']:>9.1f} {step['lambda_ms']['p50']:>11.1f} "
+            f"{step['aws_share']:>9.0%}"
+        )
+
+    for name, step in report["steps"].items():
+        lines.extend(["", name])
+        peak = max(step["histogram"]) or 1
+        for index, count in enumerate(step["histogram"]):
+            lines.append(f"  {bucket_label(index):>10} {count:>6} {'#' * round(count / peak * HISTOGRAM_WIDTH)}")
+
+    lines.extend(["", f"{'operation':<36} {'calls':>6} {'p50':>9} {'p99':>9} {'errors':>7} {'retries':>8}"])
+    for name, operation in sorted(report["operations"].items()):
+        latency = operation["latency_ms"]
+        lines.append(
+            f"{name:<36} {latency['count']:>6} {latency['p50']:>9.1f} {latency['p99']:>9.1f} "
+            f"{operation['errors']:>7} {operation['retries']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=["-"], help="Files holding trace lines, - or none reads stdin")
+    parser.add_argument("--group", help="Only aggregate the events of this autoscaling group")
+    parser.add_argument("--json", action="store_true", help="Print the aggregates as JSON")
+    args = parser.parse_args(argv)
+
+    traces = []
+    for path in args.files:
+        if path == "-":
+            traces.extend(read_traces(sys.stdin, args.group))
+        else:
+            with open(path) as fh:
+                traces.extend(read_traces(fh, args.group))
+
+    report = aggregate(traces)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0 if traces else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+"""
+Drives lambda_handler with a burst of synthetic launch lifecycle events against an in-process EC2 / Auto Scaling fake,
+and reports throughput, latency from launch to CONTINUE and the API calls made.
+
+Events are built from tests/test_data/event.json. In `invoke` mode every event is its own invocation, as delivered by
+EventBridge, and up to --lambda-concurrency invocations run at once. In `sqs` mode events are delivered in batches of
+--batch-size SQS records.
+
+    python scripts/benchmarks/bench_burst_scale_out.py --instances 50 --latency 0.05 --jitter 0.05 --throttle-rate 0.05
+"""
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, SCRIPTS_DIR)
+TEST_DATA_DIR = os.path.join(SCRIPTS_DIR, "tests", "test_data")
+
+import corelight_sensor_asg_nic_manager as nic_manager  # noqa: E402
+from benchmarks.fake_aws import FakeAws, FakeAwsProfile  # noqa: E402
+
+
+class LambdaContext:
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.expires_at - time.monotonic()) * 1000)
+
+
+def synthetic_events(instance_ids: list) -> list:
+    with open(os.path.join(TEST_DATA_DIR, "event.json")) as fh:
+        template = json.load(fh)
+
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    events = []
+    for instance_id in instance_ids:
+        event = copy.deepcopy(template)
+        event["id"] = str(uuid.uuid4())
+        event["time"] = now
+        event["detail"]["EC2InstanceId"] = instance_id
+        event["detail"]["LifecycleActionToken"] = str(uuid.uuid4())
+        events.append(event)
+    return events
+
+
+def invoke(event, timeout: float):
+    try:
+        return nic_manager.lambda_handler(event, LambdaContext(timeout))
+    except Exception as e:
+        # A failed invocation is retried by EventBridge in production, here it only shows up as a missing CONTINUE
+        return e
+
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else float("nan")
+
+
+def run(
+        instances: int = 50,
+        mode: str = "invoke",
+        lambda_concurrency: int = 50,
+        batch_size: int = 10,
+        timeout: float = 30.0,
+        profile: FakeAwsProfile = None,
+        seed: int = None,
+        subnets: dict = None,
+        environment: dict = None
+) -> dict:
+    # subnets maps an AZ to its management subnets, environment holds extra Lambda environment variables
+    profile = profile or FakeAwsProfile()
+    fake = FakeAws(profile, subnets or {"us-east-1a": ["subnet-a"], "us-east-1b": ["subnet-b"]}, seed=seed)
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault(nic_manager.EnvironmentVariables.METRICS_ENABLED.value, "false")
+    os.environ.update(environment or {})
+    os.environ[nic_manager.EnvironmentVariables.TARGET_SUBNETS.value] = json.dumps(fake.subnets)
+    os.environ[nic_manager.EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value] = "sg-12345"
+    nic_manager.reset_runtime_context()
+    runtime_context = nic_manager.get_runtime_context()
+    fake.attach(runtime_context.aws_client.ec2_client, runtime_context.aws_client.asg_client)
+
+    events = synthetic_events(fake.launch(instances))
+    if mode == "sqs":
+        payloads = [
+            {"Records": [{"messageId": str(uuid.uuid4()), "body": json.dumps(event)} for event in events[i:i + batch_size]]}
+            for i in range(0, len(events), batch_size)
+        ]
+    else:
+        payloads = events
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=lambda_concurrency) as executor:
+        responses = list(executor.map(lambda payload: invoke(payload, timeout), payloads))
+    elapsed = time.monotonic() - start
+
+    continued = [at - start for action, at in fake.lifecycle_actions.values() if action == "CONTINUE"]
+    return {
+        "instances": instances,
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "continued": len(continued),
+        "abandoned": sum(1 for action, _ in fake.lifecycle_actions.values() if action == "ABANDON"),
+        "incomplete": instances - len(fake.lifecycle_actions),
+        "failed_invocations": sum(1 for response in responses if isinstance(response, Exception)),
+        "throughput_per_s": round(len(continued) / elapsed, 3) if elapsed else None,
+        "latency_to_continue_p50_ms": round(statistics.median(continued) * 1000, 3) if continued else None,
+        "latency_to_continue_p99_ms": round(percentile(continued, 0.99) * 1000, 3) if continued else None,
+        **fake.summary()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--mode", choices=["invoke", "sqs"], default="invoke")
+    parser.add_argument("--lambda-concurrency", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Lambda timeout in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds added on top of --latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability a call is throttled")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability a call fails with --error-code")
+    parser.add_argument("--error-code", default="InternalError")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Calls per second per operation, 0 is unlimited")
+    parser.add_argument("--fault-operations", nargs="*", default=[],
+                        help="API operations (e.g. CreateNetworkInterface) to inject faults into, all when omitted")
+    parser.add_argument("--attachment-delay", type=float, default=0.0, help="Seconds an attachment stays `attaching`")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--async-pipeline", action="store_true", help="Handle events with AsyncLifecycleEventService")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    nic_manager.logging.disable(nic_manager.logging.CRITICAL)
+    report = run(
+        instances=args.instances,
+        mode=args.mode,
+        lambda_concurrency=args.lambda_concurrency,
+        batch_size=args.batch_size,
+        timeout=args.timeout,
+        profile=FakeAwsProfile(
+            latency=args.latency,
+            jitter=args.jitter,
+            throttle_rate=args.throttle_rate,
+            error_rate=args.error_rate,
+            error_code=args.error_code,
+            rate_limit=args.rate_limit,
+            attachment_delay=args.attachment_delay,
+            fault_operations=tuple(args.fault_operations)
+        ),
+        seed=args.seed,
+        environment={nic_manager.EnvironmentVariables.ASYNC_PIPELINE.value: str(args.async_pipeline).lower()}
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['instances']} instances ({report['mode']}) in {report['elapsed_s']}s: "
+          f"{report['continued']} continued, {report['abandoned']} abandoned, {report['incomplete']} incomplete")
+    print(f"throughput: {report['throughput_per_s']} instances/s")
+    print(f"launch to CONTINUE: p50={report['latency_to_continue_p50_ms']}ms p99={report['latency_to_continue_p99_ms']}ms")
+    for operation, count in sorted(report["calls"].items()):
+        print(f"  {operation:<36} calls={count:<5} throttled={report['throttled'].get(operation, 0):<5} "
+              f"errors={report['errors'].get(operation, 0)}")
+
+
+if __name__ == "__main__":
+    main()
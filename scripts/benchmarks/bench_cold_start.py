@@ -0,0 +1,116 @@
+"""
+Measures what a cold start pays before the first event is handled: importing the script, and the init duration of
+importing it and building the runtime context with its EC2 / Auto Scaling clients.
+
+Every sample is a fresh interpreter importing from a fresh directory. That directory has no __pycache__, like the
+read-only /var/task of a Lambda. Variants:
+
+    source      the script as archived by default
+    optimized   the payload of build_lambda_payload.py with trimmed service models on AWS_DATA_PATH, compiled to a
+                .pyc when this is the Lambda's Python version
+    before      the script at --before REV, for comparing with an earlier commit
+
+    python scripts/benchmarks/bench_cold_start.py --samples 20 --before HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import build_lambda_payload  # noqa: E402
+
+SAMPLE = """
+import json, time
+start = time.perf_counter()
+import corelight_sensor_asg_nic_manager as nic_manager
+imported = time.perf_counter()
+nic_manager.get_runtime_context()
+initialized = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "init_ms": (initialized - start) * 1000}))
+"""
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "TARGET_SUBNETS": json.dumps({"us-east-1a": "subnet-a"}),
+    "TARGET_SECURITY_GROUP_ID": "sg-12345",
+    "METRICS_ENABLED": "false",
+}
+
+
+def sample(payload_dir: str, data_path: str = "") -> dict:
+    environment = {key: value for key, value in os.environ.items() if not key.startswith("AWS_")}
+    environment.update(ENVIRONMENT, AWS_DATA_PATH=data_path)
+    output = subprocess.run(
+        [sys.executable, "-B", "-c", SAMPLE], cwd=payload_dir, env=environment, capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(payload_dir: str, samples: int, data_path: str = "") -> dict:
+    results = [sample(payload_dir, data_path) for _ in range(samples)]
+    return {
+        metric: round(statistics.median(result[metric] for result in results), 1)
+        for metric in ("import_ms", "init_ms")
+    }
+
+
+def run(samples: int = 10, before: str = None) -> dict:
+    compile_script = "%d.%d" % sys.version_info[:2] == build_lambda_payload.LAMBDA_PYTHON_VERSION
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        payloads = {}
+        if before:
+            payloads["before"] = os.path.join(workdir, "before")
+            os.makedirs(payloads["before"])
+            source = subprocess.run(
+                ["git", "show", f"{before}:scripts/{build_lambda_payload.SCRIPT_NAME}.py"],
+                cwd=SCRIPTS_DIR, capture_output=True, check=True, text=True
+            ).stdout
+            with open(os.path.join(payloads["before"], f"{build_lambda_payload.SCRIPT_NAME}.py"), "w") as fh:
+                fh.write(source)
+
+        payloads["source"] = os.path.join(workdir, "source")
+        os.makedirs(payloads["source"])
+        with open(os.path.join(SCRIPTS_DIR, f"{build_lambda_payload.SCRIPT_NAME}.py")) as src, \
+                open(os.path.join(payloads["source"], f"{build_lambda_payload.SCRIPT_NAME}.py"), "w") as dst:
+            dst.write(src.read())
+
+        payloads["optimized"] = os.path.join(workdir, "optimized")
+        build_lambda_payload.build(payloads["optimized"], compile_script)
+
+        for variant, payload_dir in payloads.items():
+            data_path = os.path.join(payload_dir, build_lambda_payload.MODEL_DIR) if variant == "optimized" else ""
+            report[variant] = measure(payload_dir, samples, data_path)
+
+    report["optimized"]["compiled"] = compile_script
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=10, help="Fresh interpreters started per variant")
+    parser.add_argument("--before", default=None, help="Git revision of the script to compare against")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.samples, args.before)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for variant, result in report.items():
+        print(f"{variant:<10} import p50={result['import_ms']}ms init p50={result['init_ms']}ms")
+    if not report["optimized"]["compiled"]:
+        print(f"optimized payload not compiled, run with Python {build_lambda_payload.LAMBDA_PYTHON_VERSION} to include the .pyc")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares launch handling with and without TRUST_EVENT_DATA against the in-process EC2 / Auto Scaling fake.
+
+Invocations run one after the other against a single-AZ fleet, so the mean invocation time shows the latency of the
+describe_instances round trip the fast path skips.
+
+    python scripts/benchmarks/bench_describe_fast_path.py --instances 50 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+import corelight_sensor_asg_nic_manager as nic_manager  # noqa: E402
+from benchmarks import bench_burst_scale_out  # noqa: E402
+from benchmarks.fake_aws import FakeAwsProfile  # noqa: E402
+
+
+def run(instances: int = 50, latency: float = 0.05, seed: int = None) -> dict:
+    report = {}
+    for trust_event_data in (False, True):
+        result = bench_burst_scale_out.run(
+            instances=instances,
+            lambda_concurrency=1,
+            profile=FakeAwsProfile(latency=latency),
+            seed=seed,
+            subnets={"us-east-1a": ["subnet-a"]},
+            environment={
+                nic_manager.EnvironmentVariables.TRUST_EVENT_DATA.value: str(trust_event_data).lower(),
+                nic_manager.EnvironmentVariables.MONITORING_SUBNETS.value: json.dumps({"subnet-monitoring": "us-east-1a"})
+            }
+        )
+        report["trusted" if trust_event_data else "described"] = {
+            "continued": result["continued"],
+            "mean_invocation_ms": round(result["elapsed_s"] * 1000 / instances, 3),
+            "describe_instances_calls": result["calls"].get("DescribeInstances", 0)
+        }
+
+    report["saved_ms_per_invocation"] = round(
+        report["described"]["mean_invocation_ms"] - report["trusted"]["mean_invocation_ms"], 3
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every API call")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    nic_manager.logging.disable(nic_manager.logging.CRITICAL)
+    report = run(args.instances, args.latency, args.seed)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for mode in ("described", "trusted"):
+        print(f"{mode:<10} continued={report[mode]['continued']:<5} "
+              f"mean invocation={report[mode]['mean_invocation_ms']}ms "
+              f"DescribeInstances calls={report[mode]['describe_instances_calls']}")
+    print(f"saved per invocation: {report['saved_ms_per_invocation']}ms")
+
+
+if __name__ == "__main__":
+    main()
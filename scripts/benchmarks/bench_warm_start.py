@@ -0,0 +1,102 @@
+"""
+Compares cold and warm lambda_handler invocation latency using stubbed EC2 / ASG clients.
+
+A cold invocation resets the runtime context, so the botocore session, service models and clients are
+built again. A warm invocation reuses the context built by the previous invocation.
+
+    AWS_DEFAULT_REGION=us-east-1 python scripts/benchmarks/bench_warm_start.py --iterations 50
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+from botocore.stub import Stubber
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, SCRIPTS_DIR)
+TEST_DATA_DIR = os.path.join(SCRIPTS_DIR, "tests", "test_data")
+
+import corelight_sensor_asg_nic_manager as nic_manager  # noqa: E402
+
+
+def load_test_data(name: str) -> dict:
+    with open(os.path.join(TEST_DATA_DIR, name)) as fh:
+        return json.load(fh)
+
+
+def stub_launch(runtime_context: nic_manager.RuntimeContext) -> tuple:
+    ec2_stubber = Stubber(runtime_context.aws_client.ec2_client)
+    asg_stubber = Stubber(runtime_context.aws_client.asg_client)
+    ec2_stubber.add_response("describe_instances", load_test_data("single_nic_instance_describe_response.json"))
+    ec2_stubber.add_response("create_network_interface", load_test_data("nic_create_response.json"))
+    ec2_stubber.add_response("attach_network_interface", {"AttachmentId": "eni-attach-1234567890abcdefg"})
+    ec2_stubber.add_response("describe_network_interfaces", {"NetworkInterfaces": [{
+        "NetworkInterfaceId": "eni-1234567890abcdefg",
+        "Attachment": {"AttachmentId": "eni-attach-1234567890abcdefg", "Status": "attached"}
+    }]})
+    ec2_stubber.add_response("modify_network_interface_attribute", {})
+    asg_stubber.add_response("complete_lifecycle_action", {})
+    ec2_stubber.activate()
+    asg_stubber.activate()
+    return ec2_stubber, asg_stubber
+
+
+def invoke(event: dict, cold: bool) -> float:
+    if cold:
+        nic_manager.reset_runtime_context()
+
+    start = time.perf_counter()
+    runtime_context = nic_manager.get_runtime_context()
+    elapsed = time.perf_counter() - start
+
+    stubbers = stub_launch(runtime_context)
+    # A replayed token would be skipped as a duplicate by warm invocations
+    event = dict(event, detail=dict(event["detail"], LifecycleActionToken=str(uuid.uuid4())))
+    start = time.perf_counter()
+    nic_manager.lambda_handler(event, None)
+    elapsed += time.perf_counter() - start
+
+    for stubber in stubbers:
+        stubber.assert_no_pending_responses()
+        stubber.deactivate()
+
+    return elapsed * 1000
+
+
+def summarize(name: str, samples: list):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:>5}: n={len(samples)} mean={statistics.mean(samples):8.3f}ms "
+          f"p50={statistics.median(samples):8.3f}ms p99={p99:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=25)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault(nic_manager.EnvironmentVariables.METRICS_ENABLED.value, "false")
+    # Only the launch calls are stubbed
+    os.environ.setdefault(nic_manager.EnvironmentVariables.PREFLIGHT_TTL.value, "0")
+    os.environ.setdefault(nic_manager.EnvironmentVariables.TARGET_SUBNETS.value, '{"us-east-1a": "subnet-foo"}')
+    os.environ.setdefault(nic_manager.EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "sg-12345")
+    event = load_test_data("event.json")
+
+    # Keep the handler's INFO logging out of the measurements
+    nic_manager.logging.disable(nic_manager.logging.CRITICAL)
+
+    cold = [invoke(event, cold=True) for _ in range(args.iterations)]
+    warm = [invoke(event, cold=False) for _ in range(args.iterations)]
+
+    summarize("cold", cold)
+    summarize("warm", warm)
+    print(f"warm invocations are {statistics.median(cold) / statistics.median(warm):.1f}x faster (p50)")
+
+
+if __name__ == "__main__":
+    main()
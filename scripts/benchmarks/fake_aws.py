@@ -0,0 +1,342 @@
+"""
+In-process stand-in for the EC2 and Auto Scaling APIs used by the ENI management lambda.
+
+FakeAws answers calls made by real boto3 clients from a `before-call` hook, the same mechanism botocore's Stubber uses,
+so the request still goes through parameter validation and the response through the client's event hooks. It keeps
+just enough state (instances, interfaces, subnets, lifecycle actions) for the lambda's calls to be consistent with
+each other, and can add latency, throttling and errors to every call.
+"""
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from botocore.awsrequest import AWSResponse
+
+PARAMS_CONTEXT_KEY = "fake_aws_params"
+VPC_ID = "vpc-12345"
+
+
+@dataclass
+class FakeAwsProfile:
+    latency: float = 0.0  # Seconds added to every call
+    jitter: float = 0.0  # Up to this many seconds added on top of the latency, uniformly distributed
+    throttle_rate: float = 0.0  # Probability a call fails with RequestLimitExceeded / Throttling
+    error_rate: float = 0.0  # Probability a call fails with error_code
+    error_code: str = "InternalError"
+    rate_limit: float = 0.0  # Calls per second allowed per operation before throttling, 0 is unlimited
+    attachment_delay: float = 0.0  # Seconds an attachment stays `attaching`
+    subnet_capacity: int = 250  # Free addresses in every subnet
+    fault_operations: Tuple[str, ...] = ()  # Operations throttling and errors are injected into, empty means all
+
+
+class FakeApiError(Exception):
+    def __init__(self, code: str, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class OperationRateLimit:
+    # Token bucket holding at most one second of calls, the way EC2 API throttling is documented to behave
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeAws:
+    def __init__(
+            self,
+            profile: Optional[FakeAwsProfile] = None,
+            subnets: Optional[Dict[str, List[str]]] = None,
+            seed: Optional[int] = None
+    ):
+        self.profile = profile or FakeAwsProfile()
+        self.subnets = subnets or {"us-east-1a": ["subnet-foo"]}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.errors = Counter()
+        self.instances = {}
+        self.interfaces = {}
+        self.available_addresses = {
+            subnet_id: self.profile.subnet_capacity for subnet_ids in self.subnets.values() for subnet_id in subnet_ids
+        }
+        self.lifecycle_actions = {}  # Maps instance ID to (LifecycleActionResult, time.monotonic() it was completed)
+        self.call_times = []  # (operation, time.monotonic()) of every call that was answered successfully
+        self._rate_limits = {}
+
+    def attach(self, *clients):
+        for client in clients:
+            client.meta.events.register("before-parameter-build.*.*", self._capture_params)
+            client.meta.events.register("before-call.*.*", self._handle)
+
+    def launch(self, count: int) -> List[str]:
+        availability_zones = list(self.subnets)
+        launched = []
+        with self.lock:
+            for i in range(count):
+                instance_id = f"i-{next(self.ids):017x}"
+                self.instances[instance_id] = {
+                    "InstanceId": instance_id,
+                    "LaunchTime": datetime.now(timezone.utc),
+                    "Placement": {"AvailabilityZone": availability_zones[i % len(availability_zones)]},
+                    "NetworkInterfaces": [self._primary_interface(instance_id)]
+                }
+                launched.append(instance_id)
+        return launched
+
+    def summary(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "throttled": dict(self.throttled),
+            "errors": dict(self.errors),
+            "interfaces": Counter(interface["Status"] for interface in self.interfaces.values())
+        }
+
+    @staticmethod
+    def _capture_params(params: dict, context: dict, **kwargs):
+        context[PARAMS_CONTEXT_KEY] = dict(params)
+
+    def _handle(self, model, context: dict, **kwargs):
+        operation = model.name
+        params = context.get(PARAMS_CONTEXT_KEY, {})
+        delay = self.profile.latency + self.random.uniform(0, self.profile.jitter)
+        if delay:
+            time.sleep(delay)
+
+        with self.lock:
+            self.calls[operation] += 1
+            try:
+                self._inject_failures(operation, model.service_model.service_name)
+                parsed = getattr(self, f"_{operation}")(params)
+                self.call_times.append((operation, time.monotonic()))
+                status_code = 200
+            except FakeApiError as e:
+                parsed = {"Error": {"Code": e.code, "Message": e.message}}
+                status_code = e.status_code
+
+        parsed["ResponseMetadata"] = {"RequestId": str(uuid.uuid4()), "HTTPStatusCode": status_code, "RetryAttempts": 0}
+        return AWSResponse(None, status_code, {}, None), parsed
+
+    def _inject_failures(self, operation: str, service_name: str):
+        if self.profile.fault_operations and operation not in self.profile.fault_operations:
+            return
+        throttle_code = "RequestLimitExceeded" if service_name == "ec2" else "Throttling"
+        if self.profile.rate_limit > 0:
+            limit = self._rate_limits.setdefault(operation, OperationRateLimit(self.profile.rate_limit))
+            if not limit.allow():
+                self.throttled[operation] += 1
+                raise FakeApiError(throttle_code, "Request limit exceeded.", 503)
+        if self.random.random() < self.profile.throttle_rate:
+            self.throttled[operation] += 1
+            raise FakeApiError(throttle_code, "Request limit exceeded.", 503)
+        if self.random.random() < self.profile.error_rate:
+            self.errors[operation] += 1
+            status_code = 500 if self.profile.error_code == "InternalError" else 400
+            raise FakeApiError(self.profile.error_code, "An injected error has occurred", status_code)
+
+    @staticmethod
+    def _primary_interface(instance_id: str) -> dict:
+        return {
+            "NetworkInterfaceId": f"eni-primary-{instance_id}",
+            "SubnetId": "subnet-monitoring",
+            "Groups": [{"GroupId": "sg-monitoring"}],
+            "Attachment": {
+                "AttachmentId": f"eni-attach-primary-{instance_id}",
+                "DeviceIndex": 0,
+                "Status": "attached",
+                "DeleteOnTermination": True
+            }
+        }
+
+    def _interface(self, interface_id: str) -> dict:
+        interface = self.interfaces.get(interface_id)
+        if interface is None:
+            raise FakeApiError("InvalidNetworkInterfaceID.NotFound", f"The networkInterface ID '{interface_id}' does not exist")
+        attachment = interface.get("Attachment")
+        if attachment and attachment["Status"] == "attaching" and time.monotonic() >= attachment["ready_at"]:
+            attachment["Status"] = "attached"
+        return interface
+
+    @staticmethod
+    def _public(interface: dict) -> dict:
+        interface = dict(interface)
+        if "Attachment" in interface:
+            interface["Attachment"] = {k: v for k, v in interface["Attachment"].items() if k != "ready_at"}
+        return interface
+
+    # EC2
+
+    def _DescribeInstances(self, params: dict) -> dict:
+        missing = [instance_id for instance_id in params.get("InstanceIds", []) if instance_id not in self.instances]
+        if missing:
+            raise FakeApiError("InvalidInstanceID.NotFound", f"The instance IDs '{', '.join(missing)}' do not exist")
+
+        instances = []
+        for instance_id in params.get("InstanceIds", []):
+            instance = dict(self.instances[instance_id])
+            instance["NetworkInterfaces"] = instance["NetworkInterfaces"] + [
+                self._public(self._interface(interface["NetworkInterfaceId"]))
+                for interface in self.interfaces.values()
+                if interface.get("Attachment", {}).get("InstanceId") == instance_id
+            ]
+            instances.append(instance)
+        return {"Reservations": [{"Instances": instances}]}
+
+    def _CreateNetworkInterface(self, params: dict) -> dict:
+        subnet_id = params["SubnetId"]
+        if self.available_addresses.get(subnet_id, 0) <= 0:
+            raise FakeApiError("InsufficientFreeAddressesInSubnet", f"There are not enough free addresses in subnet '{subnet_id}'")
+        self.available_addresses[subnet_id] -= 1
+
+        interface_id = f"eni-{next(self.ids):017x}"
+        tags = [tag for spec in params.get("TagSpecifications", []) for tag in spec.get("Tags", [])]
+        self.interfaces[interface_id] = {
+            "NetworkInterfaceId": interface_id,
+            "SubnetId": subnet_id,
+            "Status": "available",
+            "Groups": [{"GroupId": group_id} for group_id in params.get("Groups", [])],
+            "PrivateIpAddresses": [{"PrivateIpAddress": f"10.0.{len(self.interfaces) // 250}.{len(self.interfaces) % 250}"}],
+            "TagSet": tags
+        }
+        return {"NetworkInterface": self._public(self.interfaces[interface_id])}
+
+    def _AttachNetworkInterface(self, params: dict) -> dict:
+        interface = self._interface(params["NetworkInterfaceId"])
+        if params["InstanceId"] not in self.instances:
+            raise FakeApiError("InvalidInstanceID.NotFound", f"The instance ID '{params['InstanceId']}' does not exist")
+        if interface["Status"] != "available":
+            raise FakeApiError("InvalidNetworkInterface.InUse", f"Interface: [{interface['NetworkInterfaceId']}] in use.")
+        if any(other.get("Attachment", {}).get("InstanceId") == params["InstanceId"] and
+               other["Attachment"]["DeviceIndex"] == params["DeviceIndex"] for other in self.interfaces.values()):
+            raise FakeApiError("InvalidParameterValue", f"Instance '{params['InstanceId']}' already has an interface "
+                                                        f"attached at device index '{params['DeviceIndex']}'.")
+
+        attachment_id = f"eni-attach-{next(self.ids):017x}"
+        interface["Status"] = "in-use"
+        interface["Attachment"] = {
+            "AttachmentId": attachment_id,
+            "InstanceId": params["InstanceId"],
+            "DeviceIndex": params["DeviceIndex"],
+            "Status": "attaching" if self.profile.attachment_delay > 0 else "attached",
+            "DeleteOnTermination": False,
+            "ready_at": time.monotonic() + self.profile.attachment_delay
+        }
+        return {"AttachmentId": attachment_id, "NetworkCardIndex": 0}
+
+    def _DescribeNetworkInterfaces(self, params: dict) -> dict:
+        if params.get("NetworkInterfaceIds"):
+            return {"NetworkInterfaces": [
+                self._public(self._interface(interface_id)) for interface_id in params["NetworkInterfaceIds"]
+            ]}
+
+        interfaces = [self._interface(interface_id) for interface_id in list(self.interfaces)]
+        for interface_filter in params.get("Filters", []):
+            name, values = interface_filter["Name"], interface_filter["Values"]
+            if name.startswith("tag:"):
+                key = name[len("tag:"):]
+                interfaces = [i for i in interfaces if any(t["Key"] == key and t["Value"] in values for t in i["TagSet"])]
+            elif name == "tag-key":
+                interfaces = [i for i in interfaces if any(t["Key"] in values for t in i["TagSet"])]
+            elif name == "status":
+                interfaces = [i for i in interfaces if i["Status"] in values]
+            elif name == "subnet-id":
+                interfaces = [i for i in interfaces if i["SubnetId"] in values]
+            elif name == "group-id":
+                interfaces = [i for i in interfaces if any(g["GroupId"] in values for g in i["Groups"])]
+        return {"NetworkInterfaces": [self._public(interface) for interface in interfaces]}
+
+    def _ModifyNetworkInterfaceAttribute(self, params: dict) -> dict:
+        interface = self._interface(params["NetworkInterfaceId"])
+        attachment = params.get("Attachment")
+        if attachment:
+            if interface.get("Attachment", {}).get("AttachmentId") != attachment["AttachmentId"]:
+                raise FakeApiError("InvalidAttachmentID.NotFound", f"The attachment '{attachment['AttachmentId']}' does not exist")
+            interface["Attachment"]["DeleteOnTermination"] = attachment["DeleteOnTermination"]
+        return {}
+
+    def _DetachNetworkInterface(self, params: dict) -> dict:
+        for interface in self.interfaces.values():
+            if interface.get("Attachment", {}).get("AttachmentId") == params["AttachmentId"]:
+                del interface["Attachment"]
+                interface["Status"] = "available"
+                return {}
+        raise FakeApiError("InvalidAttachmentID.NotFound", f"The attachment '{params['AttachmentId']}' does not exist")
+
+    def _DeleteNetworkInterface(self, params: dict) -> dict:
+        interface = self._interface(params["NetworkInterfaceId"])
+        if interface["Status"] != "available":
+            raise FakeApiError("InvalidNetworkInterface.InUse", f"Interface: [{interface['NetworkInterfaceId']}] in use.")
+        del self.interfaces[interface["NetworkInterfaceId"]]
+        self.available_addresses[interface["SubnetId"]] += 1
+        return {}
+
+    def _CreateTags(self, params: dict) -> dict:
+        return {}
+
+    def _DeleteTags(self, params: dict) -> dict:
+        keys = {tag["Key"] for tag in params.get("Tags", [])}
+        for resource_id in params.get("Resources", []):
+            interface = self._interface(resource_id)
+            interface["TagSet"] = [tag for tag in interface["TagSet"] if tag["Key"] not in keys]
+        return {}
+
+    def _DescribeSubnets(self, params: dict) -> dict:
+        # The monitoring subnet every instance launches into is in the first AZ
+        availability_zones = {"subnet-monitoring": next(iter(self.subnets))}
+        availability_zones.update(
+            (subnet_id, availability_zone)
+            for availability_zone, subnet_ids in self.subnets.items() for subnet_id in subnet_ids
+        )
+        if "SubnetIds" in params:
+            subnet_ids = params["SubnetIds"]
+        else:
+            subnet_ids = [
+                subnet_id for f in params.get("Filters", []) if f["Name"] == "subnet-id"
+                for subnet_id in f["Values"] if subnet_id in availability_zones
+            ]
+        return {"Subnets": [
+            {
+                "SubnetId": subnet_id,
+                "AvailabilityZone": availability_zones.get(subnet_id),
+                "VpcId": VPC_ID,
+                "AvailableIpAddressCount": self.available_addresses.get(subnet_id, 0)
+            }
+            for subnet_id in subnet_ids
+        ]}
+
+    def _DescribeSecurityGroups(self, params: dict) -> dict:
+        group_ids = [group_id for f in params.get("Filters", []) if f["Name"] == "group-id" for group_id in f["Values"]]
+        return {"SecurityGroups": [{"GroupId": group_id, "VpcId": VPC_ID} for group_id in group_ids]}
+
+    # Auto Scaling
+
+    def _CompleteLifecycleAction(self, params: dict) -> dict:
+        instance_id = params["InstanceId"]
+        if instance_id in self.lifecycle_actions:
+            raise FakeApiError("ValidationError", f"No active Lifecycle Action found with instance ID {instance_id}")
+        self.lifecycle_actions[instance_id] = (params["LifecycleActionResult"], time.monotonic())
+        return {}
+
+    def _RecordLifecycleActionHeartbeat(self, params: dict) -> dict:
+        return {}
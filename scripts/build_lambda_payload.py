@@ -0,0 +1,140 @@
+"""
+Builds a cold-start optimized Lambda payload directory for `lambda_payload_dir`.
+
+Creating the EC2 client parses the full EC2 service model, by far the largest in botocore, although the Lambda calls
+about ten of its operations. The payload carries trimmed models holding only the operations the script calls, which
+the Lambda finds first through AWS_DATA_PATH. Endpoint rule sets and anything else not in the payload still come from
+the botocore shipped with the runtime.
+
+--compile replaces the script with a sourceless .pyc. It must be built with the Python version of the Lambda runtime,
+a .pyc built by another version is ignored by the runtime.
+
+    python scripts/build_lambda_payload.py --output build/lambda --compile
+"""
+import argparse
+import json
+import os
+import py_compile
+import re
+import shutil
+import sys
+
+import botocore.loaders
+from botocore import xform_name
+
+SCRIPTS_DIR = os.path.abspath(os.path.dirname(__file__))
+SCRIPT_NAME = "corelight_sensor_asg_nic_manager"
+LAMBDA_PYTHON_VERSION = "3.12"
+MODEL_DIR = "data"
+
+# Maps the attribute holding a client in the script to its service
+CLIENT_SERVICES = {
+    "ec2_client": "ec2",
+    "asg_client": "autoscaling",
+    "dynamodb_client": "dynamodb",
+}
+
+
+def client_operations(source: str) -> dict:
+    # Maps a service to the snake_case operations called on its client in the source
+    operations = {}
+    for client, operation in re.findall(r"\b(\w+_client)\.(\w+)\b", source):
+        if client in CLIENT_SERVICES and not operation.startswith("meta") and operation != "exceptions":
+            operations.setdefault(CLIENT_SERVICES[client], set()).add(operation)
+    return operations
+
+
+def shape_closure(shapes: dict, names: list) -> set:
+    seen = set()
+    pending = [name for name in names if name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        shape = shapes[name]
+        references = [shape.get("member"), shape.get("key"), shape.get("value")] + list(shape.get("members", {}).values())
+        pending.extend(reference["shape"] for reference in references if reference)
+    return seen
+
+
+def strip_documentation(value):
+    if isinstance(value, dict):
+        return {key: strip_documentation(item) for key, item in value.items() if key != "documentation"}
+    if isinstance(value, list):
+        return [strip_documentation(item) for item in value]
+    return value
+
+
+def trim_service_model(model: dict, operations: set) -> dict:
+    snake_case = {xform_name(name): name for name in model["operations"]}
+    missing = operations - set(snake_case)
+    if missing:
+        raise Exception(f"{model['metadata']['serviceId']} has no operations {sorted(missing)}")
+
+    kept = {snake_case[operation]: model["operations"][snake_case[operation]] for operation in sorted(operations)}
+    referenced = [
+        reference["shape"]
+        for operation in kept.values()
+        for reference in [operation.get("input"), operation.get("output")] + operation.get("errors", [])
+        if reference
+    ]
+    return strip_documentation({
+        "version": model.get("version", "2.0"),
+        "metadata": model["metadata"],
+        "operations": kept,
+        "shapes": {name: model["shapes"][name] for name in sorted(shape_closure(model["shapes"], referenced))}
+    })
+
+
+def build(output: str, compile_script: bool = False) -> dict:
+    script = os.path.join(SCRIPTS_DIR, f"{SCRIPT_NAME}.py")
+    with open(script) as fh:
+        operations = client_operations(fh.read())
+
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+    if compile_script:
+        if "%d.%d" % sys.version_info[:2] != LAMBDA_PYTHON_VERSION:
+            raise Exception(f"--compile needs Python {LAMBDA_PYTHON_VERSION} to match the Lambda runtime, "
+                            f"this is {sys.version.split()[0]}")
+        py_compile.compile(
+            script,
+            cfile=os.path.join(output, f"{SCRIPT_NAME}.pyc"),
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+        )
+    else:
+        shutil.copy(script, output)
+
+    # Loaded through a Loader without AWS_DATA_PATH, so an earlier build never feeds the next one
+    loader = botocore.loaders.Loader(include_default_extras=False)
+    report = {}
+    for service, service_operations in sorted(operations.items()):
+        api_version = loader.determine_latest_version(service, "service-2")
+        model = loader.load_service_model(service, "service-2", api_version)
+        trimmed = trim_service_model(model, service_operations)
+
+        model_dir = os.path.join(output, MODEL_DIR, service, api_version)
+        os.makedirs(model_dir)
+        with open(os.path.join(model_dir, "service-2.json"), "w") as fh:
+            json.dump(trimmed, fh, separators=(",", ":"))
+        report[service] = {
+            "operations": len(trimmed["operations"]),
+            "shapes": f"{len(trimmed['shapes'])}/{len(model['shapes'])}"
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="Directory to build the payload in, it is replaced")
+    parser.add_argument("--compile", action="store_true", help="Ship a sourceless .pyc instead of the script")
+    args = parser.parse_args()
+
+    for service, counts in build(args.output, args.compile).items():
+        print(f"{service:<12} operations={counts['operations']:<4} shapes={counts['shapes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,180 @@
 import os
+import abc
+import contextvars
+import fcntl
+import functools
 import json
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from enum import Enum
+from typing import Dict, Iterator, List, Optional, Union
 
-import boto3
-import botocore
-from dataclasses import dataclass
+# boto3 and the rest of botocore are imported when the first client is created, so importing the module only pays
+# for the exception types
+import botocore.exceptions
+from dataclasses import asdict, dataclass, field, replace
 import logging
 
+# Clients are reused across warm invocations, so keep connections alive. Retries of the EC2 and Auto Scaling clients
+# are left to AwsClient, which rate limits each API action on its own and never retries past the Lambda deadline.
+BOTO_CLIENT_CONFIG = {
+    "connect_timeout": 2,
+    "read_timeout": 10,
+    "tcp_keepalive": True,
+    "max_pool_connections": 20,
+    "retries": {
+        "total_max_attempts": 1,
+        "mode": "standard"
+    }
+}
+# Clients called outside AwsClient, like the idempotency table's, keep the SDK's own retries
+SDK_RETRIES = {"mode": "standard"}
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "EC2ThrottledException",
+}
+TRANSIENT_ERROR_CODES = {"InternalError", "InternalFailure", "ServiceUnavailable", "Unavailable", "RequestTimeout"}
+RETRY_MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+RATE_LIMIT_MIN = 0.5  # Calls per second an action is never limited below
+RATE_LIMIT_MAX = 100.0
+RATE_LIMIT_DECREASE = 0.5
+RATE_LIMIT_COOLDOWN = 1.0  # Throttles within this many seconds of a decrease are part of the same burst
+RATE_LIMIT_MIN_THROTTLES = 3  # Throttles within the last second before the rate is decreased
+RATE_LIMIT_THROTTLE_RATIO = 0.2  # Part of the calls made within the last second that must have been throttled
+DETACH_POLL_DELAY = 1.0
+DETACH_POLL_ATTEMPTS = 15
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_WARM_POOL_TTL = 3600
+DEFAULT_ATTACHMENT_WAIT_TIMEOUT = 20
+DEFAULT_ORPHAN_MIN_AGE = 900
+DEFAULT_ORPHAN_DELETE_BATCH_SIZE = 10
+DEFAULT_ORPHAN_DELETE_RATE = 5.0
+DEFAULT_SUBNET_CAPACITY_TTL = 30
+
+# Seconds kept back from the Lambda timeout so the last API call and the invocation's logging finish before it
+DEADLINE_RESERVE = 1.0
+# Seconds of every invocation kept for cleanup and posting the lifecycle action result, provisioning never uses them
+FINALIZE_RESERVE = 5.0
+# Seconds of FINALIZE_RESERVE that cleanup and teardown leave for posting the lifecycle action result
+RESULT_RESERVE = 2.0
+# Least time left for a provisioning step to be started, a launch that can not finish in time is abandoned instead
+STEP_BUDGETS = {
+    "describe_instance": 1.0,
+    "create_interface": 1.0,
+    "attach_interface": 1.0,
+    "modify_attachment": 0.5,
+}
+DEFAULT_LIFECYCLE_HOOK_TIMEOUT = 300
+DEFAULT_PREFLIGHT_TTL = 300
+ATTACHMENT_POLL_INITIAL_DELAY = 0.25
+ATTACHMENT_POLL_MAX_DELAY = 2.0
+HEARTBEAT_INTERVAL = 10.0
+
+DEFAULT_METRICS_NAMESPACE = "Corelight/SensorNicManager"
+TRACE_RECORD_TYPE = "lifecycle_event"  # Value of the "trace" key that marks trace records among the log lines
+TRACE_SERVICE_NAME = "corelight-sensor-nic-manager"
+TRACE_EXPORT_TIMEOUT = 1.0
+
+# An in-progress claim ends with the invocation holding it, the Lambda's timeout when it runs without a deadline. A
+# completed one outlives the lifecycle hook
+IDEMPOTENCY_IN_PROGRESS_TTL = 30
+IDEMPOTENCY_COMPLETED_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE_SIZE = 4096
+
+MANAGED_TAG_KEY = "CorelightManaged"
+WARM_POOL_TAG_KEY = "CorelightWarmPool"
+CREATED_AT_TAG_KEY = "CorelightCreatedAt"
+MANAGEMENT_DEVICE_INDEX = 1
+
+# Input of the scheduled EventBridge rule that runs the orphaned interface sweep
+ORPHANED_INTERFACE_SWEEP_ACTION = "sweep_orphaned_interfaces"
+
 
 @dataclass
 class EnvironmentConfig:
-    subnet_map: dict  # Maps AZ to subnet ID
+    subnet_map: dict  # Maps AZ to a subnet ID, or to a list of subnet IDs in the same AZ
     security_group_id: str
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY  # Instances provisioned in parallel within one invocation
+    warm_pool_size: int = 0  # Detached interfaces kept ready per management subnet, 0 disables the pool
+    warm_pool_ttl: int = DEFAULT_WARM_POOL_TTL  # Seconds before an unclaimed pool interface is replaced
+    attachment_wait_timeout: int = 0  # Seconds to wait for the attachment to be `attached`, 0 skips the wait
+    metrics_enabled: bool = False  # Emit CloudWatch Embedded Metric Format records to stdout
+    metrics_namespace: str = DEFAULT_METRICS_NAMESPACE
+    idempotency_table_name: str = ""  # DynamoDB table shared by all containers, empty keeps idempotency in memory
+    idempotency_file: str = ""  # File-backed store for local runs, used when no table is configured
+    orphan_min_age: int = DEFAULT_ORPHAN_MIN_AGE  # Seconds an available managed interface is left alone by the sweep
+    orphan_delete_batch_size: int = DEFAULT_ORPHAN_DELETE_BATCH_SIZE
+    orphan_delete_rate: float = DEFAULT_ORPHAN_DELETE_RATE  # DeleteNetworkInterface calls per second
+    subnet_capacity_ttl: int = DEFAULT_SUBNET_CAPACITY_TTL  # Seconds a subnet's free address count is cached
+    trust_event_data: bool = False  # Skip describe_instances when the instance's AZ is known without it
+    monitoring_subnets: dict = field(default_factory=dict)  # Maps a monitoring subnet ID to its AZ
+    async_pipeline: bool = False  # Interleave the events of an invocation on one asyncio event loop
+    lifecycle_hook_timeout: int = DEFAULT_LIFECYCLE_HOOK_TIMEOUT  # Heartbeat timeout of the launch lifecycle hook
+    vpc_id: str = ""  # VPC every subnet and the security group must be in, empty expects the security group's VPC
+    preflight_ttl: int = 0  # Seconds a preflight validation result is cached, 0 skips validation in the Lambda
+    region: str = ""  # Region of the sensor group, empty uses the Lambda's own
+    fleets: dict = field(default_factory=dict)  # Maps the ASG name of each additional fleet to its placement, see FLEETS
+    trace_enabled: bool = False  # Export a trace of the steps and API calls of every lifecycle event
+    trace_otlp_endpoint: str = ""  # OTLP/HTTP collector the traces are posted to instead of being logged
+    lifecycle_hook_names: list = field(default_factory=list)  # Hooks of the group handled here, empty handles any
+
+    def subnets_for(self, availability_zone: str) -> List[str]:
+        subnet_ids = self.subnet_map.get(availability_zone, [])
+        return [subnet_ids] if isinstance(subnet_ids, str) else list(subnet_ids)
+
+    def all_subnet_ids(self) -> List[str]:
+        return [subnet_id for availability_zone in self.subnet_map for subnet_id in self.subnets_for(availability_zone)]
+
+    def fleet_configs(self) -> Dict[str, "EnvironmentConfig"]:
+        # Additional fleets share every setting of the deployment except where their interfaces are created
+        return {
+            autoscaling_group_name: replace(
+                self,
+                subnet_map=fleet['subnets'],
+                security_group_id=fleet['security_group_id'],
+                monitoring_subnets=fleet.get('monitoring_subnets') or {},
+                vpc_id=fleet.get('vpc_id') or "",
+                region=fleet.get('region') or "",
+                lifecycle_hook_names=fleet.get('lifecycle_hook_names') or self.lifecycle_hook_names,
+                fleets={}
+            )
+            for autoscaling_group_name, fleet in self.fleets.items()
+        }
+
+    def single_availability_zone(self) -> Optional[str]:
+        # Lifecycle events do not carry the instance placement, it is only known up front when every subnet the
+        # group launches into is in the same AZ
+        availability_zones = set(self.monitoring_subnets.values()) or set(self.subnet_map)
+        return next(iter(availability_zones)) if len(availability_zones) == 1 else None
+
+
+def tag_value(resource: dict, key: str) -> Optional[str]:
+    for tag in resource.get('TagSet', resource.get('Tags', [])):
+        if tag['Key'] == key:
+            return tag['Value']
+    return None
+
+
+class LifecycleTransition(Enum):
+    LAUNCHING = "autoscaling:EC2_INSTANCE_LAUNCHING"
+    TERMINATING = "autoscaling:EC2_INSTANCE_TERMINATING"
 
 
 @dataclass
@@ -21,6 +184,12 @@ class Ec2LifecycleHookEvent:
     destination: str
     lifecycle_hook_name: str
     lifecycle_action_token: str
+    event_time: Optional[str] = None  # When EventBridge emitted the lifecycle event, ISO 8601
+    lifecycle_transition: str = "autoscaling:EC2_INSTANCE_LAUNCHING"
+
+    @property
+    def terminating(self) -> bool:
+        return self.lifecycle_transition == LifecycleTransition.TERMINATING.value
 
 
 def from_aws_event_bridge_json(event_bridge_json: dict) -> Ec2LifecycleHookEvent:
@@ -29,7 +198,9 @@ def from_aws_event_bridge_json(event_bridge_json: dict) -> Ec2LifecycleHookEvent
         autoscaling_group_name=event_bridge_json['detail']['AutoScalingGroupName'],
         destination=event_bridge_json['detail']['Destination'],
         lifecycle_hook_name=event_bridge_json['detail']['LifecycleHookName'],
-        lifecycle_action_token=event_bridge_json['detail']['LifecycleActionToken']
+        lifecycle_action_token=event_bridge_json['detail']['LifecycleActionToken'],
+        event_time=event_bridge_json.get('time'),
+        lifecycle_transition=event_bridge_json['detail'].get('LifecycleTransition', LifecycleTransition.LAUNCHING.value)
     )
 
 
@@ -38,34 +209,617 @@ class LifecycleActionResult(Enum):
     ABANDON = "ABANDON"
 
 
+class ManagementInterfaceState(Enum):
+    MISSING = "MISSING"  # Only the primary interface is attached, the management interface needs provisioning
+    ATTACHED = "ATTACHED"  # A previous attempt already attached a usable management interface
+    INCONSISTENT = "INCONSISTENT"
+
+
+@dataclass
+class LifecycleEventResult:
+    event: Ec2LifecycleHookEvent
+    action: Optional[LifecycleActionResult] = None  # The result posted to the ASG, None if it could not be posted
+    error: Optional[Exception] = None
+    step_latency_ms: dict = field(default_factory=dict)
+    duplicate: bool = False  # The event was already handled, or is being handled, by another invocation
+    ignored: bool = False  # The event is for a lifecycle hook its group is not configured with here
+
+    @property
+    def completed(self) -> bool:
+        # A duplicate still in progress elsewhere has no action yet, its message is redelivered until one is posted.
+        # No action will ever be posted here for an ignored event, redelivering it would not help
+        return self.action is not None or self.ignored
+
+    def to_dict(self) -> dict:
+        return {
+            "instance_id": self.event.instance_id,
+            "action": self.action.value if self.action else None,
+            "error": str(self.error) if self.error else None,
+            "duplicate": self.duplicate,
+            "ignored": self.ignored,
+            "step_latency_ms": self.step_latency_ms
+        }
+
+
 class EnvironmentVariables(Enum):
     TARGET_SUBNETS = "TARGET_SUBNETS"
     TARGET_SECURITY_GROUP_ID = "TARGET_SECURITY_GROUP_ID"
+    MAX_CONCURRENCY = "MAX_CONCURRENCY"
+    ENI_WARM_POOL_SIZE = "ENI_WARM_POOL_SIZE"
+    ENI_WARM_POOL_TTL = "ENI_WARM_POOL_TTL"
+    ATTACHMENT_WAIT_TIMEOUT = "ATTACHMENT_WAIT_TIMEOUT"
+    METRICS_ENABLED = "METRICS_ENABLED"
+    METRICS_NAMESPACE = "METRICS_NAMESPACE"
+    IDEMPOTENCY_TABLE_NAME = "IDEMPOTENCY_TABLE_NAME"
+    IDEMPOTENCY_FILE = "IDEMPOTENCY_FILE"
+    ORPHAN_MIN_AGE = "ORPHAN_MIN_AGE"
+    ORPHAN_DELETE_BATCH_SIZE = "ORPHAN_DELETE_BATCH_SIZE"
+    ORPHAN_DELETE_RATE = "ORPHAN_DELETE_RATE"
+    SUBNET_CAPACITY_TTL = "SUBNET_CAPACITY_TTL"
+    TRUST_EVENT_DATA = "TRUST_EVENT_DATA"
+    MONITORING_SUBNETS = "MONITORING_SUBNETS"
+    ASYNC_PIPELINE = "ASYNC_PIPELINE"
+    LIFECYCLE_HOOK_TIMEOUT = "LIFECYCLE_HOOK_TIMEOUT"
+    TARGET_VPC_ID = "TARGET_VPC_ID"
+    PREFLIGHT_TTL = "PREFLIGHT_TTL"
+    FLEETS = "FLEETS"
+    TRACE_ENABLED = "TRACE_ENABLED"
+    TRACE_OTLP_ENDPOINT = "TRACE_OTLP_ENDPOINT"
+    LIFECYCLE_HOOK_NAMES = "LIFECYCLE_HOOK_NAMES"
+
+
+class MetricNames(Enum):
+    AWS_CALL_LATENCY = "AwsCallLatency"
+    AWS_CALL_RETRIES = "AwsCallRetries"
+    AWS_CALL_ERRORS = "AwsCallErrors"
+    LAUNCH_TO_CONTINUE_LATENCY = "LaunchToContinueLatency"
+    ORPHANED_INTERFACES_RECLAIMED = "OrphanedInterfacesReclaimed"
+    ORPHANED_IPS_FREED = "OrphanedIpsFreed"
+
+
+# Sensor group the current thread or task is handling an event of, API call metrics carry it as a dimension
+_metrics_autoscaling_group: contextvars.ContextVar = contextvars.ContextVar("metrics_autoscaling_group", default=None)
+
+
+@contextmanager
+def metrics_dimension(autoscaling_group_name: str):
+    token = _metrics_autoscaling_group.set(autoscaling_group_name)
+    try:
+        yield
+    finally:
+        _metrics_autoscaling_group.reset(token)
+
+
+_emit_lock = threading.Lock()
+
+
+def emit_line(line: str):
+    # print writes the text and the newline separately, so lines printed by concurrent events can interleave
+    with _emit_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+class MetricsLogger:
+    # Writes CloudWatch Embedded Metric Format records to stdout, CloudWatch Logs extracts the metrics so
+    # publishing them costs no API calls
+    def __init__(self, namespace: str = DEFAULT_METRICS_NAMESPACE, enabled: bool = True, emit=emit_line):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.emit = emit
+        self._local = threading.local()
+        self._instrumented = set()  # IDs of the clients already instrumented, fleets in one region share clients
+
+    def set_retry_attempt(self, attempt: int):
+        # Retries are made by AwsClient rather than botocore, so they are passed in for the calls of this thread
+        self._local.retry_attempt = attempt
+
+    def put(
+            self,
+            metrics: dict,
+            dimensions: dict,
+            properties: Optional[dict] = None,
+            dimension_sets: Optional[List[List[str]]] = None
+    ):
+        # metrics maps a metric name to a (value, unit) tuple, dimension_sets defaults to all dimensions together
+        if not self.enabled:
+            return
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": dimension_sets or [list(dimensions.keys())],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()]
+                }]
+            },
+            **dimensions,
+            **(properties or {}),
+            **{name: value for name, (value, _) in metrics.items()}
+        }
+        self.emit(json.dumps(record, separators=(",", ":"), default=str))
+
+    def instrument(self, client):
+        # Times every API call made by a boto3 client, including waiter and paginator calls
+        events = getattr(getattr(client, "meta", None), "events", None)
+        if events is None or id(client) in self._instrumented:
+            return
+        self._instrumented.add(id(client))
+        events.register_first("before-parameter-build.*.*", self._start_call)
+        events.register("after-call.*.*", self._end_call)
+        events.register("after-call-error.*.*", self._end_call_error)
+
+    @staticmethod
+    def _start_call(model, context: dict, **kwargs):
+        context["nic_manager_start"] = time.perf_counter()
+        context["nic_manager_operation"] = model.name
+
+    def _end_call(self, model, parsed: dict, http_response, context: dict, **kwargs):
+        outcome = "Success" if http_response.status_code < 300 else parsed.get("Error", {}).get("Code", "Error")
+        self._record_call(model.name, context, outcome, parsed.get("ResponseMetadata", {}))
+
+    def _end_call_error(self, exception: Exception, context: dict, **kwargs):
+        self._record_call(context.get("nic_manager_operation", "Unknown"), context, type(exception).__name__, {})
+
+    def _record_call(self, operation: str, context: dict, outcome: str, response_metadata: dict):
+        start = context.get("nic_manager_start")
+        if start is None:
+            return
+
+        latency_ms = round((time.perf_counter() - start) * 1000, 3)
+        retries = response_metadata.get("RetryAttempts", 0) + getattr(self._local, "retry_attempt", 0)
+        request_id = response_metadata.get("RequestId")
+        record_trace_call(operation, latency_ms, outcome, request_id, retries)
+
+        # Published per operation as before, and per operation and group when the call was made for an event
+        dimensions = {"Operation": operation}
+        dimension_sets = None
+        autoscaling_group_name = _metrics_autoscaling_group.get()
+        if autoscaling_group_name is not None:
+            dimensions["AutoScalingGroupName"] = autoscaling_group_name
+            dimension_sets = [["Operation"], ["Operation", "AutoScalingGroupName"]]
+        self.put(
+            {
+                MetricNames.AWS_CALL_LATENCY.value: (latency_ms, "Milliseconds"),
+                MetricNames.AWS_CALL_RETRIES.value: (retries, "Count"),
+                MetricNames.AWS_CALL_ERRORS.value: (0 if outcome == "Success" else 1, "Count"),
+            },
+            dimensions,
+            {"Outcome": outcome, "RequestId": request_id},
+            dimension_sets
+        )
+
+
+class ProvisioningCancelled(Exception):
+    pass
+
+
+class AttachmentTimeout(Exception):
+    pass
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at  # time.monotonic() value, None when unbounded
+
+    @classmethod
+    def from_lambda_context(cls, context, reserve: float = DEADLINE_RESERVE) -> "Deadline":
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return cls()
+        return cls(time.monotonic() + context.get_remaining_time_in_millis() / 1000 - reserve)
+
+    def within(self, seconds: float) -> "Deadline":
+        return Deadline(min(time.monotonic() + seconds, self.expires_at or float("inf")))
+
+    def reserve(self, seconds: float) -> "Deadline":
+        # The part of this deadline that leaves `seconds` for what has to run after it
+        return self if self.expires_at is None else Deadline(self.expires_at - seconds)
+
+    def require(self, seconds: float, step: str):
+        if self.remaining() < seconds:
+            raise DeadlineExceeded(f"{step} needs {seconds}s, {self.remaining():.2f}s is left")
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+# Deadline of the provisioning budget the current thread or task is working within, see AwsClient.bounded_by
+_call_deadline: contextvars.ContextVar = contextvars.ContextVar("call_deadline", default=None)
+
+
+# Trace of the lifecycle event the current thread or task is handling and its step in progress, see TraceExporter
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class TraceCall:
+    operation: str
+    start: float  # Unix time
+    latency_ms: float
+    outcome: str
+    request_id: Optional[str] = None
+    retries: int = 0
+
+
+@dataclass
+class TraceSpan:
+    name: str
+    start: float  # Unix time
+    duration_ms: float = 0.0
+    calls: List[TraceCall] = field(default_factory=list)
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    instance_id: str
+    autoscaling_group_name: str
+    lifecycle_transition: str
+    start: float  # Unix time
+    duration_ms: float = 0.0
+    action: Optional[str] = None
+    error: Optional[str] = None
+    duplicate: bool = False
+    spans: List[TraceSpan] = field(default_factory=list)
+    calls: List[TraceCall] = field(default_factory=list)  # Calls made outside of any step
+
+    def finish(self, result: "LifecycleEventResult"):
+        self.action = result.action.value if result.action else None
+        self.error = str(result.error) if result.error else None
+        self.duplicate = result.duplicate
+
+    def to_dict(self) -> dict:
+        return {"trace": TRACE_RECORD_TYPE, **asdict(self)}
+
+    def to_otlp(self) -> dict:
+        # OTLP/HTTP JSON encoding: the event is the root span, each step a child and each API call a grandchild
+        def attributes(values: dict) -> list:
+            encoded = []
+            for key, value in values.items():
+                if value is None:
+                    continue
+                if isinstance(value, bool):
+                    encoded.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    encoded.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    encoded.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    encoded.append({"key": key, "value": {"stringValue": str(value)}})
+            return encoded
+
+        def span(name: str, parent_id: str, start: float, duration_ms: float, kind: int, values: dict, error: bool):
+            return {
+                "traceId": self.trace_id,
+                "spanId": uuid.uuid4().hex[:16],
+                "parentSpanId": parent_id,
+                "name": name,
+                "kind": kind,
+                "startTimeUnixNano": str(int(start * 1e9)),
+                "endTimeUnixNano": str(int((start + duration_ms / 1000) * 1e9)),
+                "attributes": attributes(values),
+                "status": {"code": 2 if error else 0}
+            }
+
+        def calls(parent_id: str, trace_calls: List[TraceCall]) -> list:
+            return [
+                span(call.operation, parent_id, call.start, call.latency_ms, 3,
+                     {"aws.request_id": call.request_id, "outcome": call.outcome, "retries": call.retries},
+                     call.outcome != "Success")
+                for call in trace_calls
+            ]
+
+        root = span(
+            "lifecycle_event", "", self.start, self.duration_ms, 1,
+            {"instance_id": self.instance_id, "autoscaling_group_name": self.autoscaling_group_name,
+             "lifecycle_transition": self.lifecycle_transition, "action": self.action, "duplicate": self.duplicate},
+            self.error is not None
+        )
+        spans = [root, *calls(root["spanId"], self.calls)]
+        for trace_span in self.spans:
+            step = span(trace_span.name, root["spanId"], trace_span.start, trace_span.duration_ms, 1, {}, False)
+            spans.append(step)
+            spans.extend(calls(step["spanId"], trace_span.calls))
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": attributes({"service.name": TRACE_SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+            }]
+        }
+
+
+def record_trace_call(operation: str, latency_ms: float, outcome: str, request_id: Optional[str], retries: int):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    call = TraceCall(operation, round(time.time() - latency_ms / 1000, 6), latency_ms, outcome, request_id, retries)
+    span = _current_span.get()
+    (span.calls if span is not None else trace.calls).append(call)
+
+
+class TraceExporter:
+    # Writes one compact JSON line per lifecycle event holding a span per step and the API calls made within it,
+    # or posts it as OTLP/HTTP JSON to a collector such as the one of the ADOT Lambda layer. Export failures are
+    # logged and never fail the event
+    def __init__(self, enabled: bool = False, otlp_endpoint: str = "", emit=emit_line):
+        self.enabled = enabled
+        self.otlp_endpoint = otlp_endpoint
+        self.emit = emit
+
+    @contextmanager
+    def trace(self, event: "Ec2LifecycleHookEvent") -> Iterator[Optional[Trace]]:
+        if not self.enabled:
+            yield None
+            return
+
+        trace = Trace(
+            uuid.uuid4().hex, event.instance_id, event.autoscaling_group_name, event.lifecycle_transition, time.time()
+        )
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.duration_ms = round((time.perf_counter() - start) * 1000, 3)
+            self.export(trace)
+
+    def export(self, trace: Trace):
+        try:
+            if self.otlp_endpoint:
+                self._post(trace.to_otlp())
+            else:
+                self.emit(json.dumps(trace.to_dict(), separators=(",", ":")))
+        except Exception as e:
+            logging.warning(f"unable to export the trace of instance {trace.instance_id}: {e}")
+
+    def _post(self, payload: dict):
+        import urllib.request
+
+        request = urllib.request.Request(
+            f"{self.otlp_endpoint.rstrip('/')}/v1/traces",
+            data=json.dumps(payload, separators=(",", ":")).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=TRACE_EXPORT_TIMEOUT) as response:
+            response.read()
+
+
+@contextmanager
+def timed_step(step_latency_ms: dict, step: str):
+    start = time.perf_counter()
+    # Within a traced event the step is also a span collecting the API calls made during it
+    trace = _current_trace.get()
+    span = TraceSpan(step, time.time()) if trace is not None else None
+    token = _current_span.set(span) if span is not None else None
+    try:
+        yield
+    finally:
+        step_latency_ms[step] = round((time.perf_counter() - start) * 1000, 3)
+        if span is not None:
+            _current_span.reset(token)
+            span.duration_ms = step_latency_ms[step]
+            trace.spans.append(span)
+
+
+class CancellationToken:
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self, instance_id: str):
+        if self.cancelled:
+            raise ProvisioningCancelled(f"provisioning of instance {instance_id} was cancelled")
+
+
+class AdaptiveRateLimiter:
+    # Token bucket for one API action. Calls are not limited until the action is throttled, the rate is then halved
+    # on each burst of throttles and raised again by about one call per second, every second, while calls succeed.
+    # Only sustained throttling is a burst, the odd throttle of an action running below its limit is left to the
+    # retries. The clock and sleep can be replaced to simulate time.
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.rate: Optional[float] = None  # Calls per second, None until the action is throttled
+        self.tokens = 0.0
+        self.updated_at = clock()
+        self.decreased_at = None
+        self._sent = deque()  # Times of the calls made in the last second
+        self._throttled = deque()  # Times of the throttles in the last second
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float = float("inf")):
+        with self._lock:
+            now = self.clock()
+            self._sent.append(now)
+            self._expire(now)
+            if self.rate is None:
+                return
+
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait > max_wait:
+                self.tokens += 1
+                raise RateLimitExceeded(f"waiting {wait:.2f}s for the rate limit would exceed the deadline")
+        if wait > 0:
+            self.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            now = self.clock()
+            self._throttled.append(now)
+            self._expire(now)
+            if self.decreased_at is not None and now - self.decreased_at < RATE_LIMIT_COOLDOWN:
+                return
+            throttled = len(self._throttled)
+            if throttled < RATE_LIMIT_MIN_THROTTLES or throttled < len(self._sent) * RATE_LIMIT_THROTTLE_RATIO:
+                return
+            # The first throttle starts from the rate the action was actually called at
+            current = self.rate if self.rate is not None else len(self._sent)
+            self.rate = max(RATE_LIMIT_MIN, current * RATE_LIMIT_DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+            self.updated_at = now
+            self.decreased_at = now
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is not None:
+                self.rate = min(RATE_LIMIT_MAX, self.rate + 1 / self.rate)
+
+    def _expire(self, now: float):
+        for times in (self._sent, self._throttled):
+            while times and times[0] <= now - 1:
+                times.popleft()
+
+    def _refill(self, now: float):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
 
 
 class AwsClient:
-    def __init__(self, ec2_client, asg_client):
+    def __init__(
+            self,
+            ec2_client,
+            asg_client,
+            max_workers: int = DEFAULT_MAX_CONCURRENCY,
+            metrics: Optional[MetricsLogger] = None
+    ):
         self.ec2_client = ec2_client
         self.asg_client = asg_client
+        self.max_workers = max_workers
+        self.metrics: MetricsLogger = metrics or MetricsLogger(enabled=False)
+        self.metrics.instrument(ec2_client)
+        self.metrics.instrument(asg_client)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # Rate limiters live as long as the client, so what was learned about throttling carries over to warm
+        # invocations. The deadline is replaced by every invocation.
+        self.deadline: Deadline = Deadline()
+        self._rate_limiters = {}
+        self._rate_limiters_lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # boto3 clients are thread safe, so a single bounded pool is shared by everything using this client
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="nic-manager")
+            return self._executor
+
+    @contextmanager
+    def bounded_by(self, deadline: Optional[Deadline]):
+        # Calls made within stop retrying at the earlier of the invocation deadline and `deadline`. None lifts the
+        # bound, so cleanup and the lifecycle action result can use the time provisioning had to leave
+        token = _call_deadline.set(deadline)
+        try:
+            yield
+        finally:
+            _call_deadline.reset(token)
+
+    def remaining(self) -> float:
+        bound = _call_deadline.get()
+        return self.deadline.remaining() if bound is None else min(self.deadline.remaining(), bound.remaining())
+
+    def rate_limiter(self, action: str) -> AdaptiveRateLimiter:
+        with self._rate_limiters_lock:
+            if action not in self._rate_limiters:
+                self._rate_limiters[action] = AdaptiveRateLimiter()
+            return self._rate_limiters[action]
+
+    def _call(self, operation, **kwargs):
+        # Retries throttled and transient failures with full jitter, slowing the throttled action down
+        action = getattr(operation, "__name__", str(operation))
+        limiter = self.rate_limiter(action)
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            limiter.acquire(self.remaining())
+            self.metrics.set_retry_attempt(attempt)
+            try:
+                resp = operation(**kwargs)
+            except botocore.exceptions.ClientError as e:
+                code = e.response['Error']['Code']
+                if code in THROTTLING_ERROR_CODES:
+                    limiter.on_throttle()
+                elif code not in TRANSIENT_ERROR_CODES:
+                    raise e
+                error = e
+            except (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError) as e:
+                error = e
+            else:
+                limiter.on_success()
+                return resp
+            finally:
+                self.metrics.set_retry_attempt(0)
+
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if attempt == RETRY_MAX_ATTEMPTS - 1 or delay >= self.remaining():
+                raise error
+            logging.warning(f"{action} failed with {error}, retrying in {delay:.3f}s")
+            time.sleep(delay)
+
+    def _describe_network_interfaces(self, filters: List[dict]) -> List[dict]:
+        interfaces = []
+        kwargs = {"Filters": filters}
+        while True:
+            resp = self._call(self.ec2_client.describe_network_interfaces, **kwargs)
+            interfaces.extend(resp['NetworkInterfaces'])
+            if not resp.get('NextToken'):
+                return interfaces
+            kwargs['NextToken'] = resp['NextToken']
 
     def get_instance_details(self, instance_id: str) -> dict:
         try:
-            return self.ec2_client.describe_instances(InstanceIds=[instance_id])
+            return self._call(self.ec2_client.describe_instances, InstanceIds=[instance_id])
         except botocore.exceptions.ClientError as e:
             logging.error(f"failed to fetch information on instance {instance_id}: {e}")
             raise e
 
-    def create_interface(self, subnet_id: str, security_group_id: str) -> str:
+    def get_instances_details(self, instance_ids: List[str]) -> dict:
+        try:
+            resp = self._call(self.ec2_client.describe_instances, InstanceIds=instance_ids)
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"failed to fetch information on instances {instance_ids}: {e}")
+            raise e
+
+        # Maps instance ID to its description
+        return {
+            instance['InstanceId']: instance
+            for reservation in resp['Reservations']
+            for instance in reservation['Instances']
+        }
+
+    def create_interface(self, subnet_id: str, security_group_id: str, tags: Optional[dict] = None) -> str:
+        # Interfaces have no creation timestamp in EC2, so record it as a tag for the warm pool TTL
+        tags = {MANAGED_TAG_KEY: "true", CREATED_AT_TAG_KEY: str(int(time.time())), **(tags or {})}
         try:
-            return self.ec2_client.create_network_interface(
+            # Retries after a dropped connection reuse the token, so EC2 returns the interface it may have created
+            return self._call(
+                self.ec2_client.create_network_interface,
                 SubnetId=subnet_id,
                 Groups=[security_group_id],
+                ClientToken=str(uuid.uuid4()),
                 TagSpecifications=[{
                     "ResourceType": "network-interface",
-                    "Tags": [{
-                        "Key": "CorelightManaged",
-                        "Value": "true"
-                    }]
+                    "Tags": [{"Key": key, "Value": value} for key, value in tags.items()]
                 }]
             )['NetworkInterface']['NetworkInterfaceId']
 
@@ -74,12 +828,83 @@ class AwsClient:
                           f"subnet {subnet_id} and security group {security_group_id}: {e}")
             raise e
 
+    def get_subnets(self, subnet_ids: List[str]) -> List[dict]:
+        try:
+            return self._call(self.ec2_client.describe_subnets, SubnetIds=subnet_ids)['Subnets']
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error describing subnets {subnet_ids}: {e}")
+            raise e
+
+    def find_subnets(self, subnet_ids: List[str]) -> List[dict]:
+        # Filtering instead of passing SubnetIds leaves missing subnets out rather than failing the whole call
+        try:
+            return self._call(
+                self.ec2_client.describe_subnets, Filters=[{"Name": "subnet-id", "Values": subnet_ids}]
+            )['Subnets']
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error describing subnets {subnet_ids}: {e}")
+            raise e
+
+    def find_security_groups(self, group_ids: List[str]) -> List[dict]:
+        try:
+            return self._call(
+                self.ec2_client.describe_security_groups, Filters=[{"Name": "group-id", "Values": group_ids}]
+            )['SecurityGroups']
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error describing security groups {group_ids}: {e}")
+            raise e
+
+    def get_interface(self, interface_id: str) -> Optional[dict]:
+        try:
+            return self._call(
+                self.ec2_client.describe_network_interfaces,
+                NetworkInterfaceIds=[interface_id]
+            )['NetworkInterfaces'][0]
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == "InvalidNetworkInterfaceID.NotFound":
+                return None
+            logging.error(f"[{e.response['Error']['Message']}] error describing network interface {interface_id}: {e}")
+            raise e
+
+    def get_warm_pool_interfaces(self, subnet_ids: List[str], security_group_id: str) -> List[dict]:
+        try:
+            return self._describe_network_interfaces([
+                {"Name": f"tag:{MANAGED_TAG_KEY}", "Values": ["true"]},
+                {"Name": "tag-key", "Values": [WARM_POOL_TAG_KEY]},
+                {"Name": "status", "Values": ["available"]},
+                {"Name": "subnet-id", "Values": subnet_ids},
+                {"Name": "group-id", "Values": [security_group_id]},
+            ])
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error listing warm pool interfaces in {subnet_ids}: {e}")
+            raise e
+
+    def get_available_managed_interfaces(self, subnet_ids: List[str], security_group_id: str) -> List[dict]:
+        try:
+            return self._describe_network_interfaces([
+                {"Name": f"tag:{MANAGED_TAG_KEY}", "Values": ["true"]},
+                {"Name": "status", "Values": ["available"]},
+                {"Name": "subnet-id", "Values": subnet_ids},
+                {"Name": "group-id", "Values": [security_group_id]},
+            ])
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error listing available interfaces in {subnet_ids}: {e}")
+            raise e
+
+    def untag_interface(self, interface_id: str, tag_keys: List[str]):
+        try:
+            self._call(self.ec2_client.delete_tags, Resources=[interface_id], Tags=[{"Key": key} for key in tag_keys])
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error removing tags {tag_keys} from {interface_id}: {e}")
+            raise e
+
     def attach_interface(self, interface_id: str, instance_id: str) -> dict:
         try:
-            return self.ec2_client.attach_network_interface(
+            return self._call(
+                self.ec2_client.attach_network_interface,
                 NetworkInterfaceId=interface_id,
                 InstanceId=instance_id,
-                DeviceIndex=1
+                DeviceIndex=MANAGEMENT_DEVICE_INDEX
             )
         except botocore.exceptions.ClientError as e:
             logging.error(f"[{e.response['Error']['Message']}] error attaching network interface "
@@ -88,7 +913,8 @@ class AwsClient:
 
     def modify_attachment_to_delete_on_termination(self, attachment_id: str, network_interface_id: str):
         try:
-            self.ec2_client.modify_network_interface_attribute(
+            self._call(
+                self.ec2_client.modify_network_interface_attribute,
                 Attachment={
                     'AttachmentId': attachment_id,
                     'DeleteOnTermination': True,
@@ -99,11 +925,28 @@ class AwsClient:
             logging.error(f"[{e.response['Error']['Message']}] failed to modify network attachment on {attachment_id}: {e}")
             raise e
 
+    def detach_interface(self, attachment_id: str, interface_id: str):
+        try:
+            self._call(self.ec2_client.detach_network_interface, AttachmentId=attachment_id, Force=True)
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error detaching network interface {interface_id}: {e}")
+            raise e
+
+        # The interface can only be deleted once the detachment has finished
+        for _ in range(DETACH_POLL_ATTEMPTS):
+            interface = self.get_interface(interface_id)
+            if interface is None or interface['Status'] == "available":
+                return
+            if self.remaining() <= 0:
+                break
+            time.sleep(min(DETACH_POLL_DELAY, self.remaining()))
+        raise Exception(f"network interface {interface_id} was not detached in time")
+
     def delete_interface(self, interface_id: str) -> dict:
         try:
-            return self.ec2_client.delete_network_interface(NetworkInterfaceId=interface_id)
+            return self._call(self.ec2_client.delete_network_interface, NetworkInterfaceId=interface_id)
         except botocore.exceptions.ClientError as e:
-            logging.error(f"[{e.response['Error']['Message']}] error attaching network interface {interface_id}: {e}")
+            logging.error(f"[{e.response['Error']['Message']}] error deleting network interface {interface_id}: {e}")
             raise e
 
     def complete_lifecycle_action(
@@ -115,7 +958,8 @@ class AwsClient:
             lifecycle_action_result: LifecycleActionResult
     ):
         try:
-            self.asg_client.complete_lifecycle_action(
+            self._call(
+                self.asg_client.complete_lifecycle_action,
                 LifecycleHookName=lifecycle_hook_name,
                 AutoScalingGroupName=auto_scaling_group_name,
                 InstanceId=instance_id,
@@ -128,105 +972,1751 @@ class AwsClient:
                 f"for instance {instance_id}: {e}")
             raise e
 
+    def record_lifecycle_action_heartbeat(
+            self,
+            lifecycle_hook_name: str,
+            auto_scaling_group_name: str,
+            instance_id: str,
+            lifecycle_action_token: str
+    ):
+        try:
+            self._call(
+                self.asg_client.record_lifecycle_action_heartbeat,
+                LifecycleHookName=lifecycle_hook_name,
+                AutoScalingGroupName=auto_scaling_group_name,
+                InstanceId=instance_id,
+                LifecycleActionToken=lifecycle_action_token
+            )
+        except botocore.exceptions.ClientError as e:
+            logging.error(
+                f"[{e.response['Error']['Message']}] error recording lifecycle action heartbeat "
+                f"for instance {instance_id}: {e}")
+            raise e
+
 
-class LifecycleEventService:
+class SubnetSelector:
+    # Orders the management subnets of an AZ by free addresses, so a launch is not failed by a single full subnet.
+    # The clock can be replaced to simulate time.
+    def __init__(self, config: EnvironmentConfig, aws_client: AwsClient, clock=time.monotonic):
+        self.config: EnvironmentConfig = config
+        self.aws_client: AwsClient = aws_client
+        self.clock = clock
+        self._available = {}  # Maps subnet ID to (AvailableIpAddressCount, clock() it was fetched)
+        self._lock = threading.Lock()
+
+    def candidates(self, subnet_ids: List[str]) -> List[str]:
+        if len(subnet_ids) <= 1:
+            return list(subnet_ids)
+
+        now = self.clock()
+        with self._lock:
+            expired = [
+                subnet_id for subnet_id in subnet_ids
+                if subnet_id not in self._available or now - self._available[subnet_id][1] > self.config.subnet_capacity_ttl
+            ]
+        if expired:
+            try:
+                subnets = self.aws_client.get_subnets(expired)
+                with self._lock:
+                    for subnet in subnets:
+                        self._available[subnet['SubnetId']] = (subnet['AvailableIpAddressCount'], now)
+            except Exception as e:
+                logging.error(f"unable to refresh the free addresses of subnets {expired}: {e}")
+
+        with self._lock:
+            available = {subnet_id: self._available.get(subnet_id, (0, 0))[0] for subnet_id in subnet_ids}
+        # sorted() is stable, subnets with the same count keep their configured order
+        return sorted(subnet_ids, key=lambda subnet_id: available[subnet_id], reverse=True)
+
+    def consume(self, subnet_id: str):
+        # Spread the instances of a batch out instead of waiting for the cache to expire
+        with self._lock:
+            if subnet_id in self._available:
+                count, fetched_at = self._available[subnet_id]
+                self._available[subnet_id] = (max(0, count - 1), fetched_at)
+
+    def mark_exhausted(self, subnet_id: str):
+        with self._lock:
+            self._available[subnet_id] = (0, self.clock())
+
+
+@dataclass
+class PreflightResult:
+    problems: List[str] = field(default_factory=list)
+    checked_at: float = 0.0  # time.monotonic() of the check
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def to_dict(self) -> dict:
+        return {"ok": self.ok, "problems": self.problems}
+
+
+class PreflightValidator:
+    # Checks that the management and monitoring subnets exist in their AZ and VPC and that the security group exists,
+    # with one DescribeSubnets and one DescribeSecurityGroups call. Warm invocations reuse the result until it expires
     def __init__(self, config: EnvironmentConfig, aws_client: AwsClient):
         self.config: EnvironmentConfig = config
         self.aws_client: AwsClient = aws_client
-        self.instance_data = {}
+        self._result: Optional[PreflightResult] = None
+        self._lock = threading.Lock()
 
-    def process_event(self, event: Ec2LifecycleHookEvent):
-        # Get the AZ of the instance
-        instance_az = self.instance_data['Placement']['AvailabilityZone']
-        logging.info(f"Instance {event.instance_id} is in AZ {instance_az}")
+    def validate(self) -> Optional[PreflightResult]:
+        if self.config.preflight_ttl <= 0:
+            return None
 
-        # Find the matching management subnet for this AZ
-        if instance_az not in self.config.subnet_map:
-            raise Exception(f"No management subnet configured for AZ {instance_az}. Available AZs: {list(self.config.subnet_map.keys())}")
+        with self._lock:
+            if self._result is not None and time.monotonic() - self._result.checked_at < self.config.preflight_ttl:
+                return self._result
+            try:
+                self._result = self.check()
+            except Exception as e:
+                # Launches are not held up by a check that could not run, it is retried on the next invocation
+                logging.error(f"unable to run the preflight validation: {e}")
+                return None
 
-        target_subnet_id = self.config.subnet_map[instance_az]
-        logging.info(f"Using management subnet {target_subnet_id} for AZ {instance_az}")
+        for problem in self._result.problems:
+            logging.error(f"preflight validation: {problem}")
+        return self._result
 
-        network_interface_id = self.aws_client.create_interface(target_subnet_id, self.config.security_group_id)
-        try:
-            attachment_resp = self.aws_client.attach_interface(network_interface_id, event.instance_id)
-            self.aws_client.modify_attachment_to_delete_on_termination(attachment_resp["AttachmentId"], network_interface_id)
-        except Exception as e:
-            logging.error(f"unable to attach NIC {network_interface_id}: {e}")
-            logging.info(f"Deleting {network_interface_id}")
-            self.aws_client.delete_interface(network_interface_id)
-            raise e
+    def check(self) -> PreflightResult:
+        expected_azs = {}  # Maps subnet ID to the AZ the configuration places it in
+        for availability_zone in self.config.subnet_map:
+            for subnet_id in self.config.subnets_for(availability_zone):
+                expected_azs[subnet_id] = availability_zone
+        expected_azs.update(self.config.monitoring_subnets)
 
-    def should_process_event(self, event: Ec2LifecycleHookEvent) -> bool:
-        self.instance_data = self.aws_client.get_instance_details(event.instance_id)['Reservations'][0]['Instances'][0]
+        result = PreflightResult(checked_at=time.monotonic())
+        subnets = {subnet['SubnetId']: subnet for subnet in self.aws_client.find_subnets(sorted(expected_azs))}
+        groups = self.aws_client.find_security_groups([self.config.security_group_id])
 
-        if event.destination != "AutoScalingGroup":
-            logging.error(f"Destination should be 'AutoScalingGroup' and it is set to {event.destination}")
-            return False
+        vpc_id = self.config.vpc_id
+        if not groups:
+            result.problems.append(f"security group {self.config.security_group_id} does not exist")
+        else:
+            group_vpc_id = groups[0].get('VpcId')
+            if vpc_id and group_vpc_id != vpc_id:
+                result.problems.append(f"security group {self.config.security_group_id} is in {group_vpc_id}, "
+                                       f"expected {vpc_id}")
+            vpc_id = vpc_id or group_vpc_id
 
-        if len(self.instance_data['NetworkInterfaces']) > 1:
-            logging.error(f"instance {event.instance_id} has more than one network interface")
-            return False
+        for subnet_id, availability_zone in sorted(expected_azs.items()):
+            subnet = subnets.get(subnet_id)
+            if subnet is None:
+                result.problems.append(f"subnet {subnet_id} does not exist")
+                continue
+            if subnet['AvailabilityZone'] != availability_zone:
+                result.problems.append(f"subnet {subnet_id} is in {subnet['AvailabilityZone']}, "
+                                       f"expected {availability_zone}")
+            if vpc_id and subnet['VpcId'] != vpc_id:
+                result.problems.append(f"subnet {subnet_id} is in {subnet['VpcId']}, expected {vpc_id}")
+        return result
 
-        return True
 
-    def complete_lifecycle_action(self, event: Ec2LifecycleHookEvent, action: LifecycleActionResult):
-        return self.aws_client.complete_lifecycle_action(
-            lifecycle_hook_name=event.lifecycle_hook_name,
-            auto_scaling_group_name=event.autoscaling_group_name,
-            instance_id=event.instance_id,
-            lifecycle_action_token=event.lifecycle_action_token,
-            lifecycle_action_result=action
-        )
+class WarmInterfacePool:
+    def __init__(self, config: EnvironmentConfig, aws_client: AwsClient):
+        self.config: EnvironmentConfig = config
+        self.aws_client: AwsClient = aws_client
 
+    def is_stale(self, interface: dict, now: float) -> bool:
+        created_at = tag_value(interface, CREATED_AT_TAG_KEY)
+        return created_at is None or not created_at.isdigit() or now - int(created_at) > self.config.warm_pool_ttl
 
-def lambda_handler(event, context):
-    logging.getLogger().setLevel(logging.INFO)
-    logging.info("initiating Corelight autoscale group monitoring NIC lambda")
-    config: EnvironmentConfig = parse_environment()
-    ec2_client = boto3.client("ec2")
-    asg_client = boto3.client("autoscaling")
-    aws_client = AwsClient(ec2_client, asg_client)
-    lifecycle_event_svc: LifecycleEventService = LifecycleEventService(config, aws_client)
-    parsed_event: Ec2LifecycleHookEvent = from_aws_event_bridge_json(event)
+    def claim(self, subnet_id: str, instance_id: str) -> Optional[tuple]:
+        # Attaching is the claim: EC2 only lets one invocation attach an available interface, so a lost race
+        # simply moves on to the next candidate. Shuffling keeps concurrent invocations from all racing for the
+        # same interface.
+        now = time.time()
+        candidates = [
+            interface for interface in self.aws_client.get_warm_pool_interfaces([subnet_id], self.config.security_group_id)
+            if not self.is_stale(interface, now)
+        ]
+        random.shuffle(candidates)
 
-    try:
-        if not lifecycle_event_svc.should_process_event(parsed_event):
-            logging.error("Event validation failed, abandoning lifecycle action")
-            lifecycle_event_svc.complete_lifecycle_action(parsed_event, LifecycleActionResult.ABANDON)
-            return
+        for interface in candidates:
+            interface_id = interface['NetworkInterfaceId']
+            try:
+                attachment_resp = self.aws_client.attach_interface(interface_id, instance_id)
+            except botocore.exceptions.ClientError as e:
+                current = self.aws_client.get_interface(interface_id)
+                if current is None or current['Status'] != "available":
+                    logging.info(f"warm pool interface {interface_id} was claimed by another invocation")
+                    continue
+                raise e
 
-        lifecycle_event_svc.process_event(parsed_event)
-        lifecycle_event_svc.complete_lifecycle_action(parsed_event, LifecycleActionResult.CONTINUE)
-        logging.info("Lifecycle action completed successfully")
-    except Exception as e:
-        logging.error(f"failed to process event: {e}")
-        try:
-            lifecycle_event_svc.complete_lifecycle_action(parsed_event, LifecycleActionResult.ABANDON)
-        except Exception as complete_error:
-            logging.error(f"Failed to complete lifecycle action with ABANDON: {complete_error}")
-        raise e
+            logging.info(f"claimed warm pool interface {interface_id} for instance {instance_id}")
+            try:
+                self.aws_client.untag_interface(interface_id, [WARM_POOL_TAG_KEY])
+            except Exception as e:
+                # Attached interfaces are never listed as pool candidates, so the stale tag is harmless
+                logging.error(f"unable to remove warm pool tag from {interface_id}: {e}")
+            return interface_id, attachment_resp
 
+        logging.info(f"no warm pool interface available in subnet {subnet_id}")
+        return None
 
-def parse_environment() -> EnvironmentConfig:
-    subnets_json = os.getenv(EnvironmentVariables.TARGET_SUBNETS.value, "")
-    security_group_id = os.getenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "")
+    def refill(self, subnet_ids: List[str]):
+        pool = self.aws_client.get_warm_pool_interfaces(subnet_ids, self.config.security_group_id)
+        now = time.time()
 
-    if subnets_json == "":
-        msg = f"environment variable ${EnvironmentVariables.TARGET_SUBNETS.value} is not defined"
-        logging.error(msg)
-        raise Exception(msg)
+        to_delete = []
+        to_create = []
+        for subnet_id in subnet_ids:
+            interfaces = [interface for interface in pool if interface['SubnetId'] == subnet_id]
+            fresh = sorted(
+                (interface for interface in interfaces if not self.is_stale(interface, now)),
+                key=lambda interface: int(tag_value(interface, CREATED_AT_TAG_KEY)),
+                reverse=True
+            )
+            to_delete.extend(interface for interface in interfaces if self.is_stale(interface, now))
+            to_delete.extend(fresh[self.config.warm_pool_size:])
+            to_create.extend([subnet_id] * max(0, self.config.warm_pool_size - len(fresh)))
 
-    if security_group_id == "":
-        msg = f"environment variable ${EnvironmentVariables.TARGET_SECURITY_GROUP_ID} is not defined"
-        logging.error(msg)
-        raise Exception(msg)
+        for interface in to_delete:
+            logging.info(f"evicting warm pool interface {interface['NetworkInterfaceId']}")
+        for subnet_id in to_create:
+            logging.info(f"adding a warm pool interface to subnet {subnet_id}")
+
+        futures = [self.aws_client.executor.submit(self._evict, interface['NetworkInterfaceId']) for interface in to_delete]
+        futures.extend(
+            self.aws_client.executor.submit(
+                self.aws_client.create_interface,
+                subnet_id,
+                self.config.security_group_id,
+                {WARM_POOL_TAG_KEY: "true"}
+            )
+            for subnet_id in to_create
+        )
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"warm pool refill step failed: {e}")
+
+    def _evict(self, interface_id: str):
+        # Fails harmlessly if another invocation attached the interface in the meantime
+        self.aws_client.delete_interface(interface_id)
+
+
+@dataclass
+class SweepResult:
+    scanned: int = 0
+    reclaimed: int = 0
+    freed_ips: int = 0
+    failed: int = 0
+    skipped: int = 0  # Old enough, but left for the next sweep because the deadline was reached
+
+    def to_dict(self) -> dict:
+        return {
+            "scanned": self.scanned,
+            "reclaimed": self.reclaimed,
+            "freed_ips": self.freed_ips,
+            "failed": self.failed,
+            "skipped": self.skipped
+        }
+
+
+class OrphanedInterfaceCollector:
+    # Deletes managed interfaces left available by an invocation that timed out before it could clean up, so they
+    # do not slowly exhaust the management subnets
+    def __init__(self, config: EnvironmentConfig, aws_client: AwsClient):
+        self.config: EnvironmentConfig = config
+        self.aws_client: AwsClient = aws_client
+
+    def is_orphaned(self, interface: dict, now: float) -> bool:
+        # Warm pool interfaces are evicted by the pool itself while it is enabled
+        if self.config.warm_pool_size > 0 and tag_value(interface, WARM_POOL_TAG_KEY) is not None:
+            return False
+        # Interfaces created before the creation time was tagged have no known age, they are never deleted
+        created_at = tag_value(interface, CREATED_AT_TAG_KEY)
+        if created_at is None or not created_at.isdigit():
+            return False
+        return now - int(created_at) >= self.config.orphan_min_age
+
+    def sweep(self, deadline: Optional[Deadline] = None) -> SweepResult:
+        deadline = deadline or Deadline()
+        interfaces = self.aws_client.get_available_managed_interfaces(
+            self.config.all_subnet_ids(), self.config.security_group_id
+        )
+        now = time.time()
+        orphans = [interface for interface in interfaces if self.is_orphaned(interface, now)]
+        result = SweepResult(scanned=len(interfaces))
+
+        batch_size = max(1, self.config.orphan_delete_batch_size)
+        batch_interval = batch_size / self.config.orphan_delete_rate if self.config.orphan_delete_rate > 0 else 0
+        for start in range(0, len(orphans), batch_size):
+            if deadline.remaining() < batch_interval:
+                result.skipped = len(orphans) - start
+                logging.info(f"deadline reached, leaving {result.skipped} orphaned interfaces for the next sweep")
+                break
+
+            batch_started = time.monotonic()
+            batch = orphans[start:start + batch_size]
+            futures = [
+                (interface, self.aws_client.executor.submit(self.aws_client.delete_interface, interface['NetworkInterfaceId']))
+                for interface in batch
+            ]
+            for interface, future in futures:
+                try:
+                    future.result()
+                    result.reclaimed += 1
+                    result.freed_ips += len(interface.get('PrivateIpAddresses', [])) + len(interface.get('Ipv6Addresses', []))
+                    logging.info(f"reclaimed orphaned interface {interface['NetworkInterfaceId']}")
+                except Exception as e:
+                    # Usually attached by a concurrent invocation since it was listed
+                    result.failed += 1
+                    logging.error(f"unable to reclaim orphaned interface {interface['NetworkInterfaceId']}: {e}")
+
+            # Spread the deletes out so a large sweep does not eat into the EC2 request rate of launches
+            if start + batch_size < len(orphans):
+                time.sleep(max(0.0, batch_interval - (time.monotonic() - batch_started)))
+
+        self.aws_client.metrics.put(
+            {
+                MetricNames.ORPHANED_INTERFACES_RECLAIMED.value: (result.reclaimed, "Count"),
+                MetricNames.ORPHANED_IPS_FREED.value: (result.freed_ips, "Count")
+            },
+            {"SecurityGroupId": self.config.security_group_id},
+            result.to_dict()
+        )
+        logging.info(f"orphaned interface sweep finished: {json.dumps(result.to_dict())}")
+        return result
+
+
+class IdempotencyStatus(Enum):
+    IN_PROGRESS = "IN_PROGRESS"
+    COMPLETED = "COMPLETED"
+
+
+@dataclass
+class IdempotencyRecord:
+    status: IdempotencyStatus
+    expires_at: float
+    action: Optional[str] = None  # The LifecycleActionResult posted, once completed
+
+    def to_dict(self) -> dict:
+        return {"status": self.status.value, "expires_at": self.expires_at, "action": self.action}
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "IdempotencyRecord":
+        return cls(IdempotencyStatus(record['status']), float(record['expires_at']), record.get('action'))
+
+
+class IdempotencyStore(abc.ABC):
+    # Records which lifecycle action tokens have been handled. claim() atomically marks a token as in progress and
+    # returns None, or returns the live record when the token was already claimed.
+    @abc.abstractmethod
+    def claim(self, key: str, ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> Optional[IdempotencyRecord]:
+        pass
+
+    @abc.abstractmethod
+    def complete(self, key: str, action: LifecycleActionResult):
+        pass
+
+    @abc.abstractmethod
+    def release(self, key: str):
+        pass
+
+    @staticmethod
+    def in_progress(ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> IdempotencyRecord:
+        return IdempotencyRecord(IdempotencyStatus.IN_PROGRESS, time.time() + ttl)
+
+    @staticmethod
+    def completed(action: LifecycleActionResult) -> IdempotencyRecord:
+        return IdempotencyRecord(IdempotencyStatus.COMPLETED, time.time() + IDEMPOTENCY_COMPLETED_TTL, action.value)
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    # LRU cache living in the warm container
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> Optional[IdempotencyRecord]:
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record.expires_at > time.time():
+                self._records.move_to_end(key)
+                return record
+            self._put(key, self.in_progress(ttl))
+            return None
+
+    def complete(self, key: str, action: LifecycleActionResult):
+        with self._lock:
+            self._put(key, self.completed(action))
+
+    def release(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def _put(self, key: str, record: IdempotencyRecord):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+
+class FileIdempotencyStore(IdempotencyStore):
+    # JSON file guarded by an exclusive lock, shared by local processes. Intended for tests and local runs.
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _records(self):
+        with open(self.path, "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                content = fh.read()
+                now = time.time()
+                records = {
+                    key: IdempotencyRecord.from_dict(record)
+                    for key, record in (json.loads(content) if content else {}).items()
+                    if float(record['expires_at']) > now
+                }
+                yield records
+                fh.seek(0)
+                fh.truncate()
+                json.dump({key: record.to_dict() for key, record in records.items()}, fh)
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def claim(self, key: str, ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> Optional[IdempotencyRecord]:
+        with self._records() as records:
+            if key in records:
+                return records[key]
+            records[key] = self.in_progress(ttl)
+            return None
+
+    def complete(self, key: str, action: LifecycleActionResult):
+        with self._records() as records:
+            records[key] = self.completed(action)
+
+    def release(self, key: str):
+        with self._records() as records:
+            records.pop(key, None)
+
+
+class DynamoDbIdempotencyStore(IdempotencyStore):
+    # Items are keyed on `token` and expire through the table's TTL on `expires_at`
+    def __init__(self, table_name: str, dynamodb_client):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client
+
+    @staticmethod
+    def _item(key: str, record: IdempotencyRecord) -> dict:
+        item = {
+            "token": {"S": key},
+            "status": {"S": record.status.value},
+            "expires_at": {"N": str(int(record.expires_at))}
+        }
+        if record.action:
+            item["action"] = {"S": record.action}
+        return item
+
+    def claim(self, key: str, ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> Optional[IdempotencyRecord]:
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item=self._item(key, self.in_progress(ttl)),
+                ConditionExpression="attribute_not_exists(#token) OR expires_at < :now",
+                ExpressionAttributeNames={"#token": "token"},
+                ExpressionAttributeValues={":now": {"N": str(int(time.time()))}},
+                ReturnValuesOnConditionCheckFailure="ALL_OLD"
+            )
+            return None
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != "ConditionalCheckFailedException":
+                logging.error(f"[{e.response['Error']['Message']}] error claiming idempotency token {key}: {e}")
+                raise e
+
+            item = e.response.get('Item', {})
+            return IdempotencyRecord(
+                IdempotencyStatus(item.get('status', {}).get('S', IdempotencyStatus.IN_PROGRESS.value)),
+                float(item.get('expires_at', {}).get('N', time.time() + IDEMPOTENCY_IN_PROGRESS_TTL)),
+                item.get('action', {}).get('S')
+            )
+
+    def complete(self, key: str, action: LifecycleActionResult):
+        try:
+            self.dynamodb_client.put_item(TableName=self.table_name, Item=self._item(key, self.completed(action)))
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error completing idempotency token {key}: {e}")
+            raise e
+
+    def release(self, key: str):
+        try:
+            self.dynamodb_client.delete_item(TableName=self.table_name, Key={"token": {"S": key}})
+        except botocore.exceptions.ClientError as e:
+            logging.error(f"[{e.response['Error']['Message']}] error releasing idempotency token {key}: {e}")
+            raise e
+
+
+class LayeredIdempotencyStore(IdempotencyStore):
+    # Answers duplicates seen by this container from memory and only asks the shared store about new tokens
+    def __init__(self, local: IdempotencyStore, shared: IdempotencyStore):
+        self.local = local
+        self.shared = shared
+
+    def claim(self, key: str, ttl: float = IDEMPOTENCY_IN_PROGRESS_TTL) -> Optional[IdempotencyRecord]:
+        record = self.local.claim(key, ttl)
+        if record is not None:
+            return record
+
+        try:
+            record = self.shared.claim(key, ttl)
+        except Exception:
+            self.local.release(key)
+            raise
+
+        if record is not None and record.status == IdempotencyStatus.COMPLETED:
+            self.local.complete(key, LifecycleActionResult(record.action))
+        elif record is not None:
+            # Another container is working on it, ask the shared store again next time
+            self.local.release(key)
+        return record
+
+    def complete(self, key: str, action: LifecycleActionResult):
+        self.local.complete(key, action)
+        self.shared.complete(key, action)
+
+    def release(self, key: str):
+        self.local.release(key)
+        self.shared.release(key)
+
+
+class AsyncAwsClient:
+    # asyncio surface of AwsClient. botocore has no async transport, so each call runs the blocking AwsClient method
+    # on its bounded executor and retries, rate limiting and the deadline behave exactly as on the sync path. Without
+    # offload the call is made inline, for an event loop that only ever runs a single event
+    def __init__(self, aws_client: AwsClient, offload: bool = True):
+        self.aws_client: AwsClient = aws_client
+        self.offload: bool = offload
+
+    @property
+    def metrics(self) -> MetricsLogger:
+        return self.aws_client.metrics
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        return self.aws_client.executor
+
+    def bounded_by(self, deadline: Optional[Deadline]):
+        return self.aws_client.bounded_by(deadline)
+
+    async def _run(self, method, *args, **kwargs):
+        if not self.offload:
+            return method(*args, **kwargs)
+        import asyncio
+
+        # The call runs in a copy of the task's context, so the budget it was made within bounds its retries
+        return await asyncio.get_running_loop().run_in_executor(
+            self.aws_client.executor, functools.partial(contextvars.copy_context().run, method, *args, **kwargs)
+        )
+
+    async def get_instance_details(self, instance_id: str) -> dict:
+        return await self._run(self.aws_client.get_instance_details, instance_id)
+
+    async def get_instances_details(self, instance_ids: List[str]) -> dict:
+        return await self._run(self.aws_client.get_instances_details, instance_ids)
+
+    async def create_interface(self, subnet_id: str, security_group_id: str, tags: Optional[dict] = None) -> str:
+        if tags is None:
+            return await self._run(self.aws_client.create_interface, subnet_id, security_group_id)
+        return await self._run(self.aws_client.create_interface, subnet_id, security_group_id, tags)
+
+    async def get_subnets(self, subnet_ids: List[str]) -> List[dict]:
+        return await self._run(self.aws_client.get_subnets, subnet_ids)
+
+    async def get_interface(self, interface_id: str) -> Optional[dict]:
+        return await self._run(self.aws_client.get_interface, interface_id)
+
+    async def get_warm_pool_interfaces(self, subnet_ids: List[str], security_group_id: str) -> List[dict]:
+        return await self._run(self.aws_client.get_warm_pool_interfaces, subnet_ids, security_group_id)
+
+    async def get_available_managed_interfaces(self, subnet_ids: List[str], security_group_id: str) -> List[dict]:
+        return await self._run(self.aws_client.get_available_managed_interfaces, subnet_ids, security_group_id)
+
+    async def untag_interface(self, interface_id: str, tag_keys: List[str]):
+        return await self._run(self.aws_client.untag_interface, interface_id, tag_keys)
+
+    async def attach_interface(self, interface_id: str, instance_id: str) -> dict:
+        return await self._run(self.aws_client.attach_interface, interface_id, instance_id)
+
+    async def modify_attachment_to_delete_on_termination(self, attachment_id: str, network_interface_id: str):
+        return await self._run(
+            self.aws_client.modify_attachment_to_delete_on_termination, attachment_id, network_interface_id
+        )
+
+    async def detach_interface(self, attachment_id: str, interface_id: str):
+        return await self._run(self.aws_client.detach_interface, attachment_id, interface_id)
+
+    async def delete_interface(self, interface_id: str) -> dict:
+        return await self._run(self.aws_client.delete_interface, interface_id)
+
+    async def complete_lifecycle_action(
+            self,
+            lifecycle_hook_name: str,
+            auto_scaling_group_name: str,
+            instance_id: str,
+            lifecycle_action_token: str,
+            lifecycle_action_result: LifecycleActionResult
+    ):
+        return await self._run(
+            self.aws_client.complete_lifecycle_action,
+            lifecycle_hook_name=lifecycle_hook_name,
+            auto_scaling_group_name=auto_scaling_group_name,
+            instance_id=instance_id,
+            lifecycle_action_token=lifecycle_action_token,
+            lifecycle_action_result=lifecycle_action_result
+        )
+
+    async def record_lifecycle_action_heartbeat(
+            self,
+            lifecycle_hook_name: str,
+            auto_scaling_group_name: str,
+            instance_id: str,
+            lifecycle_action_token: str
+    ):
+        return await self._run(
+            self.aws_client.record_lifecycle_action_heartbeat,
+            lifecycle_hook_name=lifecycle_hook_name,
+            auto_scaling_group_name=auto_scaling_group_name,
+            instance_id=instance_id,
+            lifecycle_action_token=lifecycle_action_token
+        )
+
+
+class AsyncLifecycleEventService:
+    # Every step of handling a lifecycle event, as coroutines, so one event loop can interleave all the events of an
+    # invocation. With offload, AWS calls are awaited on the client's executor and other blocking work, the idempotency
+    # store, subnet selector and warm pool, on the loop's default executor. Without it everything runs inline, which
+    # is how LifecycleEventService drives the same steps
+    def __init__(
+            self,
+            config: EnvironmentConfig,
+            aws_client: AwsClient,
+            idempotency_store: Optional[IdempotencyStore] = None,
+            tracer: Optional[TraceExporter] = None,
+            offload: bool = True
+    ):
+        self.config: EnvironmentConfig = config
+        self.aws_client: AwsClient = aws_client
+        self.async_client: AsyncAwsClient = AsyncAwsClient(aws_client, offload)
+        self.offload: bool = offload
+        self.idempotency_store: IdempotencyStore = idempotency_store or InMemoryIdempotencyStore()
+        self.tracer: TraceExporter = tracer or TraceExporter()
+        self.warm_pool: Optional[WarmInterfacePool] = \
+            WarmInterfacePool(config, aws_client) if config.warm_pool_size > 0 else None
+        self.subnet_selector: SubnetSelector = SubnetSelector(config, aws_client)
+        self.instance_data = {}
+        self._cancellation_tokens = {}
+        self._cancellation_lock = threading.Lock()
+
+    async def _blocking(self, function, *args):
+        # Work that blocks without going through AsyncAwsClient. The warm pool refill waits on futures of the
+        # client's executor, so this uses the default executor rather than that one
+        if not self.offload:
+            return function(*args)
+        import asyncio
+
+        return await asyncio.to_thread(function, *args)
+
+    async def _sleep(self, seconds: float):
+        if not self.offload:
+            time.sleep(seconds)
+            return
+        import asyncio
+
+        await asyncio.sleep(seconds)
+
+    def cancel(self, instance_id: str) -> bool:
+        # Stops provisioning of an in-flight instance at its next step and cleans up what was already done
+        with self._cancellation_lock:
+            token = self._cancellation_tokens.get(instance_id)
+        if token is None:
+            return False
+
+        logging.info(f"cancelling provisioning of instance {instance_id}")
+        token.cancel()
+        return True
+
+    async def process_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: Optional[dict] = None,
+            cancellation: Optional[CancellationToken] = None,
+            deadline: Optional[Deadline] = None,
+            cleanup_deadline: Optional[Deadline] = None
+    ) -> dict:
+        instance_data = self.instance_data if instance_data is None else instance_data
+        cancellation = cancellation or CancellationToken()
+        deadline = deadline or Deadline()
+        step_latency_ms = {}
+
+        # Get the AZ of the instance
+        instance_az = instance_data['Placement']['AvailabilityZone']
+        logging.info(f"Instance {event.instance_id} is in AZ {instance_az}")
+
+        # Find the matching management subnet for this AZ
+        if not self.config.subnets_for(instance_az):
+            raise Exception(f"No management subnet configured for AZ {instance_az}. Available AZs: {list(self.config.subnet_map.keys())}")
+
+        target_subnet_ids = await self._blocking(self.subnet_selector.candidates, self.config.subnets_for(instance_az))
+        logging.info(f"Using management subnets {target_subnet_ids} for AZ {instance_az}")
+
+        cancellation.raise_if_cancelled(event.instance_id)
+        claimed = None
+        if self.warm_pool is not None:
+            with timed_step(step_latency_ms, "claim_warm_interface"):
+                for target_subnet_id in target_subnet_ids:
+                    claimed = await self._claim_warm_interface(target_subnet_id, event.instance_id)
+                    if claimed:
+                        break
+        if claimed:
+            network_interface_id, attachment_resp = claimed
+        else:
+            deadline.require(STEP_BUDGETS["create_interface"], "create_interface")
+            with timed_step(step_latency_ms, "create_interface"):
+                network_interface_id = await self.create_interface(target_subnet_ids)
+
+        # Undo steps are run in reverse order if a later step fails or provisioning is cancelled
+        cleanup_steps = [
+            (f"Deleting {network_interface_id}", self.async_client.delete_interface, (network_interface_id,))
+        ]
+        try:
+            if not claimed:
+                cancellation.raise_if_cancelled(event.instance_id)
+                deadline.require(STEP_BUDGETS["attach_interface"], "attach_interface")
+                with timed_step(step_latency_ms, "attach_interface"):
+                    attachment_resp = await self.async_client.attach_interface(network_interface_id, event.instance_id)
+            cleanup_steps.append((
+                f"Detaching {network_interface_id} from {event.instance_id}",
+                self.async_client.detach_interface,
+                (attachment_resp["AttachmentId"], network_interface_id)
+            ))
+
+            if self.config.attachment_wait_timeout > 0:
+                cancellation.raise_if_cancelled(event.instance_id)
+                with timed_step(step_latency_ms, "wait_for_attachment"):
+                    await self.wait_for_attachment(
+                        event, network_interface_id, deadline.reserve(STEP_BUDGETS["modify_attachment"])
+                    )
+
+            cancellation.raise_if_cancelled(event.instance_id)
+            deadline.require(STEP_BUDGETS["modify_attachment"], "modify_attachment")
+            with timed_step(step_latency_ms, "modify_attachment"):
+                await self.async_client.modify_attachment_to_delete_on_termination(
+                    attachment_resp["AttachmentId"], network_interface_id
+                )
+        except Exception as e:
+            logging.error(f"unable to attach NIC {network_interface_id}: {e}")
+            await self._cleanup(cleanup_steps, cleanup_deadline)
+            raise e
+
+        return step_latency_ms
+
+    async def create_interface(self, subnet_ids: List[str]) -> str:
+        for index, subnet_id in enumerate(subnet_ids):
+            try:
+                interface_id = await self.async_client.create_interface(subnet_id, self.config.security_group_id)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != "InsufficientFreeAddressesInSubnet" or index == len(subnet_ids) - 1:
+                    raise e
+                logging.warning(f"subnet {subnet_id} has no free addresses, falling over to {subnet_ids[index + 1]}")
+                self.subnet_selector.mark_exhausted(subnet_id)
+                continue
+
+            self.subnet_selector.consume(subnet_id)
+            return interface_id
+
+    async def wait_for_attachment(self, event: Ec2LifecycleHookEvent, interface_id: str, deadline: Deadline) -> dict:
+        # EC2 accepts the attachment before it is complete. Poll with jittered exponential backoff until it is
+        # attached, so the sensor boots with its management interface present
+        deadline = deadline.within(self.config.attachment_wait_timeout)
+        delay = ATTACHMENT_POLL_INITIAL_DELAY
+        last_heartbeat = time.monotonic()
+        polls = 0
+        while True:
+            interface = await self.async_client.get_interface(interface_id)
+            polls += 1
+            status = (interface or {}).get('Attachment', {}).get('Status')
+            if status == "attached":
+                logging.info(f"interface {interface_id} attached to {event.instance_id} after {polls} polls")
+                return interface
+
+            if interface is None or status in ("detaching", "detached"):
+                raise Exception(f"attachment of {interface_id} to {event.instance_id} failed with status {status}")
+
+            if deadline.remaining() < delay:
+                raise AttachmentTimeout(
+                    f"interface {interface_id} is still {status} on {event.instance_id} after {polls} polls")
+
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                await self.record_heartbeat(event)
+                last_heartbeat = time.monotonic()
+
+            await self._sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, ATTACHMENT_POLL_MAX_DELAY)
+
+    def record_launch_to_continue(self, event: Ec2LifecycleHookEvent, instance_data: dict):
+        # Prefer the instance launch time, the event time is the closest substitute when describe data came from JSON
+        launched_at = instance_data.get('LaunchTime')
+        try:
+            if not isinstance(launched_at, datetime):
+                launched_at = datetime.fromisoformat(event.event_time.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            return
+
+        latency_ms = (datetime.now(timezone.utc) - launched_at).total_seconds() * 1000
+        self.aws_client.metrics.put(
+            {MetricNames.LAUNCH_TO_CONTINUE_LATENCY.value: (round(latency_ms, 3), "Milliseconds")},
+            {"AutoScalingGroupName": event.autoscaling_group_name},
+            {"InstanceId": event.instance_id}
+        )
+
+    async def record_heartbeat(self, event: Ec2LifecycleHookEvent):
+        # Extends the lifecycle hook timeout, failing to do so only shortens the time left before it expires
+        try:
+            await self.async_client.record_lifecycle_action_heartbeat(
+                lifecycle_hook_name=event.lifecycle_hook_name,
+                auto_scaling_group_name=event.autoscaling_group_name,
+                instance_id=event.instance_id,
+                lifecycle_action_token=event.lifecycle_action_token
+            )
+        except Exception as e:
+            logging.error(f"unable to record a lifecycle heartbeat for {event.instance_id}: {e}")
+
+    def lifecycle_hook_remaining(self, event: Ec2LifecycleHookEvent) -> Optional[float]:
+        # Seconds before the hook times out if no heartbeat was recorded since the event, None when unknown
+        try:
+            emitted_at = datetime.fromisoformat(event.event_time.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            return None
+        return self.config.lifecycle_hook_timeout - (datetime.now(timezone.utc) - emitted_at).total_seconds()
+
+    async def extend_lifecycle_hook(self, event: Ec2LifecycleHookEvent, deadline: Deadline):
+        # An event delivered late, from a batch window or a redelivery, may leave the hook less time than this
+        # invocation can still take. The heartbeat restarts its timeout so the result posted at the end is accepted
+        hook_remaining = self.lifecycle_hook_remaining(event)
+        if hook_remaining is not None and hook_remaining < deadline.remaining():
+            logging.info(f"lifecycle hook of {event.instance_id} times out in {hook_remaining:.1f}s, recording a heartbeat")
+            await self.record_heartbeat(event)
+
+    async def _claim_warm_interface(self, subnet_id: str, instance_id: str) -> Optional[tuple]:
+        try:
+            return await self._blocking(self.warm_pool.claim, subnet_id, instance_id)
+        except Exception as e:
+            # The pool is only an optimization, creating a new interface is always possible
+            logging.error(f"unable to claim a warm pool interface for {instance_id}, creating one instead: {e}")
+            return None
+
+    async def refill_warm_pool(self):
+        # Runs once lifecycle actions have been completed so the refill stays off the launch path
+        if self.warm_pool is None:
+            return
+
+        try:
+            await self._blocking(self.warm_pool.refill, self.config.all_subnet_ids())
+        except Exception as e:
+            logging.error(f"unable to refill the warm interface pool: {e}")
+
+    async def _cleanup(self, cleanup_steps: list, deadline: Optional[Deadline] = None):
+        # Runs on the time kept back from provisioning, short of what posting the result needs. Detaching polls until
+        # the interface is free, so without a bound it could take all of it
+        with self.async_client.bounded_by(deadline or self.aws_client.deadline.reserve(RESULT_RESERVE)):
+            for description, step, args in reversed(cleanup_steps):
+                logging.info(description)
+                try:
+                    await step(*args)
+                except Exception as e:
+                    logging.error(f"cleanup step failed: {description}: {e}")
+
+    async def get_instance_data(self, instance_id: str) -> dict:
+        return (await self.async_client.get_instance_details(instance_id))['Reservations'][0]['Instances'][0]
+
+    async def should_process_event(self, event: Ec2LifecycleHookEvent, instance_data: Optional[dict] = None) -> bool:
+        if instance_data is None:
+            self.instance_data = await self.get_instance_data(event.instance_id)
+            instance_data = self.instance_data
+
+        if event.destination != "AutoScalingGroup":
+            logging.error(f"Destination should be 'AutoScalingGroup' and it is set to {event.destination}")
+            return False
+
+        state, _ = self.inspect_interfaces(event, instance_data)
+        if state == ManagementInterfaceState.INCONSISTENT:
+            logging.error(f"instance {event.instance_id} has network interfaces that can not be reconciled")
+            return False
+
+        return True
+
+    def inspect_interfaces(self, event: Ec2LifecycleHookEvent, instance_data: dict) -> tuple:
+        # A retry after a partial success finds the management interface already attached. Accept it when it is in
+        # the right place, so the instance is not abandoned and relaunched
+        interfaces = instance_data['NetworkInterfaces']
+        if len(interfaces) <= 1:
+            return ManagementInterfaceState.MISSING, None
+
+        by_index = {}
+        for interface in interfaces:
+            by_index.setdefault(interface.get('Attachment', {}).get('DeviceIndex'), []).append(interface)
+        if len(interfaces) > 2 or len(by_index.get(0, [])) != 1 or len(by_index.get(MANAGEMENT_DEVICE_INDEX, [])) != 1:
+            logging.error(f"instance {event.instance_id} has unexpected interfaces at device indexes {sorted(by_index, key=str)}")
+            return ManagementInterfaceState.INCONSISTENT, None
+
+        interface = by_index[MANAGEMENT_DEVICE_INDEX][0]
+        expected_subnet_ids = self.config.subnets_for(instance_data['Placement']['AvailabilityZone'])
+        group_ids = [group['GroupId'] for group in interface.get('Groups', [])]
+        if interface['SubnetId'] not in expected_subnet_ids or self.config.security_group_id not in group_ids:
+            logging.error(f"interface {interface['NetworkInterfaceId']} on instance {event.instance_id} is in subnet "
+                          f"{interface['SubnetId']} with groups {group_ids}, expected one of {expected_subnet_ids} "
+                          f"with group {self.config.security_group_id}")
+            return ManagementInterfaceState.INCONSISTENT, None
+
+        if interface['Attachment'].get('Status') not in ("attaching", "attached"):
+            logging.error(f"interface {interface['NetworkInterfaceId']} on instance {event.instance_id} is "
+                          f"{interface['Attachment'].get('Status')}")
+            return ManagementInterfaceState.INCONSISTENT, None
+
+        return ManagementInterfaceState.ATTACHED, interface
+
+    async def reconcile_interface(
+            self,
+            event: Ec2LifecycleHookEvent,
+            interface: dict,
+            deadline: Optional[Deadline] = None
+    ) -> dict:
+        step_latency_ms = {}
+        interface_id = interface['NetworkInterfaceId']
+        attachment = interface['Attachment']
+        logging.info(f"Reconciling interface {interface_id} already attached to instance {event.instance_id}")
+
+        if attachment.get('Status') == "attaching" and self.config.attachment_wait_timeout > 0:
+            with timed_step(step_latency_ms, "wait_for_attachment"):
+                await self.wait_for_attachment(event, interface_id, deadline or Deadline())
+
+        if not attachment.get('DeleteOnTermination'):
+            with timed_step(step_latency_ms, "modify_attachment"):
+                await self.async_client.modify_attachment_to_delete_on_termination(
+                    attachment['AttachmentId'], interface_id
+                )
+
+        return step_latency_ms
+
+    async def complete_lifecycle_action(self, event: Ec2LifecycleHookEvent, action: LifecycleActionResult):
+        return await self.async_client.complete_lifecycle_action(
+            lifecycle_hook_name=event.lifecycle_hook_name,
+            auto_scaling_group_name=event.autoscaling_group_name,
+            instance_id=event.instance_id,
+            lifecycle_action_token=event.lifecycle_action_token,
+            lifecycle_action_result=action
+        )
+
+    async def handle_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: Optional[dict] = None,
+            cancellation: Optional[CancellationToken] = None,
+            deadline: Optional[Deadline] = None,
+            claimed: bool = False,
+            previous: Optional[IdempotencyRecord] = None
+    ) -> LifecycleEventResult:
+        # With `claimed`, the caller already claimed the event's token and `previous` is the record it found
+        deadline = deadline or Deadline()
+        with metrics_dimension(event.autoscaling_group_name), self.tracer.trace(event) as trace:
+            if not claimed:
+                previous = await self.claim(event, deadline)
+            if previous is not None:
+                result = self.skip_duplicate(event, previous)
+            else:
+                result = await self._handle_event(event, instance_data, cancellation, deadline)
+            if trace is not None:
+                trace.finish(result)
+            return result
+
+    async def claim(self, event: Ec2LifecycleHookEvent, deadline: Deadline) -> Optional[IdempotencyRecord]:
+        # The claim lasts as long as this invocation can run, so the redelivery of an event it crashed or timed out on
+        # is not mistaken for a duplicate
+        ttl = IDEMPOTENCY_IN_PROGRESS_TTL if deadline.expires_at is None else deadline.remaining() + DEADLINE_RESERVE
+        try:
+            return await self._blocking(self.idempotency_store.claim, event.lifecycle_action_token, ttl)
+        except Exception as e:
+            # Failing open keeps launches working, duplicates are still caught by the attach on DeviceIndex 1
+            logging.error(f"unable to check whether the event for {event.instance_id} is a duplicate: {e}")
+            return None
+
+    @staticmethod
+    def skip_duplicate(event: Ec2LifecycleHookEvent, previous: IdempotencyRecord) -> LifecycleEventResult:
+        logging.info(f"skipping duplicate event for instance {event.instance_id}, "
+                     f"it is {previous.status.value} with result {previous.action}")
+        result = LifecycleEventResult(event, duplicate=True)
+        if previous.status == IdempotencyStatus.COMPLETED and previous.action:
+            result.action = LifecycleActionResult(previous.action)
+        return result
+
+    async def _handle_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: Optional[dict],
+            cancellation: Optional[CancellationToken],
+            deadline: Deadline
+    ) -> LifecycleEventResult:
+        result = LifecycleEventResult(event)
+        if event.terminating:
+            return await self.handle_terminate_event(event, result, instance_data, deadline)
+
+        # Provisioning works within a budget that leaves FINALIZE_RESERVE seconds to clean up and post the result
+        budget = deadline.reserve(FINALIZE_RESERVE)
+        cleanup_deadline = deadline.reserve(RESULT_RESERVE)
+        try:
+            await self.extend_lifecycle_hook(event, deadline)
+            action = LifecycleActionResult.CONTINUE
+            provisioned = False
+            if instance_data is None:
+                trusted = self.trusted_instance_data(event)
+                if trusted is not None:
+                    try:
+                        result.step_latency_ms.update(await self.provision(
+                            event, trusted, cancellation, budget, cleanup_deadline
+                        ))
+                        instance_data, provisioned = trusted, True
+                    except (ProvisioningCancelled, DeadlineExceeded):
+                        raise
+                    except Exception as e:
+                        # Most likely a retry that finds the management interface already attached, describing the
+                        # instance lets the usual path reconcile it
+                        logging.warning(f"provisioning {event.instance_id} from event data failed, "
+                                        f"describing the instance: {e}")
+
+            if not provisioned:
+                if instance_data is None:
+                    budget.require(STEP_BUDGETS["describe_instance"], "describe_instance")
+                    with timed_step(result.step_latency_ms, "describe_instance"), self.async_client.bounded_by(budget):
+                        instance_data = await self.get_instance_data(event.instance_id)
+
+                if await self.should_process_event(event, instance_data):
+                    result.step_latency_ms.update(
+                        await self.provision(event, instance_data, cancellation, budget, cleanup_deadline)
+                    )
+                else:
+                    logging.error(f"Event validation failed for instance {event.instance_id}, "
+                                  f"abandoning lifecycle action")
+                    action = LifecycleActionResult.ABANDON
+
+            with timed_step(result.step_latency_ms, "complete_lifecycle_action"):
+                await self.complete_lifecycle_action(event, action)
+            result.action = action
+            if action == LifecycleActionResult.CONTINUE:
+                self.record_launch_to_continue(event, instance_data)
+                logging.info(f"Lifecycle action for instance {event.instance_id} completed successfully")
+        except Exception as e:
+            logging.error(f"failed to process event for instance {event.instance_id}: {e}")
+            result.error = e
+            try:
+                await self.complete_lifecycle_action(event, LifecycleActionResult.ABANDON)
+                result.action = LifecycleActionResult.ABANDON
+            except Exception as complete_error:
+                logging.error(f"Failed to complete lifecycle action with ABANDON: {complete_error}")
+
+        await self._blocking(self._record_idempotency, result)
+        logging.info(json.dumps({"instance_id": event.instance_id, "step_latency_ms": result.step_latency_ms}))
+        return result
+
+    def trusted_instance_data(self, event: Ec2LifecycleHookEvent) -> Optional[dict]:
+        # Stands in for describe_instances when the event and the deploy time subnet index are enough to place the
+        # management interface. Only the primary interface is assumed, anything else makes the attach fail
+        if not self.config.trust_event_data or event.destination != "AutoScalingGroup":
+            return None
+
+        availability_zone = self.config.single_availability_zone()
+        if availability_zone is None:
+            return None
+        return {
+            'InstanceId': event.instance_id,
+            'Placement': {'AvailabilityZone': availability_zone},
+            'NetworkInterfaces': [{}]
+        }
+
+    async def provision(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: dict,
+            cancellation: Optional[CancellationToken] = None,
+            deadline: Optional[Deadline] = None,
+            cleanup_deadline: Optional[Deadline] = None
+    ) -> dict:
+        state, interface = self.inspect_interfaces(event, instance_data)
+        with self.async_client.bounded_by(deadline):
+            if state == ManagementInterfaceState.ATTACHED:
+                return await self.reconcile_interface(event, interface, deadline)
+            return await self.process_event(event, instance_data, cancellation, deadline, cleanup_deadline)
+
+    async def handle_terminate_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            result: LifecycleEventResult,
+            instance_data: Optional[dict] = None,
+            deadline: Optional[Deadline] = None
+    ) -> LifecycleEventResult:
+        # Termination goes ahead whatever happens here, so a failed teardown is logged and left to the orphaned
+        # interface sweep rather than retried. It stops short of the time posting the result needs
+        self.cancel(event.instance_id)
+        try:
+            with self.async_client.bounded_by((deadline or Deadline()).reserve(RESULT_RESERVE)):
+                if instance_data is None:
+                    with timed_step(result.step_latency_ms, "describe_instance"):
+                        instance_data = await self.get_instance_data(event.instance_id)
+                with timed_step(result.step_latency_ms, "teardown_interfaces"):
+                    await self.teardown_interfaces(event, instance_data)
+        except Exception as e:
+            logging.error(f"unable to tear down the interfaces of terminating instance {event.instance_id}: {e}")
+
+        try:
+            with timed_step(result.step_latency_ms, "complete_lifecycle_action"):
+                await self.complete_lifecycle_action(event, LifecycleActionResult.CONTINUE)
+            result.action = LifecycleActionResult.CONTINUE
+            logging.info(f"Terminate lifecycle action for instance {event.instance_id} completed successfully")
+        except Exception as e:
+            logging.error(f"failed to complete the terminate lifecycle action for instance {event.instance_id}: {e}")
+            result.error = e
+
+        await self._blocking(self._record_idempotency, result)
+        logging.info(json.dumps({"instance_id": event.instance_id, "step_latency_ms": result.step_latency_ms}))
+        return result
+
+    async def teardown_interfaces(self, event: Ec2LifecycleHookEvent, instance_data: dict):
+        # Interfaces already marked DeleteOnTermination are removed by EC2, only the others need detaching first
+        management_subnet_ids = self.config.all_subnet_ids()
+        interfaces = [
+            interface for interface in instance_data.get('NetworkInterfaces', [])
+            if interface.get('Attachment', {}).get('DeviceIndex') != 0
+            and interface.get('SubnetId') in management_subnet_ids
+            and not interface['Attachment'].get('DeleteOnTermination')
+        ]
+        for interface in interfaces:
+            interface_id = interface['NetworkInterfaceId']
+            logging.info(f"Detaching and deleting interface {interface_id} of terminating instance {event.instance_id}")
+            await self.async_client.detach_interface(interface['Attachment']['AttachmentId'], interface_id)
+            await self.async_client.delete_interface(interface_id)
+
+    def _record_idempotency(self, result: LifecycleEventResult):
+        # Once a result has been posted the token is spent. Otherwise release it so a retry can try again
+        token = result.event.lifecycle_action_token
+        try:
+            if result.action is not None:
+                self.idempotency_store.complete(token, result.action)
+            else:
+                self.idempotency_store.release(token)
+        except Exception as e:
+            logging.error(f"unable to record the outcome of the event for {result.event.instance_id}: {e}")
+
+    async def process_events(
+            self,
+            events: List[Ec2LifecycleHookEvent],
+            deadline: Optional[Deadline] = None
+    ) -> List[LifecycleEventResult]:
+        deadline = deadline or Deadline()
+        # Claim the batch first, so duplicates are answered without describing their instances
+        previous = [await self.claim(event, deadline) for event in events]
+        claimed = [event for event, record in zip(events, previous) if record is None]
+
+        # Describe the whole batch at once; instances missing from the response are described on their own so a
+        # single bad instance ID only fails its own event
+        instance_ids = list(dict.fromkeys(
+            event.instance_id for event in claimed if event.terminating or self.trusted_instance_data(event) is None
+        ))
+        try:
+            instances = await self.async_client.get_instances_details(instance_ids) if instance_ids else {}
+        except Exception as e:
+            logging.error(f"unable to describe the batch of instances, describing them individually: {e}")
+            instances = {}
+
+        # Only launches can be cancelled, a terminate event in the same batch cancels the launch of its instance
+        tokens = {event.instance_id: CancellationToken() for event in claimed if not event.terminating}
+        with self._cancellation_lock:
+            self._cancellation_tokens.update(tokens)
+
+        def handle(e: Ec2LifecycleHookEvent, record: Optional[IdempotencyRecord]):
+            return self.handle_event(
+                e, instances.get(e.instance_id), tokens.get(e.instance_id), deadline, claimed=True, previous=record
+            )
+
+        try:
+            if self.offload:
+                import asyncio
+
+                # Every event runs on this loop at once, the client's executor bounds the API calls in flight
+                return list(await asyncio.gather(*[handle(e, record) for e, record in zip(events, previous)]))
+
+            if self.config.max_concurrency <= 1 or len(claimed) <= 1:
+                return [await handle(e, record) for e, record in zip(events, previous)]
+
+            # Inline calls never suspend, so provision every instance on a thread of the client's bounded pool instead.
+            # handle_event never raises, so each future resolves to the per-event result
+            futures = [
+                self.aws_client.executor.submit(run_inline, handle(e, record)) for e, record in zip(events, previous)
+            ]
+            return [future.result() for future in futures]
+        finally:
+            with self._cancellation_lock:
+                for instance_id, token in tokens.items():
+                    if self._cancellation_tokens.get(instance_id) is token:
+                        del self._cancellation_tokens[instance_id]
+
+
+class LifecycleEventService:
+    # Blocking surface of AsyncLifecycleEventService. The steps run with their calls made inline, so their coroutines
+    # are driven to completion directly and asyncio is never imported
+    def __init__(
+            self,
+            config: EnvironmentConfig,
+            aws_client: AwsClient,
+            idempotency_store: Optional[IdempotencyStore] = None,
+            tracer: Optional[TraceExporter] = None
+    ):
+        self.config: EnvironmentConfig = config
+        self.aws_client: AwsClient = aws_client
+        self.steps: AsyncLifecycleEventService = \
+            AsyncLifecycleEventService(config, aws_client, idempotency_store, tracer, offload=False)
+
+    @property
+    def idempotency_store(self) -> IdempotencyStore:
+        return self.steps.idempotency_store
+
+    @property
+    def tracer(self) -> TraceExporter:
+        return self.steps.tracer
+
+    @property
+    def warm_pool(self) -> Optional[WarmInterfacePool]:
+        return self.steps.warm_pool
+
+    @property
+    def subnet_selector(self) -> SubnetSelector:
+        return self.steps.subnet_selector
+
+    @property
+    def instance_data(self) -> dict:
+        return self.steps.instance_data
+
+    @instance_data.setter
+    def instance_data(self, instance_data: dict):
+        self.steps.instance_data = instance_data
+
+    def cancel(self, instance_id: str) -> bool:
+        return self.steps.cancel(instance_id)
+
+    def inspect_interfaces(self, event: Ec2LifecycleHookEvent, instance_data: dict) -> tuple:
+        return self.steps.inspect_interfaces(event, instance_data)
+
+    def trusted_instance_data(self, event: Ec2LifecycleHookEvent) -> Optional[dict]:
+        return self.steps.trusted_instance_data(event)
+
+    def get_instance_data(self, instance_id: str) -> dict:
+        return run_inline(self.steps.get_instance_data(instance_id))
+
+    def should_process_event(self, event: Ec2LifecycleHookEvent, instance_data: Optional[dict] = None) -> bool:
+        return run_inline(self.steps.should_process_event(event, instance_data))
+
+    def process_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: Optional[dict] = None,
+            cancellation: Optional[CancellationToken] = None,
+            deadline: Optional[Deadline] = None,
+            cleanup_deadline: Optional[Deadline] = None
+    ) -> dict:
+        return run_inline(self.steps.process_event(event, instance_data, cancellation, deadline, cleanup_deadline))
+
+    def wait_for_attachment(self, event: Ec2LifecycleHookEvent, interface_id: str, deadline: Deadline) -> dict:
+        return run_inline(self.steps.wait_for_attachment(event, interface_id, deadline))
+
+    def reconcile_interface(
+            self,
+            event: Ec2LifecycleHookEvent,
+            interface: dict,
+            deadline: Optional[Deadline] = None
+    ) -> dict:
+        return run_inline(self.steps.reconcile_interface(event, interface, deadline))
+
+    def complete_lifecycle_action(self, event: Ec2LifecycleHookEvent, action: LifecycleActionResult):
+        return run_inline(self.steps.complete_lifecycle_action(event, action))
+
+    def refill_warm_pool(self):
+        run_inline(self.steps.refill_warm_pool())
+
+    def handle_event(
+            self,
+            event: Ec2LifecycleHookEvent,
+            instance_data: Optional[dict] = None,
+            cancellation: Optional[CancellationToken] = None,
+            deadline: Optional[Deadline] = None,
+            claimed: bool = False,
+            previous: Optional[IdempotencyRecord] = None
+    ) -> LifecycleEventResult:
+        return run_inline(self.steps.handle_event(event, instance_data, cancellation, deadline, claimed, previous))
+
+    def process_events(
+            self,
+            events: List[Ec2LifecycleHookEvent],
+            deadline: Optional[Deadline] = None
+    ) -> List[LifecycleEventResult]:
+        return run_inline(self.steps.process_events(events, deadline))
+
+
+def run_inline(coroutine):
+    # Runs a coroutine of a service without offload to its end. Every await completes inline, so it never suspends and
+    # needs no event loop
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("coroutine suspended without an event loop to resume it")
+
+
+def run_sync(result):
+    # Lets callers drive either service, the async one returns coroutines which run on a fresh event loop
+    if not isinstance(result, types.CoroutineType):
+        return result
+    import asyncio
+
+    return asyncio.run(result)
+
+
+@dataclass
+class Fleet:
+    config: EnvironmentConfig
+    aws_client: AwsClient
+    lifecycle_event_svc: LifecycleEventService
+    preflight: PreflightValidator
+
+
+class FleetRouter:
+    # Serves the sensor group of the deployment and the additional fleets of FLEETS from one Lambda. Every fleet has
+    # its own AwsClient, so its own executor and rate limiters, and a batch is split per fleet with the parts run side
+    # by side, so one fleet's slow or failing calls do not hold up the others. Groups not in FLEETS use the default
+    def __init__(self, default: Fleet, fleets: Optional[Dict[str, Fleet]] = None):
+        self.default: Fleet = default
+        self.fleets: Dict[str, Fleet] = fleets or {}
+
+    def fleet_for(self, autoscaling_group_name: str) -> Fleet:
+        return self.fleets.get(autoscaling_group_name, self.default)
+
+    def all(self) -> List[Fleet]:
+        return [self.default, *self.fleets.values()]
+
+    def handles(self, event: Ec2LifecycleHookEvent) -> bool:
+        # The EventBridge rule matches the hook names of every fleet, so an event can pair a group with a hook of
+        # another group, or with a hook that belongs to something else entirely
+        hook_names = self.fleet_for(event.autoscaling_group_name).config.lifecycle_hook_names
+        if not hook_names or event.lifecycle_hook_name in hook_names:
+            return True
+        logging.error(f"ignoring the event of instance {event.instance_id}, lifecycle hook {event.lifecycle_hook_name} "
+                      f"is not one of {hook_names} configured for group {event.autoscaling_group_name}")
+        return False
+
+    def process_events(
+            self,
+            events: List[Ec2LifecycleHookEvent],
+            deadline: Optional[Deadline] = None
+    ) -> List[LifecycleEventResult]:
+        results: List[Optional[LifecycleEventResult]] = [None] * len(events)
+        groups = {}
+        for index, event in enumerate(events):
+            if not self.handles(event):
+                results[index] = LifecycleEventResult(event, ignored=True)
+                continue
+            fleet_name = event.autoscaling_group_name if event.autoscaling_group_name in self.fleets else None
+            groups.setdefault(fleet_name, []).append(index)
+
+        def process(fleet_name: Optional[str], indexes: List[int]) -> List[LifecycleEventResult]:
+            svc = self.fleets[fleet_name].lifecycle_event_svc if fleet_name else self.default.lifecycle_event_svc
+            return run_sync(svc.process_events([events[index] for index in indexes], deadline))
+
+        if len(groups) <= 1:
+            for fleet_name, indexes in groups.items():
+                for index, result in zip(indexes, process(fleet_name, indexes)):
+                    results[index] = result
+            return results
+
+        with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="nic-manager-fleet") as pool:
+            futures = {pool.submit(process, fleet_name, indexes): indexes for fleet_name, indexes in groups.items()}
+            for future, indexes in futures.items():
+                for index, result in zip(indexes, future.result()):
+                    results[index] = result
+        return results
+
+    def refill_warm_pools(self):
+        for fleet in self.all():
+            run_sync(fleet.lifecycle_event_svc.refill_warm_pool())
+
+    def validate(self):
+        for fleet in self.all():
+            fleet.preflight.validate()
+
+    def sweep(self, deadline: Optional[Deadline] = None) -> SweepResult:
+        total = SweepResult()
+        for fleet in self.all():
+            result = OrphanedInterfaceCollector(fleet.config, fleet.aws_client).sweep(deadline)
+            total.scanned += result.scanned
+            total.reclaimed += result.reclaimed
+            total.freed_ips += result.freed_ips
+            total.failed += result.failed
+            total.skipped += result.skipped
+        return total
+
+
+@dataclass
+class RuntimeContext:
+    environment: tuple
+    router: FleetRouter
+
+    # The deployment's own sensor group
+    @property
+    def config(self) -> EnvironmentConfig:
+        return self.router.default.config
+
+    @property
+    def aws_client(self) -> AwsClient:
+        return self.router.default.aws_client
+
+    @property
+    def lifecycle_event_svc(self) -> LifecycleEventService:
+        return self.router.default.lifecycle_event_svc
+
+    @property
+    def preflight(self) -> PreflightValidator:
+        return self.router.default.preflight
+
+
+# Built lazily on the first invocation and reused by every warm invocation of the same container
+_runtime_context: Optional[RuntimeContext] = None
+_runtime_context_lock = threading.Lock()
+
+
+def environment_fingerprint() -> tuple:
+    fingerprint = [os.getenv(variable.value, "") for variable in EnvironmentVariables]
+    fingerprint.extend(os.getenv(variable, "") for variable in ("AWS_REGION", "AWS_DEFAULT_REGION"))
+    return tuple(fingerprint)
+
+
+def create_boto_client(
+        service_name: str,
+        session=None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        region_name: Optional[str] = None,
+        retries: Optional[dict] = None
+):
+    import boto3.session
+    import botocore.config
+
+    session = session or boto3.session.Session()
+    client_config = dict(BOTO_CLIENT_CONFIG)
+    client_config["max_pool_connections"] = max(client_config["max_pool_connections"], max_concurrency)
+    if retries is not None:
+        client_config["retries"] = retries
+    return session.client(service_name, region_name=region_name or None, config=botocore.config.Config(**client_config))
+
+
+class ClientPool:
+    # One boto client per service and region, so fleets in the same region share its connection pool
+    def __init__(self, session, max_concurrency: int):
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self._clients = {}
+
+    def get(self, service_name: str, region_name: str = ""):
+        key = (service_name, region_name)
+        if key not in self._clients:
+            self._clients[key] = create_boto_client(service_name, self.session, self.max_concurrency, region_name)
+        return self._clients[key]
+
+
+def build_runtime_context() -> RuntimeContext:
+    fingerprint = environment_fingerprint()
+    config: EnvironmentConfig = parse_environment()
+    import boto3.session
+
+    session = boto3.session.Session()
+    # Every fleet's executor may have max_concurrency calls in flight on a shared client
+    clients = ClientPool(session, config.max_concurrency * (1 + len(config.fleets)))
+    metrics = MetricsLogger(config.metrics_namespace, config.metrics_enabled)
+    tracer = TraceExporter(config.trace_enabled, config.trace_otlp_endpoint)
+    idempotency_store = build_idempotency_store(config, session)
+    service_class = AsyncLifecycleEventService if config.async_pipeline else LifecycleEventService
+
+    def build_fleet(fleet_config: EnvironmentConfig) -> Fleet:
+        aws_client = AwsClient(
+            clients.get("ec2", fleet_config.region),
+            clients.get("autoscaling", fleet_config.region),
+            max_workers=fleet_config.max_concurrency,
+            metrics=metrics
+        )
+        return Fleet(
+            config=fleet_config,
+            aws_client=aws_client,
+            lifecycle_event_svc=service_class(fleet_config, aws_client, idempotency_store, tracer),
+            preflight=PreflightValidator(fleet_config, aws_client)
+        )
+
+    router = FleetRouter(
+        build_fleet(config),
+        {name: build_fleet(fleet_config) for name, fleet_config in config.fleet_configs().items()}
+    )
+    return RuntimeContext(environment=fingerprint, router=router)
+
+
+def build_idempotency_store(config: EnvironmentConfig, session=None) -> IdempotencyStore:
+    if config.idempotency_table_name:
+        dynamodb_client = create_boto_client("dynamodb", session, config.max_concurrency, retries=SDK_RETRIES)
+        shared = DynamoDbIdempotencyStore(config.idempotency_table_name, dynamodb_client)
+        return LayeredIdempotencyStore(InMemoryIdempotencyStore(), shared)
+
+    if config.idempotency_file:
+        return LayeredIdempotencyStore(InMemoryIdempotencyStore(), FileIdempotencyStore(config.idempotency_file))
+
+    return InMemoryIdempotencyStore()
+
+
+def get_runtime_context() -> RuntimeContext:
+    global _runtime_context
+    with _runtime_context_lock:
+        if _runtime_context is not None and _runtime_context.environment == environment_fingerprint():
+            return _runtime_context
+
+        if _runtime_context is not None:
+            logging.info("environment changed since the runtime context was built, rebuilding it")
+
+        _runtime_context = build_runtime_context()
+        return _runtime_context
+
+
+def reset_runtime_context():
+    global _runtime_context
+    with _runtime_context_lock:
+        _runtime_context = None
+
+
+def handle_sqs_batch(
+        lifecycle_event_svc: Union[LifecycleEventService, FleetRouter],
+        sqs_event: dict,
+        deadline: Optional[Deadline] = None
+) -> dict:
+    # Each SQS message body is an EventBridge lifecycle event. Only messages whose lifecycle action could not be
+    # completed are reported back, so SQS redelivers those and deletes the rest
+    batch_item_failures = []
+    message_ids = []
+    events = []
+    for record in sqs_event['Records']:
+        try:
+            events.append(from_aws_event_bridge_json(json.loads(record['body'])))
+            message_ids.append(record['messageId'])
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            logging.error(f"unable to parse lifecycle event from message {record.get('messageId')}: {e}")
+            batch_item_failures.append({"itemIdentifier": record.get('messageId')})
+
+    results = run_sync(lifecycle_event_svc.process_events(events, deadline))
+    for message_id, result in zip(message_ids, results):
+        if not result.completed:
+            batch_item_failures.append({"itemIdentifier": message_id})
+
+    logging.info(f"processed {len(results)} lifecycle events, {len(batch_item_failures)} failed")
+    return {"batchItemFailures": batch_item_failures}
+
+
+def lambda_handler(event, context):
+    logging.getLogger().setLevel(logging.INFO)
+    logging.info("initiating Corelight autoscale group monitoring NIC lambda")
+    runtime_context = get_runtime_context()
+    router: FleetRouter = runtime_context.router
+    deadline = Deadline.from_lambda_context(context)
+    for fleet in router.all():
+        fleet.aws_client.deadline = deadline
+
+    # The preflight validation only logs what it finds, so it runs on the scheduled sweep or once the lifecycle
+    # actions have been completed, never ahead of a launch
+    if isinstance(event, dict) and event.get('action') == ORPHANED_INTERFACE_SWEEP_ACTION:
+        router.validate()
+        return router.sweep(deadline).to_dict()
+
+    # Batches arrive either from an SQS event source mapping or as a list of EventBridge events
+    if isinstance(event, dict) and 'Records' in event:
+        resp = handle_sqs_batch(router, event, deadline)
+        router.refill_warm_pools()
+        router.validate()
+        return resp
+
+    if isinstance(event, list):
+        results = router.process_events([from_aws_event_bridge_json(e) for e in event], deadline)
+        router.refill_warm_pools()
+        router.validate()
+        return [result.to_dict() for result in results]
+
+    parsed_event: Ec2LifecycleHookEvent = from_aws_event_bridge_json(event)
+    if not router.handles(parsed_event):
+        return
+    fleet = router.fleet_for(parsed_event.autoscaling_group_name)
+    result = run_sync(fleet.lifecycle_event_svc.handle_event(parsed_event, deadline=deadline))
+    run_sync(fleet.lifecycle_event_svc.refill_warm_pool())
+    router.validate()
+    if result.error is not None:
+        raise result.error
+
+
+def parse_environment() -> EnvironmentConfig:
+    subnets_json = os.getenv(EnvironmentVariables.TARGET_SUBNETS.value, "")
+    security_group_id = os.getenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "")
+
+    if subnets_json == "":
+        msg = f"environment variable ${EnvironmentVariables.TARGET_SUBNETS.value} is not defined"
+        logging.error(msg)
+        raise Exception(msg)
+
+    if security_group_id == "":
+        msg = f"environment variable ${EnvironmentVariables.TARGET_SECURITY_GROUP_ID} is not defined"
+        logging.error(msg)
+        raise Exception(msg)
+
+    try:
+        subnet_map = json.loads(subnets_json)
+    except json.JSONDecodeError as e:
+        msg = f"Failed to parse TARGET_SUBNETS as JSON: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+    try:
+        monitoring_subnets = json.loads(os.getenv(EnvironmentVariables.MONITORING_SUBNETS.value, "") or "{}")
+    except json.JSONDecodeError as e:
+        msg = f"Failed to parse MONITORING_SUBNETS as JSON: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+    try:
+        fleets = json.loads(os.getenv(EnvironmentVariables.FLEETS.value, "") or "{}")
+    except json.JSONDecodeError as e:
+        msg = f"Failed to parse FLEETS as JSON: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+    for autoscaling_group_name, fleet in fleets.items():
+        if not isinstance(fleet, dict) or not fleet.get('subnets') or not fleet.get('security_group_id'):
+            msg = f"fleet {autoscaling_group_name} in FLEETS needs subnets and a security_group_id"
+            logging.error(msg)
+            raise Exception(msg)
+
+    try:
+        lifecycle_hook_names = json.loads(os.getenv(EnvironmentVariables.LIFECYCLE_HOOK_NAMES.value, "") or "[]")
+    except json.JSONDecodeError as e:
+        msg = f"Failed to parse LIFECYCLE_HOOK_NAMES as JSON: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+    return EnvironmentConfig(
+        subnet_map=subnet_map,
+        security_group_id=security_group_id,
+        max_concurrency=max(1, parse_int_variable(EnvironmentVariables.MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)),
+        warm_pool_size=max(0, parse_int_variable(EnvironmentVariables.ENI_WARM_POOL_SIZE, 0)),
+        warm_pool_ttl=parse_int_variable(EnvironmentVariables.ENI_WARM_POOL_TTL, DEFAULT_WARM_POOL_TTL),
+        attachment_wait_timeout=max(
+            0, parse_int_variable(EnvironmentVariables.ATTACHMENT_WAIT_TIMEOUT, DEFAULT_ATTACHMENT_WAIT_TIMEOUT)
+        ),
+        metrics_enabled=parse_bool_variable(EnvironmentVariables.METRICS_ENABLED, False),
+        metrics_namespace=os.getenv(EnvironmentVariables.METRICS_NAMESPACE.value, "") or DEFAULT_METRICS_NAMESPACE,
+        idempotency_table_name=os.getenv(EnvironmentVariables.IDEMPOTENCY_TABLE_NAME.value, ""),
+        idempotency_file=os.getenv(EnvironmentVariables.IDEMPOTENCY_FILE.value, ""),
+        orphan_min_age=max(0, parse_int_variable(EnvironmentVariables.ORPHAN_MIN_AGE, DEFAULT_ORPHAN_MIN_AGE)),
+        orphan_delete_batch_size=max(
+            1, parse_int_variable(EnvironmentVariables.ORPHAN_DELETE_BATCH_SIZE, DEFAULT_ORPHAN_DELETE_BATCH_SIZE)
+        ),
+        orphan_delete_rate=parse_float_variable(EnvironmentVariables.ORPHAN_DELETE_RATE, DEFAULT_ORPHAN_DELETE_RATE),
+        subnet_capacity_ttl=max(0, parse_int_variable(EnvironmentVariables.SUBNET_CAPACITY_TTL, DEFAULT_SUBNET_CAPACITY_TTL)),
+        trust_event_data=parse_bool_variable(EnvironmentVariables.TRUST_EVENT_DATA, False),
+        monitoring_subnets=monitoring_subnets,
+        async_pipeline=parse_bool_variable(EnvironmentVariables.ASYNC_PIPELINE, False),
+        lifecycle_hook_timeout=parse_int_variable(EnvironmentVariables.LIFECYCLE_HOOK_TIMEOUT, DEFAULT_LIFECYCLE_HOOK_TIMEOUT),
+        vpc_id=os.getenv(EnvironmentVariables.TARGET_VPC_ID.value, ""),
+        preflight_ttl=max(0, parse_int_variable(EnvironmentVariables.PREFLIGHT_TTL, DEFAULT_PREFLIGHT_TTL)),
+        fleets=fleets,
+        trace_enabled=parse_bool_variable(EnvironmentVariables.TRACE_ENABLED, False),
+        trace_otlp_endpoint=os.getenv(EnvironmentVariables.TRACE_OTLP_ENDPOINT.value, ""),
+        lifecycle_hook_names=lifecycle_hook_names
+    )
+
+
+def parse_int_variable(variable: EnvironmentVariables, default: int) -> int:
+    value = os.getenv(variable.value, "")
+    if value == "":
+        return default
+
+    try:
+        return int(value)
+    except ValueError as e:
+        msg = f"Failed to parse {variable.value} as an integer: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+
+def parse_float_variable(variable: EnvironmentVariables, default: float) -> float:
+    value = os.getenv(variable.value, "")
+    if value == "":
+        return default
+
+    try:
+        return float(value)
+    except ValueError as e:
+        msg = f"Failed to parse {variable.value} as a number: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+
+def parse_bool_variable(variable: EnvironmentVariables, default: bool) -> bool:
+    value = os.getenv(variable.value, "")
+    if value == "":
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # Pre-deploy check of the subnets and security group the Lambda is configured with. Values that are not given as
+    # arguments are read from the Lambda's own environment variables
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate the NIC manager subnets and security group before deploying")
+    parser.add_argument("--subnets", help="JSON map of AZ to management subnet ID or IDs, as TARGET_SUBNETS")
+    parser.add_argument("--security-group", help="Management security group ID, as TARGET_SECURITY_GROUP_ID")
+    parser.add_argument("--vpc-id", help="VPC the subnets and security group must be in, as TARGET_VPC_ID")
+    parser.add_argument("--monitoring-subnets", help="JSON map of monitoring subnet ID to AZ, as MONITORING_SUBNETS")
+    parser.add_argument("--region", help="AWS region, defaults to the configured one")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args(argv)
+
+    for variable, value in (
+            (EnvironmentVariables.TARGET_SUBNETS, args.subnets),
+            (EnvironmentVariables.TARGET_SECURITY_GROUP_ID, args.security_group),
+            (EnvironmentVariables.TARGET_VPC_ID, args.vpc_id),
+            (EnvironmentVariables.MONITORING_SUBNETS, args.monitoring_subnets),
+    ):
+        if value is not None:
+            os.environ[variable.value] = value
+    if args.region:
+        os.environ["AWS_DEFAULT_REGION"] = args.region
+
+    config = parse_environment()
+    result = PreflightValidator(config, AwsClient(create_boto_client("ec2"), None)).check()
+    if args.json:
+        print(json.dumps(result.to_dict(), indent=2))
+    else:
+        for problem in result.problems:
+            print(f"FAIL {problem}")
+        if result.ok:
+            print(f"OK {len(config.all_subnet_ids()) + len(config.monitoring_subnets)} subnets and security group "
+                  f"{config.security_group_id} are valid")
+    return 0 if result.ok else 1
 
-    try:
-        subnet_map = json.loads(subnets_json)
-    except json.JSONDecodeError as e:
-        msg = f"Failed to parse TARGET_SUBNETS as JSON: {e}"
-        logging.error(msg)
-        raise Exception(msg)
 
-    return EnvironmentConfig(subnet_map=subnet_map, security_group_id=security_group_id)
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,305 @@
+import os
+import argparse
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import List, Optional
+
+# Runs on a schedule next to the NIC manager. It turns the Gateway Load Balancer and EC2 traffic of the sensor group
+# into a per-instance utilization forecast that a target tracking policy can scale on, so scale-out starts while a
+# traffic ramp is building instead of once CPU has been high for minutes
+
+DEFAULT_METRICS_NAMESPACE = "Corelight/Sensor"
+DEFAULT_PERIOD = 60  # Seconds per data point, needs EC2 detailed monitoring below 300
+DEFAULT_WINDOW = 10  # Data points the trend is fitted over
+DEFAULT_HORIZON = 300  # Seconds ahead the utilization is forecast
+LOOKBACK_PERIODS = 3  # Extra periods fetched so the window is full despite CloudWatch's ingestion delay
+
+
+class EnvironmentVariables(Enum):
+    AUTO_SCALING_GROUP_NAME = "AUTO_SCALING_GROUP_NAME"
+    LOAD_BALANCER = "LOAD_BALANCER"
+    TARGET_GROUP = "TARGET_GROUP"
+    INSTANCE_CAPACITY_BPS = "INSTANCE_CAPACITY_BPS"
+    INSTANCE_CAPACITY_PPS = "INSTANCE_CAPACITY_PPS"
+    PERIOD = "PERIOD"
+    WINDOW = "WINDOW"
+    HORIZON = "HORIZON"
+    METRICS_NAMESPACE = "METRICS_NAMESPACE"
+
+
+class MetricNames(Enum):
+    TRAFFIC_UTILIZATION = "TrafficUtilization"
+    PREDICTED_TRAFFIC_UTILIZATION = "PredictedTrafficUtilization"
+
+
+@dataclass
+class PublisherConfig:
+    auto_scaling_group_name: str
+    load_balancer: str  # ARN suffix of the Gateway Load Balancer, gwy/<name>/<id>
+    target_group: str  # ARN suffix of its target group, targetgroup/<name>/<id>
+    instance_capacity_bps: float  # Bytes per second one sensor handles at 100% utilization
+    instance_capacity_pps: float  # Packets per second one sensor handles at 100% utilization
+    period: int = DEFAULT_PERIOD
+    window: int = DEFAULT_WINDOW
+    horizon: int = DEFAULT_HORIZON
+    metrics_namespace: str = DEFAULT_METRICS_NAMESPACE
+
+
+@dataclass
+class TrafficSeries:
+    # Aligned per-period samples, a None marks a period CloudWatch has no data point for
+    period: int
+    timestamps: List[str]
+    processed_bytes: List[Optional[float]]  # AWS/GatewayELB ProcessedBytes, Sum over the period
+    healthy_hosts: List[Optional[float]]  # AWS/GatewayELB HealthyHostCount, Average over the period
+    packets_in: List[Optional[float]]  # AWS/EC2 NetworkPacketsIn, Average per instance over the period
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrafficSeries":
+        return cls(data['period'], data['timestamps'], data['processed_bytes'], data['healthy_hosts'], data['packets_in'])
+
+
+@dataclass
+class Forecast:
+    timestamps: List[str]
+    utilization: List[float]  # Percent of one sensor's capacity, the larger of throughput and packet rate
+    predicted: List[float]  # Utilization forecast `horizon` seconds ahead, never below the current value
+    bytes_per_second: List[float] = field(default_factory=list)
+    packets_per_second: List[float] = field(default_factory=list)
+
+
+def fill_gaps(values: List[Optional[float]]) -> List[float]:
+    # Carries the last known value over missing points, leading gaps take the first known value
+    known = next((value for value in values if value is not None), 0.0)
+    filled = []
+    for value in values:
+        known = known if value is None else value
+        filled.append(float(known))
+    return filled
+
+
+def rolling_mean(values: List[float], window: int) -> List[float]:
+    # Mean of the last `window` points at every index, from running sums so the series is walked once
+    means, total = [], 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        means.append(total / min(i + 1, window))
+    return means
+
+
+def rolling_slope(values: List[float], window: int) -> List[float]:
+    # Least squares slope per point over the last `window` points. Running sums of y and i*y let every window be
+    # fitted in constant time, i*y is shifted to x counted from the window's first point before fitting
+    slopes = []
+    sum_y = sum_iy = 0.0
+    for i, value in enumerate(values):
+        sum_y += value
+        sum_iy += i * value
+        if i >= window:
+            sum_y -= values[i - window]
+            sum_iy -= (i - window) * values[i - window]
+
+        n = min(i + 1, window)
+        if n < 2:
+            slopes.append(0.0)
+            continue
+        sum_xy = sum_iy - (i - n + 1) * sum_y
+        sum_x = n * (n - 1) / 2
+        sum_xx = (n - 1) * n * (2 * n - 1) / 6
+        slopes.append((n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x))
+    return slopes
+
+
+def linear_forecast(values: List[float], window: int, steps_ahead: float) -> List[float]:
+    # Extrapolates the fitted line from the middle of each window to `steps_ahead` points past its end
+    means = rolling_mean(values, window)
+    slopes = rolling_slope(values, window)
+    return [
+        max(0.0, mean + slope * ((min(i + 1, window) - 1) / 2 + steps_ahead))
+        for i, (mean, slope) in enumerate(zip(means, slopes))
+    ]
+
+
+def forecast_utilization(series: TrafficSeries, config: PublisherConfig) -> Forecast:
+    hosts = [max(host, 1.0) for host in fill_gaps(series.healthy_hosts)]
+    bytes_per_second = [
+        processed / series.period / host for processed, host in zip(fill_gaps(series.processed_bytes), hosts)
+    ]
+    packets_per_second = [packets / series.period for packets in fill_gaps(series.packets_in)]
+
+    steps_ahead = config.horizon / series.period
+    utilization, predicted = [], []
+    for bps, pps, predicted_bps, predicted_pps in zip(
+            bytes_per_second,
+            packets_per_second,
+            linear_forecast(bytes_per_second, config.window, steps_ahead),
+            linear_forecast(packets_per_second, config.window, steps_ahead)
+    ):
+        current = 100 * max(bps / config.instance_capacity_bps, pps / config.instance_capacity_pps)
+        ahead = 100 * max(predicted_bps / config.instance_capacity_bps, predicted_pps / config.instance_capacity_pps)
+        utilization.append(round(current, 3))
+        # A falling trend must not scale in before the traffic has actually dropped
+        predicted.append(round(max(current, ahead), 3))
+
+    return Forecast(series.timestamps, utilization, predicted, bytes_per_second, packets_per_second)
+
+
+def metric_data_queries(config: PublisherConfig) -> List[dict]:
+    def query(query_id: str, namespace: str, metric_name: str, dimensions: dict, statistic: str) -> dict:
+        return {
+            "Id": query_id,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": namespace,
+                    "MetricName": metric_name,
+                    "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions.items()]
+                },
+                "Period": config.period,
+                "Stat": statistic
+            },
+            "ReturnData": True
+        }
+
+    return [
+        query("processed_bytes", "AWS/GatewayELB", "ProcessedBytes", {"LoadBalancer": config.load_balancer}, "Sum"),
+        query("healthy_hosts", "AWS/GatewayELB", "HealthyHostCount",
+              {"LoadBalancer": config.load_balancer, "TargetGroup": config.target_group}, "Average"),
+        query("packets_in", "AWS/EC2", "NetworkPacketsIn",
+              {"AutoScalingGroupName": config.auto_scaling_group_name}, "Average"),
+    ]
+
+
+def fetch_series(cloudwatch_client, config: PublisherConfig, now: Optional[datetime] = None) -> TrafficSeries:
+    now = now or datetime.now(timezone.utc)
+    end = now.replace(second=0, microsecond=0)
+    start = end - timedelta(seconds=config.period * (config.window + LOOKBACK_PERIODS))
+
+    values = {}
+    kwargs = {"MetricDataQueries": metric_data_queries(config), "StartTime": start, "EndTime": end,
+              "ScanBy": "TimestampAscending"}
+    while True:
+        resp = cloudwatch_client.get_metric_data(**kwargs)
+        for result in resp['MetricDataResults']:
+            points = values.setdefault(result['Id'], {})
+            points.update(zip(result['Timestamps'], result['Values']))
+        if not resp.get('NextToken'):
+            break
+        kwargs['NextToken'] = resp['NextToken']
+
+    timestamps = [start + timedelta(seconds=config.period * i) for i in range(config.window + LOOKBACK_PERIODS)]
+    return TrafficSeries(
+        period=config.period,
+        timestamps=[timestamp.isoformat() for timestamp in timestamps],
+        **{query_id: [values.get(query_id, {}).get(timestamp) for timestamp in timestamps]
+           for query_id in ("processed_bytes", "healthy_hosts", "packets_in")}
+    )
+
+
+def latest_complete_index(series: TrafficSeries) -> Optional[int]:
+    # The newest period with both traffic metrics reported, later ones are still being ingested
+    for i in reversed(range(len(series.timestamps))):
+        if series.processed_bytes[i] is not None and series.packets_in[i] is not None:
+            return i
+    return None
+
+
+def emit_metrics(config: PublisherConfig, forecast: Forecast, index: int, emit=print):
+    # CloudWatch Embedded Metric Format, the log line becomes the metrics without a PutMetricData call
+    emit(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": config.metrics_namespace,
+                "Dimensions": [["AutoScalingGroupName"]],
+                "Metrics": [
+                    {"Name": MetricNames.TRAFFIC_UTILIZATION.value, "Unit": "Percent"},
+                    {"Name": MetricNames.PREDICTED_TRAFFIC_UTILIZATION.value, "Unit": "Percent"},
+                ]
+            }]
+        },
+        "AutoScalingGroupName": config.auto_scaling_group_name,
+        MetricNames.TRAFFIC_UTILIZATION.value: forecast.utilization[index],
+        MetricNames.PREDICTED_TRAFFIC_UTILIZATION.value: forecast.predicted[index],
+        "BytesPerSecondPerInstance": round(forecast.bytes_per_second[index], 3),
+        "PacketsPerSecondPerInstance": round(forecast.packets_per_second[index], 3),
+        "SampleTimestamp": forecast.timestamps[index]
+    }))
+
+
+def lambda_handler(event, context):
+    logging.getLogger().setLevel(logging.INFO)
+    import boto3
+
+    config = parse_environment()
+    series = fetch_series(boto3.client("cloudwatch"), config)
+    index = latest_complete_index(series)
+    if index is None:
+        logging.info(f"no traffic data points for {config.auto_scaling_group_name} yet, nothing to publish")
+        return {"published": False}
+
+    forecast = forecast_utilization(series, config)
+    emit_metrics(config, forecast, index)
+    return {
+        "published": True,
+        "timestamp": forecast.timestamps[index],
+        "utilization": forecast.utilization[index],
+        "predicted": forecast.predicted[index]
+    }
+
+
+def parse_environment() -> PublisherConfig:
+    values = {}
+    for variable in (EnvironmentVariables.AUTO_SCALING_GROUP_NAME, EnvironmentVariables.LOAD_BALANCER,
+                     EnvironmentVariables.TARGET_GROUP):
+        values[variable] = os.getenv(variable.value, "")
+        if values[variable] == "":
+            msg = f"environment variable ${variable.value} is not defined"
+            logging.error(msg)
+            raise Exception(msg)
+
+    try:
+        return PublisherConfig(
+            auto_scaling_group_name=values[EnvironmentVariables.AUTO_SCALING_GROUP_NAME],
+            load_balancer=values[EnvironmentVariables.LOAD_BALANCER],
+            target_group=values[EnvironmentVariables.TARGET_GROUP],
+            instance_capacity_bps=float(os.environ[EnvironmentVariables.INSTANCE_CAPACITY_BPS.value]),
+            instance_capacity_pps=float(os.environ[EnvironmentVariables.INSTANCE_CAPACITY_PPS.value]),
+            period=int(os.getenv(EnvironmentVariables.PERIOD.value, "") or DEFAULT_PERIOD),
+            window=max(2, int(os.getenv(EnvironmentVariables.WINDOW.value, "") or DEFAULT_WINDOW)),
+            horizon=int(os.getenv(EnvironmentVariables.HORIZON.value, "") or DEFAULT_HORIZON),
+            metrics_namespace=os.getenv(EnvironmentVariables.METRICS_NAMESPACE.value, "") or DEFAULT_METRICS_NAMESPACE
+        )
+    except (KeyError, ValueError) as e:
+        msg = f"Failed to parse the traffic metrics publisher configuration: {e}"
+        logging.error(msg)
+        raise Exception(msg)
+
+
+def main():
+    # Replays a recorded series offline, printing the metric every point would have published
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic series through the forecast")
+    parser.add_argument("series", help="JSON file with period, timestamps, processed_bytes, healthy_hosts, packets_in")
+    parser.add_argument("--capacity-bps", type=float, required=True)
+    parser.add_argument("--capacity-pps", type=float, required=True)
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON)
+    args = parser.parse_args()
+
+    with open(args.series) as fh:
+        series = TrafficSeries.from_dict(json.load(fh))
+    config = PublisherConfig("replay", "", "", args.capacity_bps, args.capacity_pps, series.period, args.window,
+                             args.horizon)
+    forecast = forecast_utilization(series, config)
+    for timestamp, utilization, predicted in zip(forecast.timestamps, forecast.utilization, forecast.predicted):
+        print(f"{timestamp}  utilization={utilization:>8.3f}%  predicted={predicted:>8.3f}%")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
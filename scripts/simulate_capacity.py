@@ -0,0 +1,522 @@
+"""
+Simulates the NIC manager Lambda through a scaling scenario to check, before raising the group's max_size or adding
+availability zones, whether the management subnets and the EC2 / Auto Scaling API rate limits will hold.
+
+The simulation runs offline in simulated time. Every launch goes through the steps of STEP_BUDGETS in the Lambda's
+order, each checked against the remaining budget. Calls use the Lambda's own retry schedule, deadline budget and
+AdaptiveRateLimiter, and AWS is modelled as per-action latencies plus the request token buckets EC2 throttles with. The
+subnet of each management interface is picked by the container's own SubnetSelector, falling over to the next subnet
+when EC2 finds one full. The warm pool, SQS batching and scale-in are not modelled.
+
+It predicts the time from launch to CONTINUE, the point at which each availability zone runs out of addresses, and
+how often each action is throttled. --sweep runs a grid of scenarios:
+
+    python scripts/simulate_capacity.py --subnets '{"us-east-1a": ["subnet-a1", "subnet-a2"], "us-east-1b": "subnet-b"}' \\
+        --instances 60 --subnet-free 100 --sweep lambda_concurrency=10,50 --sweep instances=60,120
+
+A scenario file lists launch waves, each spread evenly over `over` seconds:
+
+    {"steps": [{"at": 0, "instances": {"us-east-1a": 40, "us-east-1b": 40}, "over": 30},
+               {"at": 300, "instances": {"us-east-1a": 80}}]}
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+import sys
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from analyze_traces import summarize
+from corelight_sensor_asg_nic_manager import AdaptiveRateLimiter, EnvironmentConfig, RateLimitExceeded, SubnetSelector
+
+# Mean latency in seconds of each action, every call is drawn uniformly within LATENCY_JITTER of it
+DEFAULT_LATENCY = {
+    "DescribeInstances": 0.15,
+    "CreateNetworkInterface": 0.35,
+    "AttachNetworkInterface": 0.45,
+    "DescribeNetworkInterfaces": 0.1,
+    "ModifyNetworkInterfaceAttribute": 0.2,
+    "DeleteNetworkInterface": 0.25,
+    "CompleteLifecycleAction": 0.1,
+}
+LATENCY_JITTER = 0.3
+THROTTLE_LATENCY = 0.05
+
+# Request token buckets as (capacity, refill per second), shared by every caller in the account and region. The EC2
+# ones are the documented defaults of its action categories, Auto Scaling does not publish its limits
+DEFAULT_BUCKETS = {
+    "ec2-non-mutating": (100, 20),
+    "ec2-mutating": (200, 5),
+    "autoscaling": (50, 10),
+}
+ACTION_BUCKETS = {
+    "DescribeInstances": "ec2-non-mutating",
+    "DescribeNetworkInterfaces": "ec2-non-mutating",
+    "CreateNetworkInterface": "ec2-mutating",
+    "AttachNetworkInterface": "ec2-mutating",
+    "ModifyNetworkInterfaceAttribute": "ec2-mutating",
+    "DeleteNetworkInterface": "ec2-mutating",
+    "CompleteLifecycleAction": "autoscaling",
+}
+
+# Parameters --sweep accepts besides the EnvironmentConfig fields
+SWEEP_PARAMETERS = {"instances", "lambda_concurrency", "lambda_timeout", "subnet_free", "latency_scale", "attach_settle"}
+
+
+@dataclass
+class ScalingStep:
+    at: float  # Seconds from the start of the scenario
+    instances: Dict[str, int]  # Launches per availability zone
+    over: float = 0.0  # Seconds the launches are spread over
+
+    @classmethod
+    def from_dict(cls, step: dict) -> "ScalingStep":
+        instances = {availability_zone: int(count) for availability_zone, count in step["instances"].items()}
+        return cls(float(step.get("at", 0)), instances, float(step.get("over", 0)))
+
+
+@dataclass
+class Scenario:
+    steps: List[ScalingStep]
+
+    @classmethod
+    def from_dict(cls, scenario: dict) -> "Scenario":
+        return cls([ScalingStep.from_dict(step) for step in scenario["steps"]])
+
+    @classmethod
+    def uniform(cls, availability_zones: List[str], instances: int, over: float = 0.0) -> "Scenario":
+        return cls([ScalingStep(0.0, dict.fromkeys(availability_zones, instances), over)])
+
+    def launches(self) -> List[Tuple[float, str]]:
+        launches = []
+        for step in self.steps:
+            for availability_zone, count in step.instances.items():
+                launches.extend(
+                    (step.at + (step.over * i / count if count else 0), availability_zone) for i in range(count)
+                )
+        return sorted(launches)
+
+
+@dataclass
+class SimulationParameters:
+    lambda_concurrency: int = 50  # Reserved or account concurrency available to the function
+    lambda_timeout: float = 30.0
+    subnet_free: int = 250  # Free addresses of every subnet missing from free_addresses
+    free_addresses: Dict[str, int] = field(default_factory=dict)
+    delivery_delay: float = 0.5  # Seconds from launch until EventBridge invokes the Lambda
+    attach_settle: float = 1.5  # Seconds an attachment stays `attaching`
+    latency_scale: float = 1.0
+    latency: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_LATENCY))
+    buckets: Dict[str, Tuple[float, float]] = field(default_factory=lambda: dict(DEFAULT_BUCKETS))
+    seed: int = 0
+
+
+@dataclass
+class SimulationResult:
+    instances: int
+    continued: int
+    abandoned: Dict[str, int]  # Maps the reason to the number of launches abandoned for it
+    time_to_continue: dict  # Percentiles in seconds
+    calls: Dict[str, int]
+    throttles: Dict[str, int]
+    retries: Dict[str, int]
+    exhausted: Dict[str, dict]  # Maps an availability zone to when and at which of its launches it ran out
+    free_addresses: Dict[str, int]  # Left in each subnet at the end
+    duration: float
+
+    @property
+    def ok(self) -> bool:
+        return self.continued == self.instances
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class LaunchState:
+    container: "Container"
+    launched_at: float
+    availability_zone: str
+    subnet_id: Optional[str] = None  # Subnet of the management interface once it is created
+
+
+class SimulationAbandoned(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill: float):
+        self.capacity = capacity
+        self.refill = refill
+        self.tokens = capacity
+        self.updated_at = 0.0
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Container:
+    # A warm Lambda container, its rate limiters and subnet capacity cache carry over from one invocation to the next
+    # as in AwsClient and SubnetSelector
+    def __init__(self, simulation: "Simulation"):
+        self.simulation = simulation
+        self.limiters: Dict[str, AdaptiveRateLimiter] = {}
+        self.subnet_selector = SubnetSelector(simulation.config, simulation, simulation.clock)
+
+    def limiter(self, action: str) -> AdaptiveRateLimiter:
+        if action not in self.limiters:
+            self.limiters[action] = AdaptiveRateLimiter(self.simulation.clock, self.simulation.sleep)
+        return self.limiters[action]
+
+
+class Simulation:
+    # Discrete event simulation, each launch is a generator yielding the seconds until it resumes
+    def __init__(self, config: EnvironmentConfig, scenario: Scenario, parameters: SimulationParameters):
+        self.config = config
+        self.scenario = scenario
+        self.parameters = parameters
+        self.rng = random.Random(parameters.seed)
+        self.now = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._slept = 0.0
+        self.buckets = {name: TokenBucket(*bucket) for name, bucket in parameters.buckets.items()}
+        self.free_addresses = {
+            subnet_id: parameters.free_addresses.get(subnet_id, parameters.subnet_free)
+            for subnet_id in config.all_subnet_ids()
+        }
+        self.idle: List[Container] = []
+        self.containers = 0
+        self.waiting = deque()
+        self.calls = defaultdict(int)
+        self.throttles = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.abandoned = defaultdict(int)
+        self.time_to_continue = []
+        self.launched = defaultdict(int)
+        self.exhausted = {}
+        # Every step of STEP_BUDGETS, a step added to the Lambda fails the simulation until it is modelled here
+        self.steps = {
+            "describe_instance": self.describe_instance,
+            "create_interface": self.create_interface,
+            "attach_interface": self.attach_interface,
+            "modify_attachment": self.modify_attachment,
+        }
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        # The limiter asks to sleep after taking its token, the launch yields the wait instead
+        self._slept += seconds
+
+    def schedule(self, delay: float, action):
+        heapq.heappush(self._queue, (self.now + delay, next(self._sequence), action))
+
+    def run(self) -> SimulationResult:
+        launches = self.scenario.launches()
+        for launched_at, availability_zone in launches:
+            self.now = 0.0
+            self.schedule(
+                launched_at + self.parameters.delivery_delay,
+                lambda launched_at=launched_at, az=availability_zone: self.invoke(launched_at, az)
+            )
+        self.now = 0.0
+
+        while self._queue:
+            self.now, _, action = heapq.heappop(self._queue)
+            if callable(action):
+                action()
+            else:
+                self.resume(*action)
+
+        return SimulationResult(
+            instances=len(launches),
+            continued=len(self.time_to_continue),
+            abandoned=dict(self.abandoned),
+            time_to_continue={key: round(value, 3) for key, value in summarize(self.time_to_continue).items()},
+            calls=dict(self.calls),
+            throttles=dict(self.throttles),
+            retries=dict(self.retries),
+            exhausted=self.exhausted,
+            free_addresses=self.free_addresses,
+            duration=round(self.now, 3)
+        )
+
+    def invoke(self, launched_at: float, availability_zone: str):
+        # Invocations beyond the concurrency limit wait for a container to finish
+        if self.idle:
+            container = self.idle.pop()
+        elif self.containers < self.parameters.lambda_concurrency:
+            self.containers += 1
+            container = Container(self)
+        else:
+            self.waiting.append((launched_at, availability_zone))
+            return
+        self.resume(self.launch(container, launched_at, availability_zone), container)
+
+    def resume(self, launch: Iterator[float], container: Container):
+        try:
+            delay = next(launch)
+        except StopIteration:
+            self.release(container)
+            return
+        self.schedule(delay, (launch, container))
+
+    def release(self, container: Container):
+        if self.waiting:
+            self.resume(self.launch(container, *self.waiting.popleft()), container)
+        else:
+            self.idle.append(container)
+
+    def launch(self, container: Container, launched_at: float, availability_zone: str) -> Iterator[float]:
+        self.launched[availability_zone] += 1
+        deadline = self.now + self.parameters.lambda_timeout - nic_manager.DEADLINE_RESERVE
+        budget = deadline - nic_manager.FINALIZE_RESERVE
+        state = LaunchState(container, launched_at, availability_zone)
+        trusted = self.config.trust_event_data and self.config.single_availability_zone() is not None
+        try:
+            for step in nic_manager.STEP_BUDGETS:
+                if step == "describe_instance" and trusted:
+                    continue
+                self.require(budget, step)
+                yield from self.steps[step](state, budget)
+            yield from self.call(container, "CompleteLifecycleAction", deadline)
+            self.time_to_continue.append(self.now - launched_at)
+        except SimulationAbandoned as e:
+            self.abandoned[e.reason] += 1
+            # Cleanup and the ABANDON result run on the reserve, failures there are left to the sweep
+            try:
+                if state.subnet_id is not None:
+                    yield from self.call(container, "DeleteNetworkInterface", deadline - nic_manager.RESULT_RESERVE)
+                    self.free_addresses[state.subnet_id] += 1
+                yield from self.call(container, "CompleteLifecycleAction", deadline)
+            except SimulationAbandoned:
+                pass
+
+    def require(self, budget: float, step: str):
+        if budget - self.now < nic_manager.STEP_BUDGETS[step]:
+            raise SimulationAbandoned("deadline")
+
+    def describe_instance(self, state: LaunchState, budget: float) -> Iterator[float]:
+        yield from self.call(state.container, "DescribeInstances", budget)
+
+    def create_interface(self, state: LaunchState, budget: float) -> Iterator[float]:
+        # Tries the subnets in the selector's order, EC2 refuses the ones that are full
+        subnet_ids = self.config.subnets_for(state.availability_zone)
+        if not any(self.free_addresses[subnet_id] for subnet_id in subnet_ids):
+            self.exhausted.setdefault(
+                state.availability_zone, {"at": round(self.now, 3), "launch": self.launched[state.availability_zone]}
+            )
+        if not subnet_ids:
+            raise SimulationAbandoned("no_subnet")
+
+        selector = state.container.subnet_selector
+        for subnet_id in selector.candidates(subnet_ids):
+            yield from self.call(state.container, "CreateNetworkInterface", budget)
+            if self.free_addresses[subnet_id] > 0:
+                self.free_addresses[subnet_id] -= 1
+                selector.consume(subnet_id)
+                state.subnet_id = subnet_id
+                return
+            selector.mark_exhausted(subnet_id)
+        raise SimulationAbandoned("ip_exhausted")
+
+    def attach_interface(self, state: LaunchState, budget: float) -> Iterator[float]:
+        yield from self.call(state.container, "AttachNetworkInterface", budget)
+        attached_at = self.now + self.parameters.attach_settle
+        if self.config.attachment_wait_timeout > 0:
+            wait_budget = budget - nic_manager.STEP_BUDGETS["modify_attachment"]
+            yield from self.wait_for_attachment(state.container, attached_at, wait_budget)
+
+    def modify_attachment(self, state: LaunchState, budget: float) -> Iterator[float]:
+        yield from self.call(state.container, "ModifyNetworkInterfaceAttribute", budget)
+
+    def get_subnets(self, subnet_ids: List[str]) -> List[dict]:
+        # Stands in for AwsClient.get_subnets when a container's SubnetSelector refreshes its cache
+        self.calls["DescribeSubnets"] += 1
+        return [
+            {"SubnetId": subnet_id, "AvailableIpAddressCount": self.free_addresses[subnet_id]}
+            for subnet_id in subnet_ids
+        ]
+
+    def wait_for_attachment(self, container: Container, attached_at: float, budget: float) -> Iterator[float]:
+        wait_deadline = min(budget, self.now + self.config.attachment_wait_timeout)
+        delay = nic_manager.ATTACHMENT_POLL_INITIAL_DELAY
+        while True:
+            yield from self.call(container, "DescribeNetworkInterfaces", budget)
+            if self.now >= attached_at:
+                return
+            if wait_deadline - self.now < delay:
+                raise SimulationAbandoned("attachment_timeout")
+            yield self.rng.uniform(delay / 2, delay)
+            delay = min(delay * 2, nic_manager.ATTACHMENT_POLL_MAX_DELAY)
+
+    def call(self, container: Container, action: str, deadline: float) -> Iterator[float]:
+        # AwsClient._call against the modelled API
+        limiter = container.limiter(action)
+        for attempt in range(nic_manager.RETRY_MAX_ATTEMPTS):
+            self._slept = 0.0
+            try:
+                limiter.acquire(max(0.0, deadline - self.now))
+            except RateLimitExceeded:
+                raise SimulationAbandoned("rate_limited")
+            if self._slept:
+                yield self._slept
+
+            self.calls[action] += 1
+            if self.buckets[ACTION_BUCKETS[action]].take(self.now):
+                latency = self.parameters.latency[action] * self.parameters.latency_scale
+                yield self.rng.uniform(latency * (1 - LATENCY_JITTER), latency * (1 + LATENCY_JITTER))
+                limiter.on_success()
+                return
+
+            self.throttles[action] += 1
+            yield THROTTLE_LATENCY
+            limiter.on_throttle()
+            delay = self.rng.uniform(0, min(nic_manager.RETRY_MAX_DELAY, nic_manager.RETRY_BASE_DELAY * 2 ** attempt))
+            if attempt == nic_manager.RETRY_MAX_ATTEMPTS - 1 or delay >= deadline - self.now:
+                raise SimulationAbandoned("throttled")
+            self.retries[action] += 1
+            yield delay
+
+
+def simulate(
+        config: EnvironmentConfig,
+        scenario: Scenario,
+        parameters: Optional[SimulationParameters] = None
+) -> SimulationResult:
+    return Simulation(config, scenario, parameters or SimulationParameters()).run()
+
+
+def parse_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return {"true": True, "false": False}.get(value.lower(), value)
+
+
+def parse_sweep(sweeps: List[str]) -> Dict[str, list]:
+    config_fields = {f.name for f in fields(EnvironmentConfig)}
+    grid = {}
+    for sweep in sweeps:
+        name, _, values = sweep.partition("=")
+        if name not in SWEEP_PARAMETERS and name not in config_fields:
+            raise ValueError(
+                f"cannot sweep {name}, expected one of {sorted(SWEEP_PARAMETERS)} or an EnvironmentConfig field"
+            )
+        grid[name] = [parse_value(value) for value in values.split(",")]
+    return grid
+
+
+def sweep(
+        config: EnvironmentConfig,
+        scenario: Optional[Scenario],
+        parameters: SimulationParameters,
+        grid: Dict[str, list],
+        instances: int = 0
+) -> List[Tuple[dict, SimulationResult]]:
+    # Runs every combination of the grid, `instances` launches per AZ stands in for the scenario when it is swept
+    config_fields = {f.name for f in fields(EnvironmentConfig)}
+    results = []
+    for values in itertools.product(*grid.values()):
+        point = dict(zip(grid.keys(), values))
+        point_config = replace(config, **{k: v for k, v in point.items() if k in config_fields})
+        point_parameters = replace(
+            parameters, **{k: v for k, v in point.items() if k in SWEEP_PARAMETERS and k != "instances"}
+        )
+        point_scenario = scenario
+        if "instances" in point or point_scenario is None:
+            point_scenario = Scenario.uniform(list(config.subnet_map), point.get("instances", instances))
+        results.append((point, simulate(point_config, point_scenario, point_parameters)))
+    return results
+
+
+def format_results(results: List[Tuple[dict, SimulationResult]]) -> str:
+    names = list(results[0][0]) if results else []
+    header = [f"{name:>18}" for name in names] + [
+        f"{'launches':>9}", f"{'continued':>9}", f"{'p50 s':>7}", f"{'p99 s':>7}", f"{'max s':>7}",
+        f"{'throttled':>9}", f"{'abandoned':<28}", "exhausted"
+    ]
+    lines = [" ".join(header)]
+    for point, result in results:
+        ttc = result.time_to_continue
+        abandoned = ",".join(f"{reason}={count}" for reason, count in sorted(result.abandoned.items())) or "-"
+        exhausted = ",".join(f"{az}@{e['at']:.0f}s#{e['launch']}" for az, e in sorted(result.exhausted.items())) or "-"
+        lines.append(" ".join([f"{str(point[name]):>18}" for name in names] + [
+            f"{result.instances:>9}", f"{result.continued:>9}", f"{ttc['p50']:>7.2f}", f"{ttc['p99']:>7.2f}",
+            f"{ttc['max']:>7.2f}", f"{sum(result.throttles.values()):>9}", f"{abandoned:<28}", exhausted
+        ]))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subnets", help="JSON map of availability zone to management subnet IDs, defaults to "
+                                          "TARGET_SUBNETS and the rest of the Lambda environment")
+    parser.add_argument("--scenario", help="JSON file of launch waves")
+    parser.add_argument("--instances", type=int, default=0, help="Launches per availability zone at once")
+    parser.add_argument("--subnet-free", type=int, help="Free addresses of each management subnet")
+    parser.add_argument("--free-addresses", help="JSON map of subnet ID to its free addresses")
+    parser.add_argument("--lambda-concurrency", type=int)
+    parser.add_argument("--lambda-timeout", type=float)
+    parser.add_argument("--latency-scale", type=float, help="Multiplies every API latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sweep", action="append", default=[], metavar="NAME=V1,V2",
+                        help="Simulate every value, repeat to sweep a grid")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.subnets:
+        config = EnvironmentConfig(json.loads(args.subnets), "")
+    else:
+        try:
+            config = nic_manager.parse_environment()
+        except Exception as e:
+            parser.error(f"--subnets is required without the Lambda environment: {e}")
+    scenario = None
+    if args.scenario:
+        with open(args.scenario) as fh:
+            scenario = Scenario.from_dict(json.load(fh))
+    elif args.instances <= 0 and not any(s.startswith("instances=") for s in args.sweep):
+        parser.error("--scenario, --instances or --sweep instances=... is required")
+
+    overrides = {
+        "subnet_free": args.subnet_free,
+        "free_addresses": json.loads(args.free_addresses) if args.free_addresses else None,
+        "lambda_concurrency": args.lambda_concurrency,
+        "lambda_timeout": args.lambda_timeout,
+        "latency_scale": args.latency_scale,
+        "seed": args.seed,
+    }
+    parameters = replace(SimulationParameters(), **{k: v for k, v in overrides.items() if v is not None})
+
+    try:
+        grid = parse_sweep(args.sweep)
+    except ValueError as e:
+        parser.error(str(e))
+    results = sweep(config, scenario, parameters, grid, args.instances)
+
+    if args.json:
+        print(json.dumps([{"parameters": point, **result.to_dict()} for point, result in results], indent=2))
+    else:
+        print(format_results(results))
+    # Non-zero when a launch would be abandoned, so the check can gate a change to the group's size
+    return 0 if all(result.ok for _, result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,48 @@
 import os
+import threading
+import time
+
+from botocore.stub import Stubber, UnStubbedResponseError
 
 TEST_DIR = os.path.dirname(f"{os.path.abspath(__file__)}")
 PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.curdir))
 test_data_dir = os.path.join(PROJECT_DIR, "test_data")
+
+
+class OperationStubber(Stubber):
+    """
+    A Stubber that matches queued responses by operation name instead of strict call order, so a single client can
+    be stubbed while several threads call it concurrently. Optionally sleeps before every call to simulate latency.
+    """
+
+    def __init__(self, client, latency: float = 0.0):
+        super().__init__(client)
+        self._lock = threading.Lock()
+        self.latency = latency
+        client.meta.events.register("before-call.*.*", self._inject_latency)
+
+    def _inject_latency(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _next_index(self, model) -> int:
+        for i, queued in enumerate(self._queue):
+            if queued['operation_name'] == model.name:
+                return i
+        raise UnStubbedResponseError(operation_name=model.name, reason="no stubbed response left for operation")
+
+    def _assert_expected_params(self, model, params, context, **kwargs):
+        with self._lock:
+            self._next_index(model)
+
+    def _get_response_handler(self, model, params, context, **kwargs):
+        with self._lock:
+            i = self._next_index(model)
+            response = self._queue[i]['response']
+            del self._queue[i]
+            return response
+
+
+def steps_of(svc):
+    # Where a service's steps can be patched, LifecycleEventService runs those of the AsyncLifecycleEventService it wraps
+    return getattr(svc, "steps", svc)
@@ -0,0 +1,9 @@
+import pytest
+
+from corelight_sensor_asg_nic_manager import AsyncLifecycleEventService, LifecycleEventService
+
+
+@pytest.fixture(params=[LifecycleEventService, AsyncLifecycleEventService], ids=["sync", "async"])
+def service_class(request):
+    # Runs a test against both implementations, calls go through run_sync so a test reads the same for either
+    return request.param
@@ -0,0 +1,249 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import AttachmentTimeout, AwsClient, Deadline, DeadlineExceeded, \
+    EnvironmentConfig, Ec2LifecycleHookEvent, LifecycleActionResult, LifecycleTransition, run_sync
+
+event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="AutoScalingGroup",
+    lifecycle_hook_name="my-lifecycle-hook",
+    lifecycle_action_token="87654321-4321-4321-4321-210987654321"
+)
+
+cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345", attachment_wait_timeout=5)
+aws_client = AwsClient("foo", "bar")
+
+
+class LambdaContext:
+    def __init__(self, remaining_ms: int):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_ms
+
+
+def interface(status: str) -> dict:
+    return {"NetworkInterfaceId": "eni-12345", "Attachment": {"AttachmentId": "eni-attach-12345", "Status": status}}
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(nic_manager, "ATTACHMENT_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(nic_manager, "ATTACHMENT_POLL_MAX_DELAY", 0.004)
+    monkeypatch.setattr(nic_manager, "STEP_BUDGETS", dict.fromkeys(nic_manager.STEP_BUDGETS, 0.001))
+
+
+def test_deadline_should_keep_a_reserve_from_the_lambda_remaining_time():
+    deadline = Deadline.from_lambda_context(LambdaContext(30000), reserve=5)
+
+    assert 24 < deadline.remaining() <= 25
+    assert deadline.within(2).remaining() <= 2
+    assert Deadline.from_lambda_context(None).remaining() == float("inf")
+
+
+def test_wait_for_attachment_should_poll_until_attached(mocker, service_class):
+    get_interface_mocker = mocker.patch.object(
+        aws_client,
+        "get_interface",
+        side_effect=[interface("attaching"), interface("attaching"), interface("attached")]
+    )
+
+    resp = run_sync(service_class(cfg, aws_client).wait_for_attachment(event, "eni-12345", Deadline()))
+
+    assert resp["Attachment"]["Status"] == "attached"
+    assert get_interface_mocker.call_count == 3
+
+
+def test_wait_for_attachment_should_raise_when_the_deadline_is_reached(mocker, service_class):
+    mocker.patch.object(aws_client, "get_interface", return_value=interface("attaching"))
+
+    with pytest.raises(AttachmentTimeout):
+        run_sync(service_class(cfg, aws_client).wait_for_attachment(event, "eni-12345", Deadline().within(0.02)))
+
+
+def test_wait_for_attachment_should_fail_fast_if_the_interface_is_detached(mocker, service_class):
+    get_interface_mocker = mocker.patch.object(aws_client, "get_interface", return_value=interface("detached"))
+
+    with pytest.raises(Exception, match="detached"):
+        run_sync(service_class(cfg, aws_client).wait_for_attachment(event, "eni-12345", Deadline()))
+    assert get_interface_mocker.call_count == 1
+
+
+def test_wait_for_attachment_should_record_heartbeats_on_long_waits(mocker, monkeypatch, service_class):
+    monkeypatch.setattr(nic_manager, "HEARTBEAT_INTERVAL", 0.0)
+    mocker.patch.object(aws_client, "get_interface", side_effect=[interface("attaching"), interface("attached")])
+    heartbeat_mocker = mocker.patch.object(aws_client, "record_lifecycle_action_heartbeat", return_value=None)
+
+    run_sync(service_class(cfg, aws_client).wait_for_attachment(event, "eni-12345", Deadline()))
+
+    heartbeat_mocker.assert_called_once_with(
+        lifecycle_hook_name=event.lifecycle_hook_name,
+        auto_scaling_group_name=event.autoscaling_group_name,
+        instance_id=event.instance_id,
+        lifecycle_action_token=event.lifecycle_action_token
+    )
+
+
+def test_process_event_should_cleanup_when_the_attachment_never_completes(mocker, service_class):
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-12345"})
+    mocker.patch.object(aws_client, "get_interface", return_value=interface("attaching"))
+    modify_mocker = mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination")
+    detach_mocker = mocker.patch.object(aws_client, "detach_interface", return_value=None)
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+
+    svc = service_class(cfg, aws_client)
+    with pytest.raises(AttachmentTimeout):
+        run_sync(svc.process_event(
+            event, {"Placement": {"AvailabilityZone": "us-east-1a"}}, deadline=Deadline().within(0.02)
+        ))
+
+    assert modify_mocker.call_count == 0
+    detach_mocker.assert_called_once_with("eni-attach-12345", "eni-12345")
+    delete_mocker.assert_called_once_with("eni-12345")
+
+
+def test_process_event_should_report_step_latencies(mocker, service_class):
+    mocker.patch.object(aws_client, "create_interface", side_effect=lambda *args: time.sleep(0.01) or "eni-12345")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-12345"})
+    mocker.patch.object(aws_client, "get_interface", return_value=interface("attached"))
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+
+    latencies = run_sync(service_class(cfg, aws_client).process_event(
+        event, {"Placement": {"AvailabilityZone": "us-east-1a"}}
+    ))
+
+    assert set(latencies) == {"create_interface", "attach_interface", "wait_for_attachment", "modify_attachment"}
+    assert latencies["create_interface"] >= 10
+
+
+def test_calls_within_a_budget_should_stop_retrying_at_the_earlier_deadline():
+    client = AwsClient("foo", "bar")
+    client.deadline = Deadline().within(10)
+
+    with client.bounded_by(Deadline().within(0)):
+        assert client.remaining() == 0
+        with client.bounded_by(None):
+            assert 9 < client.remaining() <= 10
+    assert 9 < client.remaining() <= 10
+
+
+def test_process_event_should_not_start_a_step_the_deadline_leaves_no_time_for(mocker, monkeypatch, service_class):
+    monkeypatch.setattr(nic_manager, "STEP_BUDGETS", dict.fromkeys(nic_manager.STEP_BUDGETS, 1.0))
+    create_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+
+    with pytest.raises(DeadlineExceeded):
+        run_sync(service_class(cfg, aws_client).process_event(
+            event, {"Placement": {"AvailabilityZone": "us-east-1a"}}, deadline=Deadline().within(0.5)
+        ))
+    assert create_mocker.call_count == 0
+
+
+def test_handle_event_should_abandon_in_the_reserve_when_provisioning_has_no_time_left(mocker, monkeypatch,
+                                                                                     service_class):
+    monkeypatch.setattr(nic_manager, "STEP_BUDGETS", dict.fromkeys(nic_manager.STEP_BUDGETS, 1.0))
+    create_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+    instance = {"InstanceId": event.instance_id, "Placement": {"AvailabilityZone": "us-east-1a"},
+                "NetworkInterfaces": [{}]}
+
+    start = time.monotonic()
+    result = run_sync(service_class(cfg, aws_client).handle_event(
+        event, instance, deadline=Deadline().within(nic_manager.FINALIZE_RESERVE + 0.5)
+    ))
+
+    assert time.monotonic() - start < 1
+    assert result.action == LifecycleActionResult.ABANDON
+    assert isinstance(result.error, DeadlineExceeded)
+    assert create_mocker.call_count == 0
+    assert complete_mocker.call_args.kwargs["lifecycle_action_result"] == LifecycleActionResult.ABANDON
+
+
+@pytest.mark.parametrize("age, heartbeats", [(290, 1), (5, 0)])
+def test_handle_event_should_record_a_heartbeat_when_the_hook_would_time_out_first(mocker, service_class, age,
+                                                                                  heartbeats):
+    late_event = Ec2LifecycleHookEvent(
+        instance_id=event.instance_id,
+        autoscaling_group_name=event.autoscaling_group_name,
+        destination=event.destination,
+        lifecycle_hook_name=event.lifecycle_hook_name,
+        lifecycle_action_token=f"{event.lifecycle_action_token}-{age}",
+        event_time=(datetime.now(timezone.utc) - timedelta(seconds=age)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    )
+    heartbeat_mocker = mocker.patch.object(aws_client, "record_lifecycle_action_heartbeat", return_value=None)
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-12345"})
+    mocker.patch.object(aws_client, "get_interface", return_value=interface("attached"))
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+    instance = {"InstanceId": event.instance_id, "Placement": {"AvailabilityZone": "us-east-1a"},
+                "NetworkInterfaces": [{}]}
+
+    result = run_sync(service_class(cfg, aws_client).handle_event(late_event, instance, deadline=Deadline().within(25)))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert heartbeat_mocker.call_count == heartbeats
+
+
+@pytest.fixture
+def hanging_detach(mocker, monkeypatch):
+    # An interface that never finishes detaching, on a client whose calls succeed instantly
+    monkeypatch.setattr(nic_manager, "FINALIZE_RESERVE", 0.6)
+    monkeypatch.setattr(nic_manager, "RESULT_RESERVE", 0.3)
+    monkeypatch.setattr(nic_manager, "DETACH_POLL_DELAY", 0.05)
+    ec2_client = mocker.MagicMock()
+    ec2_client.create_network_interface.return_value = {"NetworkInterface": {"NetworkInterfaceId": "eni-12345"}}
+    ec2_client.attach_network_interface.return_value = {"AttachmentId": "eni-attach-12345"}
+    ec2_client.describe_network_interfaces.return_value = {"NetworkInterfaces": [
+        {**interface("attaching"), "SubnetId": "subnet-foo", "Status": "in-use"}
+    ]}
+    return AwsClient(ec2_client, mocker.MagicMock())
+
+
+def test_cleanup_should_leave_the_time_to_post_the_result_when_detaching_hangs(mocker, service_class, hanging_detach):
+    deadline = Deadline().within(0.7)
+    left_to_complete = []
+    mocker.patch.object(
+        hanging_detach, "complete_lifecycle_action",
+        side_effect=lambda **kwargs: left_to_complete.append(deadline.remaining())
+    )
+    instance = {"InstanceId": event.instance_id, "Placement": {"AvailabilityZone": "us-east-1a"},
+                "NetworkInterfaces": [{}]}
+
+    result = run_sync(service_class(cfg, hanging_detach).handle_event(event, instance, deadline=deadline))
+
+    assert result.action == LifecycleActionResult.ABANDON and isinstance(result.error, AttachmentTimeout)
+    assert hanging_detach.ec2_client.detach_network_interface.call_count == 1
+    assert 0.2 < left_to_complete[0] <= 0.3
+
+
+def test_terminate_teardown_should_leave_the_time_to_post_the_result_when_detaching_hangs(mocker, service_class,
+                                                                                         hanging_detach):
+    terminate_event = Ec2LifecycleHookEvent(
+        instance_id=event.instance_id,
+        autoscaling_group_name=event.autoscaling_group_name,
+        destination="EC2",
+        lifecycle_hook_name="my-terminate-hook",
+        lifecycle_action_token="12345678-4321-4321-4321-210987654321",
+        lifecycle_transition=LifecycleTransition.TERMINATING.value
+    )
+    deadline = Deadline().within(0.5)
+    left_to_complete = []
+    mocker.patch.object(
+        hanging_detach, "complete_lifecycle_action",
+        side_effect=lambda **kwargs: left_to_complete.append(deadline.remaining())
+    )
+    management = {**interface("attached"), "SubnetId": "subnet-foo"}
+    management["Attachment"]["DeviceIndex"] = 1
+    instance = {"Placement": {"AvailabilityZone": "us-east-1a"}, "NetworkInterfaces": [management]}
+
+    result = run_sync(service_class(cfg, hanging_detach).handle_event(terminate_event, instance, deadline=deadline))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert hanging_detach.ec2_client.delete_network_interface.call_count == 0
+    assert 0.2 < left_to_complete[0] <= 0.3
@@ -3,18 +3,20 @@ import botocore.exceptions
 import pytest
 from botocore.stub import Stubber
 from typing import Tuple
-from corelight_sensor_asg_nic_manager import AwsClient, LifecycleActionResult
+from corelight_sensor_asg_nic_manager import AsyncAwsClient, AwsClient, LifecycleActionResult, run_sync
 from . import test_data_dir
 import json
 
 
-@pytest.fixture
-def setup_client() -> Tuple[AwsClient, Stubber, Stubber]:
+@pytest.fixture(params=[AwsClient, AsyncAwsClient], ids=["sync", "async"])
+def setup_client(request) -> Tuple[AwsClient, Stubber, Stubber]:
     ec2_client = boto3.client('ec2')
     asg_client = boto3.client('autoscaling')
     ec2_stubber = Stubber(ec2_client)
     asg_stubber = Stubber(asg_client)
-    return AwsClient(ec2_client, asg_client), ec2_stubber, asg_stubber
+    aws_client = AwsClient(ec2_client, asg_client)
+    # Both surfaces make the same calls, run_sync lets a test read the same for either
+    return (aws_client if request.param is AwsClient else AsyncAwsClient(aws_client)), ec2_stubber, asg_stubber
 
 
 def test_get_instance_details_should_raise_error_on_client_failure(setup_client):
@@ -28,7 +30,7 @@ def test_get_instance_details_should_raise_error_on_client_failure(setup_client)
     ec2_stubber.activate()
 
     with pytest.raises(botocore.exceptions.ClientError) as e:
-        aws_client.get_instance_details("my-instance-id")
+        run_sync(aws_client.get_instance_details("my-instance-id"))
         assert e.response["ResponseMetadata"]["HTTPStatusCode"] == 403
         assert e.response["Error"]["Message"] == "unauthorized"
 
@@ -43,7 +45,7 @@ def test_get_instance_details_should_return_instance_details(setup_client):
     ec2_stubber.add_response(method="describe_instances", service_response=instance_details)
     ec2_stubber.activate()
 
-    resp = aws_client.get_instance_details("my-instance-id")
+    resp = run_sync(aws_client.get_instance_details("my-instance-id"))
     assert resp == instance_details
 
 
@@ -58,7 +60,7 @@ def test_create_interface_should_raise_error_on_client_failure(setup_client):
     ec2_stubber.activate()
 
     with pytest.raises(botocore.exceptions.ClientError) as e:
-        aws_client.create_interface("foo", "bar")
+        run_sync(aws_client.create_interface("foo", "bar"))
         assert e.response["ResponseMetadata"]["HTTPStatusCode"] == 403
         assert e.response["Error"]["Message"] == "unauthorized"
 
@@ -73,7 +75,7 @@ def test_create_interface_should_return_interface_id(setup_client):
     ec2_stubber.add_response(method="create_network_interface", service_response=instance_details)
     ec2_stubber.activate()
 
-    resp = aws_client.create_interface("foo", "bar")
+    resp = run_sync(aws_client.create_interface("foo", "bar"))
     assert resp == "eni-1234567890abcdefg"
 
 
@@ -90,7 +92,7 @@ def test_attach_interface_should_raise_error_and_delete_interface_on_failure_on_
     ec2_stubber.activate()
 
     with pytest.raises(botocore.exceptions.ClientError) as e:
-        aws_client.attach_interface("foo", "bar")
+        run_sync(aws_client.attach_interface("foo", "bar"))
         assert e.response["ResponseMetadata"]["HTTPStatusCode"] == 403
         assert e.response["Error"]["Message"] == "unauthorized"
 
@@ -104,7 +106,7 @@ def test_attach_interface_should_return_aws_attachment_response(setup_client):
     )
     ec2_stubber.activate()
 
-    resp = aws_client.attach_interface("foo", "bar")
+    resp = run_sync(aws_client.attach_interface("foo", "bar"))
     assert resp["AttachmentId"] == "foo"
     assert resp["NetworkCardIndex"] == 1
 
@@ -122,7 +124,7 @@ def test_modify_attachment_to_delete_on_termination_should_raise_error_on_client
     ec2_stubber.activate()
 
     with pytest.raises(botocore.exceptions.ClientError):
-        aws_client.modify_attachment_to_delete_on_termination("foo", "bar")
+        run_sync(aws_client.modify_attachment_to_delete_on_termination("foo", "bar"))
 
 
 def test_modify_attachment_to_delete_on_termination_should_return_nothing_on_success(setup_client):
@@ -136,7 +138,7 @@ def test_modify_attachment_to_delete_on_termination_should_return_nothing_on_suc
 
     ec2_stubber.activate()
 
-    resp = aws_client.modify_attachment_to_delete_on_termination("foo", "bar")
+    resp = run_sync(aws_client.modify_attachment_to_delete_on_termination("foo", "bar"))
     assert resp is None
 
 
@@ -152,13 +154,13 @@ def test_complete_lifecycle_action_should_raise_error_on_client_error(setup_clie
     asg_stubber.activate()
 
     with pytest.raises(botocore.exceptions.ClientError) as e:
-        resp = aws_client.complete_lifecycle_action(
+        resp = run_sync(aws_client.complete_lifecycle_action(
             "foo",
             "bar",
             "baz",
             "abc123abc123abc123abc123abc123abc123abc123abc123",
             LifecycleActionResult.CONTINUE
-        )
+        ))
         assert e.response["ResponseMetadata"]["HTTPStatusCode"] == 403
         assert e.response["Error"]["Message"] == "unauthorized"
 
@@ -173,12 +175,31 @@ def test_complete_lifecycle_action_should_return_none_on_success(setup_client):
 
     asg_stubber.activate()
 
-    resp = aws_client.complete_lifecycle_action(
+    resp = run_sync(aws_client.complete_lifecycle_action(
         "foo",
         "bar",
         "baz",
         "abc123abc123abc123abc123abc123abc123abc123abc123",
         LifecycleActionResult.CONTINUE
-    )
+    ))
 
     assert resp is None
+
+
+def test_get_instances_details_should_map_instances_by_id(setup_client):
+    aws_client = setup_client[0]
+    ec2_stubber = setup_client[1]
+
+    with open(f"{test_data_dir}/single_nic_instance_describe_response.json") as fh:
+        instance_details = json.load(fh)
+
+    ec2_stubber.add_response(
+        method="describe_instances",
+        service_response=instance_details,
+        expected_params={"InstanceIds": ["i-1234567890abcdef0", "i-missing"]}
+    )
+    ec2_stubber.activate()
+
+    resp = run_sync(aws_client.get_instances_details(["i-1234567890abcdef0", "i-missing"]))
+    assert list(resp.keys()) == ["i-1234567890abcdef0"]
+    assert resp["i-1234567890abcdef0"]["Placement"]["AvailabilityZone"] == "us-east-1a"
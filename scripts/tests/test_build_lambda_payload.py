@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import botocore.session
+from botocore.stub import Stubber
+
+import build_lambda_payload
+from . import TEST_DIR
+
+
+def test_importing_the_script_should_not_import_boto3():
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, corelight_sensor_asg_nic_manager; print('boto3' in sys.modules)"],
+        cwd=os.path.dirname(TEST_DIR), capture_output=True, check=True, text=True
+    ).stdout
+
+    assert output.strip() == "False"
+
+
+def test_importing_the_script_should_not_import_asyncio():
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, corelight_sensor_asg_nic_manager; print('asyncio' in sys.modules)"],
+        cwd=os.path.dirname(TEST_DIR), capture_output=True, check=True, text=True
+    ).stdout
+
+    assert output.strip() == "False"
+
+
+def test_trimmed_models_should_only_hold_the_operations_the_script_calls(tmp_path):
+    report = build_lambda_payload.build(str(tmp_path))
+
+    session = botocore.session.get_session()
+    session.get_component("data_loader").search_paths.insert(0, str(tmp_path / build_lambda_payload.MODEL_DIR))
+    ec2_client = session.create_client("ec2", region_name="us-east-1")
+
+    assert set(report) == {"ec2", "autoscaling", "dynamodb"}
+    assert len(ec2_client.meta.service_model.operation_names) == report["ec2"]["operations"]
+    assert (tmp_path / f"{build_lambda_payload.SCRIPT_NAME}.py").exists()
+
+    stubber = Stubber(ec2_client)
+    stubber.add_response("describe_instances", {"Reservations": []}, {"InstanceIds": ["i-1234567890abcdef0"]})
+    with stubber:
+        assert ec2_client.describe_instances(InstanceIds=["i-1234567890abcdef0"])["Reservations"] == []
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import EnvironmentConfig, EnvironmentVariables
+from simulate_capacity import DEFAULT_LATENCY, Scenario, SimulationParameters, main, simulate, sweep
+
+cfg = EnvironmentConfig({"us-east-1a": ["subnet-a1", "subnet-a2"], "us-east-1b": "subnet-b"}, "sg-12345")
+
+# Enough tokens that nothing is throttled
+UNLIMITED = {"ec2-non-mutating": (1e6, 1e6), "ec2-mutating": (1e6, 1e6), "autoscaling": (1e6, 1e6)}
+
+
+def test_launches_within_capacity_should_continue_after_the_sum_of_their_steps():
+    parameters = SimulationParameters(buckets=UNLIMITED, delivery_delay=0)
+
+    result = simulate(cfg, Scenario.uniform(["us-east-1a", "us-east-1b"], 10), parameters)
+
+    assert result.ok and result.continued == 20 and result.throttles == {}
+    steps = ["DescribeInstances", "CreateNetworkInterface", "AttachNetworkInterface",
+             "ModifyNetworkInterfaceAttribute", "CompleteLifecycleAction"]
+    expected = sum(DEFAULT_LATENCY[step] for step in steps)
+    assert result.time_to_continue["p50"] == pytest.approx(expected, rel=0.3)
+    assert result.calls["CreateNetworkInterface"] == 20
+
+
+def test_addresses_should_be_taken_from_the_fullest_subnet_until_the_zone_runs_out():
+    # A launch every 10 seconds, the 7th finds both subnets full
+    scenario = Scenario.from_dict({"steps": [{"at": 0, "instances": {"us-east-1a": 8}, "over": 80}]})
+    parameters = SimulationParameters(buckets=UNLIMITED, free_addresses={"subnet-a1": 4, "subnet-a2": 2})
+
+    result = simulate(cfg, scenario, parameters)
+
+    assert result.continued == 6 and result.abandoned == {"ip_exhausted": 2}
+    assert result.free_addresses["subnet-a1"] == 0 and result.free_addresses["subnet-a2"] == 0
+    assert result.exhausted == {"us-east-1a": {"at": pytest.approx(60.65, abs=0.1), "launch": 7}}
+
+
+def test_containers_with_the_same_cached_counts_should_fall_over_to_the_next_subnet():
+    # Both containers see one free address in each subnet and pick the first, the second launch finds it full
+    parameters = SimulationParameters(buckets=UNLIMITED, free_addresses={"subnet-a1": 1, "subnet-a2": 1})
+
+    result = simulate(cfg, Scenario.uniform(["us-east-1a"], 2), parameters)
+
+    assert result.continued == 2 and result.exhausted == {}
+    assert result.calls["DescribeSubnets"] == 2 and result.calls["CreateNetworkInterface"] == 3
+
+
+def test_launches_should_be_abandoned_when_a_step_budget_is_out_of_reach(monkeypatch):
+    monkeypatch.setitem(nic_manager.STEP_BUDGETS, "attach_interface", 60.0)
+
+    result = simulate(cfg, Scenario.uniform(["us-east-1b"], 2), SimulationParameters(buckets=UNLIMITED))
+
+    assert result.abandoned == {"deadline": 2} and "AttachNetworkInterface" not in result.calls
+    assert result.calls["DeleteNetworkInterface"] == 2 and result.free_addresses["subnet-b"] == 250
+
+
+def test_a_burst_beyond_the_mutating_bucket_should_be_throttled_and_slowed_down():
+    burst = Scenario.uniform(["us-east-1a", "us-east-1b"], 60)
+    parameters = SimulationParameters(buckets={**UNLIMITED, "ec2-mutating": (50, 5)}, subnet_free=500)
+
+    throttled = simulate(cfg, burst, parameters)
+    unthrottled = simulate(cfg, burst, SimulationParameters(buckets=UNLIMITED, subnet_free=500))
+
+    assert throttled.throttles["CreateNetworkInterface"] > 0
+    assert "DescribeInstances" not in throttled.throttles
+    assert throttled.time_to_continue["p90"] > 5 * unthrottled.time_to_continue["p90"]
+
+
+def test_simulation_should_be_deterministic_for_a_seed():
+    burst = Scenario.uniform(["us-east-1a"], 40)
+
+    assert simulate(cfg, burst, SimulationParameters(seed=3)) == simulate(cfg, burst, SimulationParameters(seed=3))
+
+
+def test_sweep_should_simulate_every_combination_of_the_grid():
+    grid = {"lambda_concurrency": [1, 20], "instances": [5, 10], "trust_event_data": [False]}
+
+    results = sweep(cfg, None, SimulationParameters(buckets=UNLIMITED), grid)
+
+    assert [point for point, _ in results] == [
+        {"lambda_concurrency": 1, "instances": 5, "trust_event_data": False},
+        {"lambda_concurrency": 1, "instances": 10, "trust_event_data": False},
+        {"lambda_concurrency": 20, "instances": 5, "trust_event_data": False},
+        {"lambda_concurrency": 20, "instances": 10, "trust_event_data": False},
+    ]
+    assert [result.instances for _, result in results] == [10, 20, 10, 20]
+    # One container handles the launches one after the other
+    assert results[1][1].time_to_continue["max"] > 5 * results[3][1].time_to_continue["max"]
+
+
+def test_cli_should_exit_non_zero_when_a_launch_would_be_abandoned(capsys):
+    exit_code = main([
+        "--subnets", json.dumps({"us-east-1a": "subnet-a"}), "--subnet-free", "3", "--sweep", "instances=3,4", "--json"
+    ])
+
+    results = json.loads(capsys.readouterr().out)
+    assert exit_code == 1
+    assert [(r["parameters"]["instances"], r["continued"]) for r in results] == [(3, 3), (4, 3)]
+
+
+def test_cli_should_ask_for_subnets_without_the_lambda_environment(monkeypatch, capsys):
+    monkeypatch.delenv(EnvironmentVariables.TARGET_SUBNETS.value, raising=False)
+
+    with pytest.raises(SystemExit) as exited:
+        main(["--instances", "3"])
+
+    assert exited.value.code == 2
+    assert "--subnets is required" in capsys.readouterr().err
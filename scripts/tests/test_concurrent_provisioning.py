@@ -0,0 +1,145 @@
+import json
+import time
+import uuid
+
+import boto3
+import botocore.exceptions
+import pytest
+
+from corelight_sensor_asg_nic_manager import AwsClient, CancellationToken, EnvironmentConfig, Ec2LifecycleHookEvent, \
+    LifecycleActionResult, LifecycleEventService, run_sync, ProvisioningCancelled
+from . import OperationStubber, test_data_dir
+
+INSTANCE_COUNT = 8
+API_LATENCY = 0.05
+
+
+def lifecycle_event(instance_id: str) -> Ec2LifecycleHookEvent:
+    return Ec2LifecycleHookEvent(
+        instance_id=instance_id,
+        autoscaling_group_name="my-asg",
+        destination="AutoScalingGroup",
+        lifecycle_hook_name="my-lifecycle-hook",
+        lifecycle_action_token=str(uuid.uuid4())
+    )
+
+
+def describe_response(instance_ids: list) -> dict:
+    with open(f"{test_data_dir}/single_nic_instance_describe_response.json") as fh:
+        template = json.load(fh)
+
+    instances = []
+    for instance_id in instance_ids:
+        instance = json.loads(json.dumps(template['Reservations'][0]['Instances'][0]))
+        instance['InstanceId'] = instance_id
+        instances.append(instance)
+    return {"Reservations": [{"Instances": instances}]}
+
+
+def stubbed_service(service_class, max_concurrency: int, instance_ids: list) -> LifecycleEventService:
+    ec2_client = boto3.client("ec2")
+    asg_client = boto3.client("autoscaling")
+    ec2_stubber = OperationStubber(ec2_client, latency=API_LATENCY)
+    asg_stubber = OperationStubber(asg_client, latency=API_LATENCY)
+
+    with open(f"{test_data_dir}/nic_create_response.json") as fh:
+        create_response = json.load(fh)
+
+    ec2_stubber.add_response("describe_instances", describe_response(instance_ids))
+    for _ in instance_ids:
+        ec2_stubber.add_response("create_network_interface", create_response)
+        ec2_stubber.add_response("attach_network_interface", {"AttachmentId": "eni-attach-1234567890abcdefg"})
+        ec2_stubber.add_response("modify_network_interface_attribute", {})
+        asg_stubber.add_response("complete_lifecycle_action", {})
+    ec2_stubber.activate()
+    asg_stubber.activate()
+
+    cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345", max_concurrency=max_concurrency)
+    return service_class(cfg, AwsClient(ec2_client, asg_client, max_workers=max_concurrency))
+
+
+def timed_batch(service_class, max_concurrency: int) -> float:
+    instance_ids = [f"i-{i:017d}" for i in range(INSTANCE_COUNT)]
+    svc = stubbed_service(service_class, max_concurrency, instance_ids)
+
+    start = time.perf_counter()
+    results = run_sync(svc.process_events([lifecycle_event(instance_id) for instance_id in instance_ids]))
+    elapsed = time.perf_counter() - start
+
+    assert [result.action for result in results] == [LifecycleActionResult.CONTINUE] * INSTANCE_COUNT
+    return elapsed
+
+
+def test_concurrent_provisioning_throughput_should_scale_with_the_pool(service_class):
+    sequential = timed_batch(service_class, max_concurrency=1)
+    concurrent = timed_batch(service_class, max_concurrency=INSTANCE_COUNT)
+
+    # 4 calls per instance after the shared describe; the sequential run pays every one of them back to back
+    assert sequential >= INSTANCE_COUNT * 4 * API_LATENCY
+    assert concurrent < sequential / 3
+
+
+def test_process_event_should_cleanup_in_reverse_order_when_cancelled(mocker, service_class):
+    aws_client = AwsClient("foo", "bar")
+    cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345")
+    svc = service_class(cfg, aws_client)
+    token = CancellationToken()
+
+    calls = mocker.MagicMock()
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    calls.attach_interface.side_effect = lambda *args: token.cancel() or {"AttachmentId": "eni-attach-12345"}
+    mocker.patch.object(aws_client, "attach_interface", calls.attach_interface)
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", calls.modify)
+    mocker.patch.object(aws_client, "detach_interface", calls.detach_interface)
+    mocker.patch.object(aws_client, "delete_interface", calls.delete_interface)
+
+    with pytest.raises(ProvisioningCancelled):
+        run_sync(svc.process_event(
+            lifecycle_event("i-12345"), {"Placement": {"AvailabilityZone": "us-east-1a"}}, token
+        ))
+
+    assert [c[0] for c in calls.mock_calls] == ["attach_interface", "detach_interface", "delete_interface"]
+    calls.detach_interface.assert_called_once_with("eni-attach-12345", "eni-12345")
+
+
+def test_cancel_should_abandon_only_the_cancelled_instance(mocker, service_class):
+    # Serialize the two instances so the cancellation deterministically lands between create and attach
+    aws_client = AwsClient("foo", "bar", max_workers=1)
+    cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345", max_concurrency=1)
+    svc = service_class(cfg, aws_client)
+    instances = describe_response(["i-keep", "i-cancel"])['Reservations'][0]['Instances']
+
+    created = []
+
+    def create_interface(subnet_id, security_group_id):
+        # Cancel the second instance while its interface is being created
+        created.append(f"eni-{len(created)}")
+        if len(created) == 2:
+            assert svc.cancel("i-cancel")
+        return created[-1]
+
+    mocker.patch.object(aws_client, "get_instances_details", return_value={i['InstanceId']: i for i in instances})
+    mocker.patch.object(aws_client, "create_interface", side_effect=create_interface)
+    attach_mocker = mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach"})
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    results = run_sync(svc.process_events([lifecycle_event("i-keep"), lifecycle_event("i-cancel")]))
+
+    assert results[0].action == LifecycleActionResult.CONTINUE
+    assert results[1].action == LifecycleActionResult.ABANDON
+    assert isinstance(results[1].error, ProvisioningCancelled)
+    assert attach_mocker.call_count == 1
+    delete_mocker.assert_called_once_with("eni-1")
+    assert not svc.cancel("i-cancel")
+
+
+def test_detach_interface_should_raise_error_on_client_failure():
+    ec2_client = boto3.client("ec2")
+    stubber = OperationStubber(ec2_client)
+    stubber.add_client_error("detach_network_interface", service_message="unauthorized", http_status_code=403)
+    stubber.activate()
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        AwsClient(ec2_client, "bar").detach_interface("eni-attach-12345", "eni-12345")
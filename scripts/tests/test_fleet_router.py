@@ -0,0 +1,149 @@
+import json
+import threading
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from corelight_sensor_asg_nic_manager import AwsClient, Ec2LifecycleHookEvent, EnvironmentConfig, \
+    EnvironmentVariables, Fleet, FleetRouter, LifecycleActionResult, LifecycleEventResult, MetricsLogger, \
+    get_runtime_context, metrics_dimension, parse_environment, reset_runtime_context
+
+
+class RecordingService:
+    def __init__(self, name: str, barrier: threading.Barrier = None, error: Exception = None):
+        self.name = name
+        self.barrier = barrier
+        self.error = error
+        self.batches = []
+
+    def process_events(self, events, deadline=None):
+        self.batches.append([event.instance_id for event in events])
+        if self.barrier is not None:
+            # Every fleet's batch has to be in flight at once to get past the barrier
+            self.barrier.wait(timeout=5)
+        return [
+            LifecycleEventResult(event, None if self.error else LifecycleActionResult.CONTINUE, self.error)
+            for event in events
+        ]
+
+
+def fleet(svc: RecordingService, lifecycle_hook_names: list = None) -> Fleet:
+    config = EnvironmentConfig(
+        {"us-east-1a": "subnet-foo"}, "sg-12345", lifecycle_hook_names=lifecycle_hook_names or []
+    )
+    return Fleet(config, AwsClient("foo", "bar"), svc, None)
+
+
+def event(instance_id: str, autoscaling_group_name: str, lifecycle_hook_name: str = "hook") -> Ec2LifecycleHookEvent:
+    return Ec2LifecycleHookEvent(
+        instance_id, autoscaling_group_name, "AutoScalingGroup", lifecycle_hook_name, f"token-{instance_id}"
+    )
+
+
+@pytest.fixture
+def fleet_environment(monkeypatch):
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SUBNETS.value, '{"us-east-1a": "subnet-foo"}')
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "sg-12345")
+    monkeypatch.setenv(EnvironmentVariables.LIFECYCLE_HOOK_NAMES.value, '["launch-hook", "terminate-hook"]')
+    monkeypatch.setenv(EnvironmentVariables.FLEETS.value, json.dumps({
+        "sensors-west": {
+            "region": "us-west-2", "subnets": {"us-west-2a": "subnet-west"}, "security_group_id": "sg-west",
+            "lifecycle_hook_names": ["west-launch-hook"]
+        },
+        "sensors-east": {"subnets": {"us-east-1b": ["subnet-b1"]}, "security_group_id": "sg-east"},
+    }))
+    reset_runtime_context()
+    yield monkeypatch
+    reset_runtime_context()
+
+
+def test_parse_environment_should_give_each_fleet_its_own_placement(fleet_environment):
+    fleet_configs = parse_environment().fleet_configs()
+
+    assert fleet_configs["sensors-west"].region == "us-west-2"
+    assert fleet_configs["sensors-west"].subnet_map == {"us-west-2a": "subnet-west"}
+    assert fleet_configs["sensors-east"].security_group_id == "sg-east"
+    assert fleet_configs["sensors-east"].region == "" and fleet_configs["sensors-east"].fleets == {}
+    assert fleet_configs["sensors-west"].lifecycle_hook_names == ["west-launch-hook"]
+    assert fleet_configs["sensors-east"].lifecycle_hook_names == ["launch-hook", "terminate-hook"]
+
+
+def test_parse_environment_should_reject_a_fleet_without_a_security_group(fleet_environment):
+    fleet_environment.setenv(EnvironmentVariables.FLEETS.value, '{"sensors-west": {"subnets": {"a": "subnet-a"}}}')
+
+    with pytest.raises(Exception, match="sensors-west"):
+        parse_environment()
+
+
+def test_runtime_context_should_share_clients_per_region_but_not_aws_clients(fleet_environment):
+    router = get_runtime_context().router
+    default, west, east = router.default, router.fleet_for("sensors-west"), router.fleet_for("sensors-east")
+
+    assert east.aws_client.ec2_client is default.aws_client.ec2_client
+    assert east.aws_client is not default.aws_client
+    assert west.aws_client.ec2_client.meta.region_name == "us-west-2"
+    assert router.fleet_for("some-other-asg") is default
+
+
+def test_process_events_should_route_each_event_to_its_fleet_and_keep_the_order():
+    default, west = RecordingService("default"), RecordingService("west")
+    router = FleetRouter(fleet(default), {"sensors-west": fleet(west)})
+
+    results = router.process_events(
+        [event("i-1", "sensors"), event("i-2", "sensors-west"), event("i-3", "sensors"), event("i-4", "sensors-west")]
+    )
+
+    assert [result.event.instance_id for result in results] == ["i-1", "i-2", "i-3", "i-4"]
+    assert default.batches == [["i-1", "i-3"]] and west.batches == [["i-2", "i-4"]]
+
+
+def test_process_events_should_ignore_events_of_a_hook_not_configured_for_their_group():
+    default, west = RecordingService("default"), RecordingService("west")
+    router = FleetRouter(fleet(default, ["launch-hook"]), {"sensors-west": fleet(west, ["west-launch-hook"])})
+
+    results = router.process_events([
+        event("i-1", "sensors", "launch-hook"),
+        event("i-2", "sensors-west", "launch-hook"),
+        event("i-3", "sensors-west", "west-launch-hook"),
+    ])
+
+    assert default.batches == [["i-1"]] and west.batches == [["i-3"]]
+    assert results[1].ignored and results[1].action is None and results[1].completed
+    assert [result.action for result in (results[0], results[2])] == [LifecycleActionResult.CONTINUE] * 2
+
+
+def test_process_events_should_run_fleets_side_by_side_and_isolate_their_failures():
+    barrier = threading.Barrier(2)
+    default = RecordingService("default", barrier)
+    west = RecordingService("west", barrier, error=RuntimeError("RequestLimitExceeded"))
+    router = FleetRouter(fleet(default), {"sensors-west": fleet(west)})
+
+    results = router.process_events([event("i-1", "sensors"), event("i-2", "sensors-west")])
+
+    assert results[0].action == LifecycleActionResult.CONTINUE and results[0].error is None
+    assert results[1].action is None and isinstance(results[1].error, RuntimeError)
+
+
+def test_calls_made_for_an_event_should_carry_its_autoscaling_group():
+    records = []
+    metrics = MetricsLogger("Test", emit=lambda line: records.append(json.loads(line)))
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    stubber.add_response("delete_network_interface", {})
+    stubber.add_response("delete_network_interface", {})
+    stubber.activate()
+    aws_client = AwsClient(ec2_client, "bar", metrics=metrics)
+    # A second fleet on the same client must not record its calls twice
+    metrics.instrument(ec2_client)
+
+    with metrics_dimension("sensors-west"):
+        aws_client.delete_interface("eni-1")
+    aws_client.delete_interface("eni-2")
+
+    assert len(records) == 2
+    assert records[0]["AutoScalingGroupName"] == "sensors-west"
+    assert records[0]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [
+        ["Operation"], ["Operation", "AutoScalingGroupName"]
+    ]
+    assert "AutoScalingGroupName" not in records[1]
@@ -0,0 +1,180 @@
+import json
+import time
+from dataclasses import replace
+
+import boto3
+import botocore.exceptions
+import pytest
+from botocore.stub import Stubber
+
+from corelight_sensor_asg_nic_manager import AwsClient, Deadline, DynamoDbIdempotencyStore, EnvironmentConfig, \
+    Ec2LifecycleHookEvent, FileIdempotencyStore, IdempotencyStatus, IdempotencyStore, InMemoryIdempotencyStore, \
+    LayeredIdempotencyStore, LifecycleActionResult, DEADLINE_RESERVE, from_aws_event_bridge_json, handle_sqs_batch, \
+    run_sync
+from . import steps_of, test_data_dir
+
+event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="AutoScalingGroup",
+    lifecycle_hook_name="my-lifecycle-hook",
+    lifecycle_action_token="87654321-4321-4321-4321-210987654321"
+)
+
+cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345")
+instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}, "NetworkInterfaces": [{}]}
+
+
+def test_in_memory_store_should_claim_once_and_evict_the_least_recently_used_token():
+    store = InMemoryIdempotencyStore(max_entries=2)
+
+    assert store.claim("a") is None
+    assert store.claim("b") is None
+    assert store.claim("a").status == IdempotencyStatus.IN_PROGRESS
+    assert store.claim("c") is None
+
+    assert store.claim("b") is None  # evicted by "c"
+    store.complete("a", LifecycleActionResult.CONTINUE)
+    store.release("c")
+    assert store.claim("c") is None
+
+
+def test_file_store_should_be_shared_between_instances(tmp_path):
+    path = str(tmp_path / "idempotency.json")
+    first, second = FileIdempotencyStore(path), FileIdempotencyStore(path)
+
+    assert first.claim(event.lifecycle_action_token) is None
+    assert second.claim(event.lifecycle_action_token).status == IdempotencyStatus.IN_PROGRESS
+
+    first.complete(event.lifecycle_action_token, LifecycleActionResult.CONTINUE)
+    record = second.claim(event.lifecycle_action_token)
+    assert record.status == IdempotencyStatus.COMPLETED and record.action == "CONTINUE"
+    assert record.expires_at > time.time()
+
+
+def test_dynamodb_store_should_return_the_existing_record_when_the_condition_fails():
+    dynamodb_client = boto3.client("dynamodb")
+    stubber = Stubber(dynamodb_client)
+    stubber.add_response("put_item", {})
+    stubber.add_client_error(
+        "put_item",
+        service_error_code="ConditionalCheckFailedException",
+        response_meta={},
+        modeled_fields={"Item": {
+            "token": {"S": event.lifecycle_action_token},
+            "status": {"S": "COMPLETED"},
+            "expires_at": {"N": str(int(time.time()) + 60)},
+            "action": {"S": "ABANDON"}
+        }}
+    )
+    stubber.activate()
+    store = DynamoDbIdempotencyStore("my-table", dynamodb_client)
+
+    assert store.claim(event.lifecycle_action_token) is None
+    record = store.claim(event.lifecycle_action_token)
+
+    assert record.status == IdempotencyStatus.COMPLETED and record.action == "ABANDON"
+    stubber.assert_no_pending_responses()
+
+
+def test_layered_store_should_remember_completed_tokens_locally(mocker):
+    local, shared = InMemoryIdempotencyStore(), InMemoryIdempotencyStore()
+    store = LayeredIdempotencyStore(local, shared)
+    shared_claim_mocker = mocker.spy(shared, "claim")
+
+    assert store.claim("a") is None
+    store.complete("a", LifecycleActionResult.CONTINUE)
+
+    assert store.claim("a").action == "CONTINUE"
+    assert shared_claim_mocker.call_count == 1
+
+
+def test_store_missing_an_operation_should_not_be_created():
+    class ClaimOnlyStore(IdempotencyStore):
+        def claim(self, key: str):
+            return None
+
+    with pytest.raises(TypeError, match="complete, release"):
+        ClaimOnlyStore()
+
+
+def test_handle_event_should_skip_replayed_events_without_calling_aws(mocker, service_class):
+    aws_client = AwsClient("foo", "bar")
+    svc = service_class(cfg, aws_client)
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    first = run_sync(svc.handle_event(event, instance_data))
+    replay = run_sync(svc.handle_event(event, instance_data))
+
+    assert first.action == LifecycleActionResult.CONTINUE and not first.duplicate
+    assert replay.duplicate and replay.completed and replay.action == LifecycleActionResult.CONTINUE
+    assert process_mocker.call_count == 1 and complete_mocker.call_count == 1
+
+
+def test_handle_event_should_release_the_token_when_the_action_could_not_be_completed(mocker, service_class):
+    aws_client = AwsClient("foo", "bar")
+    svc = service_class(cfg, aws_client)
+    mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    mocker.patch.object(
+        aws_client,
+        "complete_lifecycle_action",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "Throttling", "Message": "slow down"}},
+            operation_name="complete_lifecycle_action")
+    )
+
+    assert not run_sync(svc.handle_event(event, instance_data)).completed
+    assert svc.idempotency_store.claim(event.lifecycle_action_token) is None
+
+
+def test_handle_event_should_skip_replays_of_an_event_abandoned_by_validation(mocker, service_class):
+    aws_client = AwsClient("foo", "bar")
+    svc = service_class(cfg, aws_client)
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+    ec2_event = replace(event, destination="EC2")
+
+    first = run_sync(svc.handle_event(ec2_event, instance_data))
+    replay = run_sync(svc.handle_event(ec2_event, instance_data))
+
+    assert first.action == LifecycleActionResult.ABANDON and not first.duplicate
+    assert replay.duplicate and replay.completed and replay.action == LifecycleActionResult.ABANDON
+    assert process_mocker.call_count == 0 and complete_mocker.call_count == 1
+
+
+def test_redelivery_of_an_event_whose_invocation_crashed_should_be_retried_until_it_is_completed(
+        mocker, service_class, tmp_path
+):
+    with open(f"{test_data_dir}/event.json") as fh:
+        body = fh.read()
+    sqs_event = {"Records": [{"messageId": "launch", "body": body}]}
+    token = from_aws_event_bridge_json(json.loads(body)).lifecycle_action_token
+    aws_client = AwsClient("foo", "bar")
+    svc = service_class(cfg, aws_client, FileIdempotencyStore(str(tmp_path / "tokens.json")))
+    describe_mocker = mocker.patch.object(aws_client, "get_instances_details", return_value={})
+    mocker.patch.object(aws_client, "get_instance_details", return_value={"Reservations": [{"Instances": [
+        {**instance_data, "InstanceId": "i-1234567890abcdef0"}
+    ]}]})
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+    # The invocation that claimed the token died before posting a result
+    svc.idempotency_store.claim(token, ttl=0.2)
+
+    assert handle_sqs_batch(svc, sqs_event) == {"batchItemFailures": [{"itemIdentifier": "launch"}]}
+    assert describe_mocker.call_count == 0 and complete_mocker.call_count == 0
+
+    time.sleep(0.3)
+    assert handle_sqs_batch(svc, sqs_event) == {"batchItemFailures": []}
+    assert process_mocker.call_count == 1 and complete_mocker.call_count == 1
+    assert handle_sqs_batch(svc, sqs_event) == {"batchItemFailures": []}
+    assert describe_mocker.call_count == 1 and complete_mocker.call_count == 1
+
+
+def test_claim_should_last_until_the_invocation_times_out(service_class):
+    svc = service_class(cfg, AwsClient("foo", "bar"))
+
+    run_sync(steps_of(svc).claim(event, Deadline().within(5)))
+
+    record = svc.idempotency_store.claim(event.lifecycle_action_token)
+    assert record.expires_at == pytest.approx(time.time() + 5 + DEADLINE_RESERVE, abs=0.5)
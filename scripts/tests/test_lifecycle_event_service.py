@@ -1,12 +1,14 @@
+import asyncio
 import json
 from unittest.mock import patch
 
 import botocore.exceptions
 import pytest
-from . import test_data_dir
+from . import steps_of, test_data_dir
 
-from corelight_sensor_asg_nic_manager import LifecycleEventService, EnvironmentConfig, Ec2LifecycleHookEvent, \
-    from_aws_event_bridge_json, AwsClient, LifecycleActionResult
+from corelight_sensor_asg_nic_manager import run_sync, EnvironmentConfig, Ec2LifecycleHookEvent, \
+    from_aws_event_bridge_json, AwsClient, LifecycleActionResult, LifecycleEventResult, handle_sqs_batch, \
+    ManagementInterfaceState, LifecycleTransition, LifecycleEventService
 
 # Equivalent of the test_data `event.json`
 event = Ec2LifecycleHookEvent(
@@ -39,23 +41,23 @@ def test_from_aws_event_bridge_json_should_create_an_event_object_if_payload_cor
         assert parsed_event.lifecycle_action_token == event.lifecycle_action_token
 
 
-def test_should_process_single_nic_instance_event(mocker):
+def test_should_process_single_nic_instance_event(mocker, service_class):
     with open(f"{test_data_dir}/single_nic_instance_describe_response.json") as fh:
         instance_data = json.load(fh)
         m = mocker.patch.object(aws_client, 'get_instance_details', return_value=instance_data)
-        svc = LifecycleEventService(cfg, aws_client)
-        assert svc.should_process_event(event) and m.call_count == 1
+        svc = service_class(cfg, aws_client)
+        assert run_sync(svc.should_process_event(event)) and m.call_count == 1
 
 
-def test_should_process_multiple_nics_should_return_false(mocker):
+def test_should_process_multiple_nics_should_return_false(mocker, service_class):
     with open(f"{test_data_dir}/multi_nic_instance_describe_response.json") as fh:
         instance_data = json.load(fh)
         m = mocker.patch.object(aws_client, 'get_instance_details', return_value=instance_data)
-        svc = LifecycleEventService(cfg, aws_client)
-        assert not svc.should_process_event(event) and m.call_count == 1
+        svc = service_class(cfg, aws_client)
+        assert not run_sync(svc.should_process_event(event)) and m.call_count == 1
 
 
-def test_complete_lifecycle_action_should_raise_exception_on_client_errors(mocker):
+def test_complete_lifecycle_action_should_raise_exception_on_client_errors(mocker, service_class):
     m = mocker.patch.object(
         aws_client,
         'complete_lifecycle_action',
@@ -64,23 +66,23 @@ def test_complete_lifecycle_action_should_raise_exception_on_client_errors(mocke
             operation_name="complete_lifecycle")
     )
     with pytest.raises(botocore.exceptions.ClientError):
-        LifecycleEventService(cfg, aws_client).complete_lifecycle_action(event, LifecycleActionResult.CONTINUE)
+        run_sync(service_class(cfg, aws_client).complete_lifecycle_action(event, LifecycleActionResult.CONTINUE))
 
     assert m.call_count == 1
 
 
-def test_complete_lifecycle_action_should_return_nothing_when_no_client_errors(mocker):
+def test_complete_lifecycle_action_should_return_nothing_when_no_client_errors(mocker, service_class):
     m = mocker.patch.object(
         aws_client,
         'complete_lifecycle_action',
         return_value={}
     )
 
-    LifecycleEventService(cfg, aws_client).complete_lifecycle_action(event, LifecycleActionResult.CONTINUE)
+    run_sync(service_class(cfg, aws_client).complete_lifecycle_action(event, LifecycleActionResult.CONTINUE))
     assert m.call_count == 1
 
 
-def test_process_event_should_raise_exception_on_nic_creation_client_error(mocker):
+def test_process_event_should_raise_exception_on_nic_creation_client_error(mocker, service_class):
     m = mocker.patch.object(
         aws_client,
         "create_interface",
@@ -89,15 +91,15 @@ def test_process_event_should_raise_exception_on_nic_creation_client_error(mocke
             operation_name="create_network_interface")
     )
 
-    svc = LifecycleEventService(cfg, aws_client)
+    svc = service_class(cfg, aws_client)
     svc.instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
 
     with pytest.raises(botocore.exceptions.ClientError):
-        svc.process_event(event)
+        run_sync(svc.process_event(event))
     assert m.call_count == 1
 
 
-def test_process_event_should_raise_exception_and_delete_nic_if_attachment_fails(mocker):
+def test_process_event_should_raise_exception_and_delete_nic_if_attachment_fails(mocker, service_class):
     create_nic_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
     attach_interface_mocker = mocker.patch.object(
         aws_client,
@@ -109,17 +111,17 @@ def test_process_event_should_raise_exception_and_delete_nic_if_attachment_fails
 
     delete_nic_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
 
-    svc = LifecycleEventService(cfg, aws_client)
+    svc = service_class(cfg, aws_client)
     svc.instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
 
     with pytest.raises(botocore.exceptions.ClientError):
-        svc.process_event(event)
+        run_sync(svc.process_event(event))
     assert create_nic_mocker.call_count == 1 and \
            attach_interface_mocker.call_count == 1 and \
            delete_nic_mocker.call_count == 1
 
 
-def test_process_event_should_raise_exception_and_delete_nic_if_attachment_modify_fails(mocker):
+def test_process_event_should_raise_exception_and_delete_nic_if_attachment_modify_fails(mocker, service_class):
     create_nic_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
     attach_mocker = mocker.patch.object(
         aws_client,
@@ -135,15 +137,315 @@ def test_process_event_should_raise_exception_and_delete_nic_if_attachment_modif
             operation_name="modify_network_interface_attribute")
     )
 
-    delete_nic_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+    cleanup = mocker.Mock()
+    cleanup.attach_mock(mocker.patch.object(aws_client, "detach_interface", return_value=None), "detach_interface")
+    cleanup.attach_mock(mocker.patch.object(aws_client, "delete_interface", return_value=None), "delete_interface")
 
-    svc = LifecycleEventService(cfg, aws_client)
+    svc = service_class(cfg, aws_client)
     svc.instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
 
     with pytest.raises(botocore.exceptions.ClientError):
-        svc.process_event(event)
+        run_sync(svc.process_event(event))
 
     assert create_nic_mocker.call_count == 1 and \
         attach_mocker.call_count == 1 and \
-        modify_attachment_mocker.call_count == 1 and \
-        delete_nic_mocker.call_count == 1
+        modify_attachment_mocker.call_count == 1
+    # The interface is still attached, it has to be detached before it can be deleted
+    assert cleanup.mock_calls == [
+        mocker.call.detach_interface("foo", "eni-12345"), mocker.call.delete_interface("eni-12345")
+    ]
+
+
+def test_process_event_should_raise_the_original_error_when_detaching_the_nic_fails(mocker, service_class):
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "foo"})
+    mocker.patch.object(
+        aws_client,
+        "modify_attachment_to_delete_on_termination",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "fubar", "Message": "error"}},
+            operation_name="modify_network_interface_attribute")
+    )
+    detach_mocker = mocker.patch.object(
+        aws_client,
+        "detach_interface",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "IncorrectState", "Message": "error"}},
+            operation_name="detach_network_interface")
+    )
+    delete_nic_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+
+    svc = service_class(cfg, aws_client)
+    svc.instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
+
+    with pytest.raises(botocore.exceptions.ClientError) as raised:
+        run_sync(svc.process_event(event))
+
+    assert raised.value.operation_name == "modify_network_interface_attribute"
+    detach_mocker.assert_called_once_with("foo", "eni-12345")
+    delete_nic_mocker.assert_called_once_with("eni-12345")
+
+
+def load_instance(instance_id: str) -> dict:
+    with open(f"{test_data_dir}/single_nic_instance_describe_response.json") as fh:
+        instance = json.load(fh)['Reservations'][0]['Instances'][0]
+    instance['InstanceId'] = instance_id
+    return instance
+
+
+def batch_event(instance_id: str) -> Ec2LifecycleHookEvent:
+    return Ec2LifecycleHookEvent(
+        instance_id=instance_id,
+        autoscaling_group_name="my-asg",
+        destination="AutoScalingGroup",
+        lifecycle_hook_name="my-lifecycle-hook",
+        lifecycle_action_token=f"token-{instance_id}"
+    )
+
+
+def test_process_events_should_describe_batch_once_and_report_results_per_event(mocker, service_class):
+    describe_batch_mocker = mocker.patch.object(
+        aws_client,
+        "get_instances_details",
+        return_value={"i-good": load_instance("i-good"), "i-bad": load_instance("i-bad")}
+    )
+    describe_mocker = mocker.patch.object(aws_client, "get_instance_details")
+    mocker.patch.object(aws_client, "create_interface", side_effect=["eni-1", "eni-2"])
+
+    def attach_interface(interface_id, instance_id):
+        # The events are handled concurrently, so fail by instance rather than by call order
+        if instance_id == "i-bad":
+            raise botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "fubar", "Message": "error"}},
+                operation_name="attach_network_interface")
+        return {"AttachmentId": f"{interface_id}-attach"}
+
+    attach_mocker = mocker.patch.object(aws_client, "attach_interface", side_effect=attach_interface)
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    delete_nic_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    results = run_sync(service_class(cfg, aws_client).process_events([batch_event("i-good"), batch_event("i-bad")]))
+
+    assert [result.action for result in results] == [LifecycleActionResult.CONTINUE, LifecycleActionResult.ABANDON]
+    assert results[0].error is None and isinstance(results[1].error, botocore.exceptions.ClientError)
+    assert describe_batch_mocker.call_count == 1 and describe_mocker.call_count == 0
+    bad_interface_id = next(call.args[0] for call in attach_mocker.call_args_list if call.args[1] == "i-bad")
+    delete_nic_mocker.assert_called_once_with(bad_interface_id)
+    assert complete_mocker.call_count == 2
+
+
+def test_blocking_service_should_handle_events_without_an_event_loop(mocker):
+    mocker.patch.object(aws_client, "get_instances_details", return_value={
+        "i-1": load_instance("i-1"), "i-2": load_instance("i-2")
+    })
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-12345")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-12345"})
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+    event_loop_mocker = mocker.patch.object(asyncio, "run", wraps=asyncio.run)
+    svc = LifecycleEventService(cfg, aws_client)
+
+    results = svc.process_events([batch_event("i-1"), batch_event("i-2")])
+    result = svc.handle_event(batch_event("i-3"), load_instance("i-3"))
+
+    assert [r.action for r in results + [result]] == [LifecycleActionResult.CONTINUE] * 3
+    assert event_loop_mocker.call_count == 0
+
+
+def test_process_events_should_describe_individually_if_batch_describe_fails(mocker, service_class):
+    mocker.patch.object(
+        aws_client,
+        "get_instances_details",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "InvalidInstanceID.NotFound", "Message": "error"}},
+            operation_name="describe_instances")
+    )
+
+    def get_instance_details(instance_id):
+        # The events are handled concurrently, so answer by instance rather than by call order
+        if instance_id == "i-gone":
+            raise botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "InvalidInstanceID.NotFound", "Message": "error"}},
+                operation_name="describe_instances")
+        return {"Reservations": [{"Instances": [load_instance(instance_id)]}]}
+
+    describe_mocker = mocker.patch.object(aws_client, "get_instance_details", side_effect=get_instance_details)
+    mocker.patch.object(aws_client, "create_interface", return_value="eni-good")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-good"})
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    results = run_sync(service_class(cfg, aws_client).process_events([batch_event("i-good"), batch_event("i-gone")]))
+
+    assert [result.action for result in results] == [LifecycleActionResult.CONTINUE, LifecycleActionResult.ABANDON]
+    assert describe_mocker.call_count == 2
+
+
+def test_handle_sqs_batch_should_only_report_messages_that_could_not_be_completed(mocker, service_class):
+    with open(f"{test_data_dir}/event.json") as fh:
+        event_data = json.load(fh)
+
+    svc = service_class(cfg, aws_client)
+    mocker.patch.object(svc, "process_events", return_value=[
+        LifecycleEventResult(event, LifecycleActionResult.CONTINUE),
+        LifecycleEventResult(event, None, Exception("unable to complete lifecycle action"))
+    ])
+
+    resp = handle_sqs_batch(svc, {"Records": [
+        {"messageId": "completed", "body": json.dumps(event_data)},
+        {"messageId": "malformed", "body": "{}"},
+        {"messageId": "failed", "body": json.dumps(event_data)},
+    ]})
+
+    assert resp == {"batchItemFailures": [{"itemIdentifier": "malformed"}, {"itemIdentifier": "failed"}]}
+
+
+def two_nic_instance(subnet_id: str = "subnet-foo", status: str = "attached", delete_on_termination: bool = True) -> dict:
+    return {
+        "Placement": {"AvailabilityZone": "us-east-1a"},
+        "NetworkInterfaces": [
+            {
+                "NetworkInterfaceId": "eni-primary",
+                "SubnetId": "subnet-monitoring",
+                "Groups": [{"GroupId": "sg-monitoring"}],
+                "Attachment": {"AttachmentId": "eni-attach-primary", "DeviceIndex": 0, "Status": "attached"}
+            },
+            {
+                "NetworkInterfaceId": "eni-management",
+                "SubnetId": subnet_id,
+                "Groups": [{"GroupId": "sg-12345"}],
+                "Attachment": {
+                    "AttachmentId": "eni-attach-management",
+                    "DeviceIndex": 1,
+                    "Status": status,
+                    "DeleteOnTermination": delete_on_termination
+                }
+            }
+        ]
+    }
+
+
+def test_inspect_interfaces_should_accept_a_management_interface_in_the_right_place(service_class):
+    svc = service_class(cfg, aws_client)
+
+    assert svc.inspect_interfaces(event, two_nic_instance())[0] == ManagementInterfaceState.ATTACHED
+    assert svc.inspect_interfaces(event, two_nic_instance("subnet-bar"))[0] == ManagementInterfaceState.INCONSISTENT
+    assert svc.inspect_interfaces(event, two_nic_instance(status="detaching"))[0] == \
+        ManagementInterfaceState.INCONSISTENT
+
+
+def test_handle_event_should_continue_without_provisioning_when_the_interface_is_already_attached(
+        mocker, service_class
+):
+    svc = service_class(cfg, aws_client)
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event")
+    modify_mocker = mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(svc.handle_event(event, two_nic_instance(delete_on_termination=False)))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert process_mocker.call_count == 0
+    modify_mocker.assert_called_once_with("eni-attach-management", "eni-management")
+    assert complete_mocker.call_args.kwargs["lifecycle_action_result"] == LifecycleActionResult.CONTINUE
+
+
+terminate_event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="EC2",
+    lifecycle_hook_name="my-terminate-hook",
+    lifecycle_action_token="12345678-4321-4321-4321-210987654321",
+    lifecycle_transition=LifecycleTransition.TERMINATING.value
+)
+
+
+def test_from_aws_event_bridge_json_should_parse_the_lifecycle_transition():
+    with open(f"{test_data_dir}/event.json") as fh:
+        event_data = json.load(fh)
+    assert not from_aws_event_bridge_json(event_data).terminating
+
+    event_data["detail"]["LifecycleTransition"] = LifecycleTransition.TERMINATING.value
+    assert from_aws_event_bridge_json(event_data).terminating
+
+
+def test_handle_terminate_event_should_tear_down_interfaces_not_deleted_on_termination(mocker, service_class):
+    instance_data = two_nic_instance(delete_on_termination=False)
+    detach_mocker = mocker.patch.object(aws_client, "detach_interface", return_value=None)
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(service_class(cfg, aws_client).handle_event(terminate_event, instance_data))
+
+    assert result.action == LifecycleActionResult.CONTINUE and result.error is None
+    detach_mocker.assert_called_once_with("eni-attach-management", "eni-management")
+    delete_mocker.assert_called_once_with("eni-management")
+    assert complete_mocker.call_args.kwargs["lifecycle_hook_name"] == "my-terminate-hook"
+
+
+def test_handle_terminate_event_should_leave_interfaces_deleted_on_termination_to_ec2(mocker, service_class):
+    detach_mocker = mocker.patch.object(aws_client, "detach_interface", return_value=None)
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(service_class(cfg, aws_client).handle_event(terminate_event, two_nic_instance()))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert detach_mocker.call_count == 0
+
+
+def test_handle_terminate_event_should_continue_when_the_teardown_fails(mocker, service_class):
+    mocker.patch.object(aws_client, "detach_interface", side_effect=Exception("not detached in time"))
+    complete_mocker = mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(service_class(cfg, aws_client).handle_event(
+        terminate_event, two_nic_instance(delete_on_termination=False)
+    ))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert complete_mocker.call_args.kwargs["lifecycle_action_result"] == LifecycleActionResult.CONTINUE
+
+
+trusting_cfg = EnvironmentConfig(
+    {"us-east-1a": "subnet-foo", "us-east-1b": "subnet-bar"}, "sg-12345",
+    trust_event_data=True, monitoring_subnets={"subnet-monitoring": "us-east-1a"}
+)
+
+
+def test_handle_event_should_skip_describe_instances_when_the_event_data_is_trusted(mocker, service_class):
+    svc = service_class(trusting_cfg, aws_client)
+    describe_mocker = mocker.patch.object(steps_of(svc), "get_instance_data")
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(svc.handle_event(event))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert describe_mocker.call_count == 0
+    assert process_mocker.call_args.args[1]["Placement"]["AvailabilityZone"] == "us-east-1a"
+
+
+def test_handle_event_should_describe_the_instance_when_the_availability_zone_is_ambiguous(mocker, service_class):
+    multi_az_cfg = EnvironmentConfig(
+        {"us-east-1a": "subnet-foo", "us-east-1b": "subnet-bar"}, "sg-12345",
+        trust_event_data=True, monitoring_subnets={"subnet-monitoring": "us-east-1a", "subnet-other": "us-east-1b"}
+    )
+    svc = service_class(multi_az_cfg, aws_client)
+    describe_mocker = mocker.patch.object(steps_of(svc), "get_instance_data", return_value=load_instance(event.instance_id))
+    mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    assert run_sync(svc.handle_event(event)).action == LifecycleActionResult.CONTINUE
+    assert describe_mocker.call_count == 1
+
+
+def test_handle_event_should_fall_back_to_describe_instances_when_the_trusted_attach_fails(mocker, service_class):
+    svc = service_class(trusting_cfg, aws_client)
+    describe_mocker = mocker.patch.object(steps_of(svc), "get_instance_data", return_value=two_nic_instance())
+    process_mocker = mocker.patch.object(steps_of(svc), "process_event", side_effect=Exception("interface already attached"))
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    result = run_sync(svc.handle_event(event))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert describe_mocker.call_count == 1 and process_mocker.call_count == 1
@@ -0,0 +1,63 @@
+import pytest
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from benchmarks.bench_burst_scale_out import run
+from benchmarks.fake_aws import FakeAwsProfile
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("METRICS_ENABLED", "false")
+    monkeypatch.setenv("TARGET_SUBNETS", "{}")
+    monkeypatch.setenv("TARGET_SECURITY_GROUP_ID", "")
+    monkeypatch.setenv("TRUST_EVENT_DATA", "false")
+    monkeypatch.setenv("MONITORING_SUBNETS", "{}")
+    monkeypatch.setenv("ASYNC_PIPELINE", "false")
+    yield
+    nic_manager.reset_runtime_context()
+
+
+def test_burst_should_continue_every_instance_with_one_call_per_step():
+    report = run(instances=20, lambda_concurrency=10)
+
+    assert (report["continued"], report["abandoned"], report["incomplete"]) == (20, 0, 0)
+    assert report["calls"]["CreateNetworkInterface"] == 20
+    assert report["calls"]["CompleteLifecycleAction"] == 20
+    assert report["interfaces"] == {"in-use": 20}
+
+
+def test_batched_burst_should_describe_each_batch_once():
+    report = run(instances=20, mode="sqs", batch_size=10)
+
+    assert report["continued"] == 20
+    assert report["calls"]["DescribeInstances"] == 2
+
+
+def test_failed_launches_should_not_leave_interfaces_behind():
+    profile = FakeAwsProfile(
+        error_rate=0.5, error_code="UnauthorizedOperation", fault_operations=("ModifyNetworkInterfaceAttribute",)
+    )
+    report = run(instances=20, profile=profile, seed=7)
+
+    assert report["continued"] + report["abandoned"] == 20 and report["abandoned"] > 0
+    assert report["interfaces"] == {"in-use": report["continued"]}
+
+
+def test_trusted_event_data_should_skip_describe_instances_in_a_single_az_fleet():
+    report = run(
+        instances=10,
+        subnets={"us-east-1a": ["subnet-a"]},
+        environment={"TRUST_EVENT_DATA": "true", "MONITORING_SUBNETS": '{"subnet-monitoring": "us-east-1a"}'}
+    )
+
+    assert report["continued"] == 10
+    assert "DescribeInstances" not in report["calls"]
+
+
+def test_async_pipeline_should_continue_every_instance_of_a_batch():
+    report = run(instances=20, mode="sqs", batch_size=20, environment={"ASYNC_PIPELINE": "true"})
+
+    assert (report["continued"], report["abandoned"], report["incomplete"]) == (20, 0, 0)
+    assert report["calls"]["DescribeInstances"] == 1
+    assert report["interfaces"] == {"in-use": 20}
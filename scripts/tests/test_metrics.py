@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import botocore.exceptions
+import pytest
+from botocore.stub import Stubber
+
+from corelight_sensor_asg_nic_manager import AwsClient, EnvironmentConfig, Ec2LifecycleHookEvent, \
+    run_sync, MetricNames, MetricsLogger
+from . import steps_of
+
+
+@pytest.fixture
+def records() -> list:
+    return []
+
+
+@pytest.fixture
+def metrics(records) -> MetricsLogger:
+    return MetricsLogger("Test/Namespace", emit=lambda line: records.append(json.loads(line)))
+
+
+def test_put_should_write_an_embedded_metric_format_record(metrics, records):
+    metrics.put({"Foo": (12.5, "Milliseconds")}, {"Operation": "Bar"}, {"InstanceId": "i-12345"})
+
+    assert len(records) == 1
+    directive = records[0]["_aws"]["CloudWatchMetrics"][0]
+    assert directive == {
+        "Namespace": "Test/Namespace",
+        "Dimensions": [["Operation"]],
+        "Metrics": [{"Name": "Foo", "Unit": "Milliseconds"}]
+    }
+    assert records[0]["Foo"] == 12.5 and records[0]["Operation"] == "Bar" and records[0]["InstanceId"] == "i-12345"
+
+
+def test_put_should_not_emit_when_disabled(records):
+    MetricsLogger(enabled=False, emit=records.append).put({"Foo": (1, "Count")}, {"Operation": "Bar"})
+
+    assert records == []
+
+
+def test_instrumented_client_should_record_latency_retries_and_outcome_of_every_call(metrics, records):
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    aws_client = AwsClient(ec2_client, "bar", metrics=metrics)
+    stubber.add_response(
+        "attach_network_interface",
+        {"AttachmentId": "eni-attach-12345", "ResponseMetadata": {"RetryAttempts": 2, "RequestId": "req-1"}}
+    )
+    stubber.add_client_error("delete_network_interface", service_error_code="InvalidNetworkInterface.InUse")
+    stubber.activate()
+
+    aws_client.attach_interface("eni-12345", "i-12345")
+    with pytest.raises(botocore.exceptions.ClientError):
+        aws_client.delete_interface("eni-12345")
+
+    assert [r["Operation"] for r in records] == ["AttachNetworkInterface", "DeleteNetworkInterface"]
+    assert records[0][MetricNames.AWS_CALL_RETRIES.value] == 2 and records[0]["RequestId"] == "req-1"
+    assert records[0]["Outcome"] == "Success" and records[0][MetricNames.AWS_CALL_ERRORS.value] == 0
+    assert records[1]["Outcome"] == "InvalidNetworkInterface.InUse" and records[1][MetricNames.AWS_CALL_ERRORS.value] == 1
+    assert all(r[MetricNames.AWS_CALL_LATENCY.value] >= 0 for r in records)
+
+
+def test_handle_event_should_record_launch_to_continue_latency(mocker, metrics, records, service_class):
+    aws_client = AwsClient("foo", "bar", metrics=metrics)
+    svc = service_class(EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345"), aws_client)
+    event_time = (datetime.now(timezone.utc) - timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    event = Ec2LifecycleHookEvent(
+        instance_id="i-12345",
+        autoscaling_group_name="my-asg",
+        destination="AutoScalingGroup",
+        lifecycle_hook_name="my-lifecycle-hook",
+        lifecycle_action_token="87654321-4321-4321-4321-210987654321",
+        event_time=event_time
+    )
+    mocker.patch.object(steps_of(svc), "process_event", return_value={})
+    mocker.patch.object(aws_client, "complete_lifecycle_action", return_value=None)
+
+    run_sync(svc.handle_event(event, {"Placement": {"AvailabilityZone": "us-east-1a"}, "NetworkInterfaces": [{}]}))
+
+    assert len(records) == 1
+    assert records[0]["AutoScalingGroupName"] == "my-asg" and records[0]["InstanceId"] == "i-12345"
+    assert 30000 <= records[0][MetricNames.LAUNCH_TO_CONTINUE_LATENCY.value] < 60000
@@ -0,0 +1,111 @@
+import time
+
+import botocore.exceptions
+import pytest
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import AwsClient, Deadline, EnvironmentConfig, MetricsLogger, \
+    OrphanedInterfaceCollector, CREATED_AT_TAG_KEY, MANAGED_TAG_KEY, WARM_POOL_TAG_KEY
+
+cfg = EnvironmentConfig(
+    {"us-east-1a": "subnet-foo"}, "sg-12345", orphan_min_age=600, orphan_delete_batch_size=2, orphan_delete_rate=1000
+)
+
+
+def available_interface(interface_id: str, age: int, ips: int = 1, warm_pool: bool = False) -> dict:
+    tags = [{"Key": MANAGED_TAG_KEY, "Value": "true"}, {"Key": CREATED_AT_TAG_KEY, "Value": str(int(time.time()) - age)}]
+    if warm_pool:
+        tags.append({"Key": WARM_POOL_TAG_KEY, "Value": "true"})
+    return {
+        "NetworkInterfaceId": interface_id,
+        "SubnetId": "subnet-foo",
+        "Status": "available",
+        "PrivateIpAddresses": [{"PrivateIpAddress": f"10.0.0.{i}"} for i in range(ips)],
+        "TagSet": tags
+    }
+
+
+@pytest.fixture
+def aws_client() -> AwsClient:
+    return AwsClient("foo", "bar")
+
+
+def test_sweep_should_only_delete_interfaces_older_than_the_minimum_age(mocker, aws_client):
+    list_mocker = mocker.patch.object(aws_client, "get_available_managed_interfaces", return_value=[
+        available_interface("eni-old", age=3600, ips=2),
+        available_interface("eni-new", age=10),
+        available_interface("eni-untagged-age", age=0) | {"TagSet": [{"Key": MANAGED_TAG_KEY, "Value": "true"}]},
+    ])
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+
+    result = OrphanedInterfaceCollector(cfg, aws_client).sweep()
+
+    list_mocker.assert_called_once_with(["subnet-foo"], "sg-12345")
+    # An interface without a creation time predates the tag, it may still be in use
+    assert [c.args[0] for c in delete_mocker.call_args_list] == ["eni-old"]
+    assert (result.scanned, result.reclaimed, result.freed_ips, result.failed) == (3, 1, 2, 0)
+
+
+def test_sweep_should_leave_warm_pool_interfaces_to_the_pool(mocker, aws_client):
+    pool_cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345", warm_pool_size=2, orphan_min_age=600)
+    mocker.patch.object(aws_client, "get_available_managed_interfaces", return_value=[
+        available_interface("eni-pool", age=3600, warm_pool=True),
+    ])
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+
+    assert OrphanedInterfaceCollector(pool_cfg, aws_client).sweep().reclaimed == 0
+    assert delete_mocker.call_count == 0
+
+
+def test_sweep_should_count_failures_and_rate_limit_batches(mocker, aws_client):
+    mocker.patch.object(aws_client, "get_available_managed_interfaces", return_value=[
+        available_interface(f"eni-{i}", age=3600) for i in range(5)
+    ])
+    def delete_interface(interface_id: str):
+        if interface_id == "eni-3":
+            raise botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "InvalidNetworkInterface.InUse", "Message": "in use"}},
+                operation_name="delete_network_interface")
+
+    mocker.patch.object(aws_client, "delete_interface", side_effect=delete_interface)
+    sleep_mocker = mocker.patch("corelight_sensor_asg_nic_manager.time.sleep")
+
+    result = OrphanedInterfaceCollector(cfg, aws_client).sweep()
+
+    assert (result.reclaimed, result.failed) == (4, 1)
+    assert sleep_mocker.call_count == 2  # between the three batches of two
+
+
+def test_sweep_should_stop_at_the_deadline_and_report_metrics(mocker):
+    records = []
+    aws_client = AwsClient("foo", "bar", metrics=MetricsLogger("Test", emit=records.append))
+    slow_cfg = EnvironmentConfig(
+        {"us-east-1a": "subnet-foo"}, "sg-12345", orphan_min_age=600, orphan_delete_batch_size=1, orphan_delete_rate=1
+    )
+    mocker.patch.object(aws_client, "get_available_managed_interfaces", return_value=[
+        available_interface("eni-1", age=3600), available_interface("eni-2", age=3600)
+    ])
+    mocker.patch.object(aws_client, "delete_interface", return_value=None)
+
+    result = OrphanedInterfaceCollector(slow_cfg, aws_client).sweep(Deadline().within(0.5))
+
+    assert (result.reclaimed, result.skipped) == (0, 2)
+    assert '"OrphanedInterfacesReclaimed":0' in records[0]
+
+
+def test_lambda_handler_should_run_the_sweep_for_the_scheduled_action(mocker, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("TARGET_SUBNETS", '{"us-east-1a": "subnet-foo"}')
+    monkeypatch.setenv("TARGET_SECURITY_GROUP_ID", "sg-12345")
+    monkeypatch.setenv("METRICS_ENABLED", "false")
+    nic_manager.reset_runtime_context()
+    sweep_mocker = mocker.patch.object(
+        OrphanedInterfaceCollector, "sweep", return_value=nic_manager.SweepResult(scanned=1, reclaimed=1, freed_ips=1)
+    )
+    validate_mocker = mocker.patch.object(nic_manager.PreflightValidator, "validate", return_value=None)
+
+    resp = nic_manager.lambda_handler({"action": nic_manager.ORPHANED_INTERFACE_SWEEP_ACTION}, None)
+
+    assert resp["reclaimed"] == 1 and sweep_mocker.call_count == 1
+    assert validate_mocker.call_count == 1
+    nic_manager.reset_runtime_context()
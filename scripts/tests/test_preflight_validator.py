@@ -0,0 +1,145 @@
+import json
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import AwsClient, EnvironmentConfig, EnvironmentVariables, PreflightValidator
+from . import test_data_dir
+
+VPC_ID = "vpc-12345"
+
+
+def subnet(subnet_id: str, availability_zone: str, vpc_id: str = VPC_ID) -> dict:
+    return {"SubnetId": subnet_id, "AvailabilityZone": availability_zone, "VpcId": vpc_id}
+
+
+def stubbed_client(subnets: list, groups: list, repeat: int = 1) -> tuple:
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    for _ in range(repeat):
+        stubber.add_response("describe_subnets", {"Subnets": subnets})
+        stubber.add_response("describe_security_groups", {"SecurityGroups": groups})
+    stubber.activate()
+    return ec2_client, stubber
+
+
+@pytest.fixture
+def cfg() -> EnvironmentConfig:
+    return EnvironmentConfig(
+        {"us-east-1a": ["subnet-a1", "subnet-a2"], "us-east-1b": "subnet-b"},
+        "sg-12345",
+        monitoring_subnets={"subnet-monitoring": "us-east-1a"},
+        vpc_id=VPC_ID,
+        preflight_ttl=300
+    )
+
+
+def test_check_should_accept_a_valid_configuration_with_one_call_per_resource_type(cfg):
+    ec2_client, stubber = stubbed_client(
+        [subnet("subnet-a1", "us-east-1a"), subnet("subnet-a2", "us-east-1a"), subnet("subnet-b", "us-east-1b"),
+         subnet("subnet-monitoring", "us-east-1a")],
+        [{"GroupId": "sg-12345", "VpcId": VPC_ID}]
+    )
+
+    result = PreflightValidator(cfg, AwsClient(ec2_client, "bar")).check()
+
+    assert result.ok
+    stubber.assert_no_pending_responses()
+
+
+def test_check_should_report_every_misplaced_or_missing_resource(cfg):
+    ec2_client, _ = stubbed_client(
+        [subnet("subnet-a1", "us-east-1b"), subnet("subnet-b", "us-east-1b", vpc_id="vpc-other"),
+         subnet("subnet-monitoring", "us-east-1a")],
+        []
+    )
+
+    result = PreflightValidator(cfg, AwsClient(ec2_client, "bar")).check()
+
+    assert result.problems == [
+        "security group sg-12345 does not exist",
+        "subnet subnet-a1 is in us-east-1b, expected us-east-1a",
+        "subnet subnet-a2 does not exist",
+        "subnet subnet-b is in vpc-other, expected vpc-12345",
+    ]
+
+
+def test_check_should_expect_the_security_group_vpc_when_none_is_configured(cfg):
+    cfg.vpc_id = ""
+    ec2_client, _ = stubbed_client(
+        [subnet("subnet-a1", "us-east-1a"), subnet("subnet-a2", "us-east-1a"), subnet("subnet-b", "us-east-1b"),
+         subnet("subnet-monitoring", "us-east-1a")],
+        [{"GroupId": "sg-12345", "VpcId": "vpc-other"}]
+    )
+
+    result = PreflightValidator(cfg, AwsClient(ec2_client, "bar")).check()
+
+    assert len(result.problems) == 4
+    assert all(problem.endswith("expected vpc-other") for problem in result.problems)
+
+
+def test_validate_should_cache_the_result_for_the_ttl(cfg, monkeypatch):
+    ec2_client, stubber = stubbed_client([], [], repeat=2)
+    validator = PreflightValidator(cfg, AwsClient(ec2_client, "bar"))
+
+    first = validator.validate()
+    assert validator.validate() is first
+
+    monkeypatch.setattr(nic_manager.time, "monotonic", lambda: first.checked_at + cfg.preflight_ttl + 1)
+    assert validator.validate() is not first
+    stubber.assert_no_pending_responses()
+
+
+def test_validate_should_be_skipped_without_a_ttl(cfg):
+    cfg.preflight_ttl = 0
+
+    assert PreflightValidator(cfg, AwsClient("foo", "bar")).validate() is None
+
+
+def test_validate_should_not_cache_a_check_that_could_not_run(cfg):
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    stubber.add_client_error("describe_subnets", "UnauthorizedOperation", http_status_code=403)
+    stubber.activate()
+    validator = PreflightValidator(cfg, AwsClient(ec2_client, "bar"))
+
+    assert validator.validate() is None
+    assert validator._result is None
+
+
+def test_cli_should_exit_non_zero_on_problems(cfg, monkeypatch, capsys):
+    # main() sets the variables it is given, registering them here has them restored afterwards
+    for variable in (EnvironmentVariables.TARGET_SUBNETS, EnvironmentVariables.TARGET_SECURITY_GROUP_ID,
+                     EnvironmentVariables.TARGET_VPC_ID, EnvironmentVariables.MONITORING_SUBNETS):
+        monkeypatch.setenv(variable.value, "")
+    ec2_client, _ = stubbed_client([subnet("subnet-a", "us-east-1a")], [])
+    monkeypatch.setattr(nic_manager, "create_boto_client", lambda *args, **kwargs: ec2_client)
+
+    exit_code = nic_manager.main(
+        ["--subnets", json.dumps({"us-east-1a": "subnet-a"}), "--security-group", "sg-12345", "--json"]
+    )
+
+    assert exit_code == 1
+    assert json.loads(capsys.readouterr().out) == {"ok": False, "problems": ["security group sg-12345 does not exist"]}
+
+
+def test_lambda_handler_should_validate_once_the_lifecycle_action_is_completed(mocker, monkeypatch):
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SUBNETS.value, '{"us-east-1a": "subnet-foo"}')
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "sg-12345")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    nic_manager.reset_runtime_context()
+    calls = []
+    mocker.patch.object(PreflightValidator, "validate", side_effect=lambda: calls.append("validate"))
+    mocker.patch.object(
+        nic_manager.LifecycleEventService, "handle_event",
+        side_effect=lambda event, **kwargs: calls.append("handle_event") or nic_manager.LifecycleEventResult(event)
+    )
+    with open(f"{test_data_dir}/event.json") as fh:
+        event = json.load(fh)
+
+    nic_manager.lambda_handler(event, None)
+
+    assert calls == ["handle_event", "validate"]
+    nic_manager.reset_runtime_context()
@@ -0,0 +1,183 @@
+import random
+
+import boto3
+import botocore.exceptions
+import pytest
+from botocore.stub import Stubber
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import AdaptiveRateLimiter, AwsClient, Deadline, RateLimitExceeded
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(nic_manager, "RETRY_BASE_DELAY", 0.001)
+
+
+def test_limiter_should_not_limit_until_throttled_then_halve_the_observed_rate():
+    clock = SimulatedClock()
+    limiter = AdaptiveRateLimiter(clock, clock.sleep)
+    for _ in range(40):
+        limiter.acquire()
+        clock.now += 0.025
+
+    assert limiter.rate is None and clock.slept == []
+
+    # A few throttles are left to the retries, a fifth of the calls of the last second being throttled is a burst
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate is None
+    for _ in range(6):
+        limiter.on_throttle()
+    assert limiter.rate == pytest.approx(19.5)
+    limiter.on_throttle()  # same burst, only counted once
+    assert limiter.rate == pytest.approx(19.5)
+
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.slept == [pytest.approx(1 / 19.5), pytest.approx(1 / 19.5)]
+
+
+def test_limiter_should_not_slow_down_on_random_throttles():
+    clock = SimulatedClock()
+    limiter = AdaptiveRateLimiter(clock, clock.sleep)
+    for call in range(1000):
+        limiter.acquire()
+        if call % 20 == 0:
+            limiter.on_throttle()
+        else:
+            limiter.on_success()
+        clock.now += 0.01
+
+    assert limiter.rate is None and clock.slept == []
+
+
+def test_limiter_should_recover_while_calls_succeed_and_respect_the_max_wait():
+    clock = SimulatedClock()
+    limiter = AdaptiveRateLimiter(clock, clock.sleep)
+    limiter.acquire()
+    for _ in range(nic_manager.RATE_LIMIT_MIN_THROTTLES):
+        limiter.on_throttle()
+    assert limiter.rate == nic_manager.RATE_LIMIT_MIN
+
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate > 2
+
+    # Concurrent callers queue up behind each other, the call that would wait too long is refused
+    queued = AdaptiveRateLimiter(clock, lambda seconds: None)
+    queued.acquire()
+    for _ in range(nic_manager.RATE_LIMIT_MIN_THROTTLES):
+        queued.on_throttle()
+    queued.acquire(max_wait=2)
+    with pytest.raises(RateLimitExceeded):
+        queued.acquire(max_wait=2)
+
+
+def throttle_error(stubber: Stubber, operation: str):
+    stubber.add_client_error(operation, service_error_code="RequestLimitExceeded", http_status_code=503)
+
+
+def test_aws_client_should_retry_throttled_calls_and_slow_the_action_down():
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    for _ in range(nic_manager.RATE_LIMIT_MIN_THROTTLES):
+        throttle_error(stubber, "attach_network_interface")
+    stubber.add_response("attach_network_interface", {"AttachmentId": "eni-attach-12345"})
+    stubber.activate()
+    aws_client = AwsClient(ec2_client, "bar")
+
+    assert aws_client.attach_interface("eni-12345", "i-12345") == {"AttachmentId": "eni-attach-12345"}
+    assert aws_client.rate_limiter("attach_network_interface").rate is not None
+    assert aws_client.rate_limiter("delete_network_interface").rate is None
+    stubber.assert_no_pending_responses()
+
+
+def test_aws_client_should_not_retry_past_the_deadline_or_on_other_errors():
+    ec2_client = boto3.client("ec2")
+    stubber = Stubber(ec2_client)
+    throttle_error(stubber, "attach_network_interface")
+    stubber.add_client_error("delete_network_interface", service_error_code="InvalidNetworkInterface.InUse")
+    stubber.activate()
+    aws_client = AwsClient(ec2_client, "bar")
+    aws_client.deadline = Deadline().within(0)
+
+    with pytest.raises(botocore.exceptions.ClientError, match="RequestLimitExceeded"):
+        aws_client.attach_interface("eni-12345", "i-12345")
+    aws_client.deadline = Deadline()
+    with pytest.raises(botocore.exceptions.ClientError, match="InUse"):
+        aws_client.delete_interface("eni-12345")
+    stubber.assert_no_pending_responses()
+
+
+def test_aws_client_should_create_one_interface_when_retrying_after_a_dropped_connection(mocker):
+    ec2_client = mocker.MagicMock()
+    ec2_client.create_network_interface.side_effect = [
+        botocore.exceptions.ConnectionClosedError(endpoint_url="https://ec2.us-east-1.amazonaws.com"),
+        {"NetworkInterface": {"NetworkInterfaceId": "eni-12345"}},
+        {"NetworkInterface": {"NetworkInterfaceId": "eni-67890"}},
+    ]
+    aws_client = AwsClient(ec2_client, "bar")
+
+    assert aws_client.create_interface("subnet-foo", "sg-12345") == "eni-12345"
+    first, retry = ec2_client.create_network_interface.call_args_list
+    assert first.kwargs["ClientToken"] and retry.kwargs["ClientToken"] == first.kwargs["ClientToken"]
+
+    assert aws_client.create_interface("subnet-foo", "sg-12345") == "eni-67890"
+    assert ec2_client.create_network_interface.call_args.kwargs["ClientToken"] != first.kwargs["ClientToken"]
+
+
+class CeilingEc2Client:
+    # Answers create_network_interface within simulated time, throttling calls beyond `ceiling` per second
+    def __init__(self, clock: SimulatedClock, ceiling: float, latency: float):
+        self.clock = clock
+        self.ceiling = ceiling
+        self.latency = latency
+        self.tokens = ceiling
+        self.updated_at = 0.0
+        self.call_times = []
+        self.throttled = 0
+
+    def create_network_interface(self, **kwargs):
+        self.clock.now += self.latency
+        self.tokens = min(self.ceiling, self.tokens + (self.clock.now - self.updated_at) * self.ceiling)
+        self.updated_at = self.clock.now
+        if self.tokens < 1:
+            self.throttled += 1
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "RequestLimitExceeded"}}, "CreateNetworkInterface"
+            )
+        self.tokens -= 1
+        self.call_times.append(self.clock.now)
+        return {"NetworkInterface": {"NetworkInterfaceId": f"eni-{len(self.call_times)}"}}
+
+
+def test_aws_client_should_sustain_throughput_under_a_throttle_ceiling(monkeypatch):
+    ceiling = 40
+    clock = SimulatedClock()
+    monkeypatch.setattr(nic_manager.time, "sleep", clock.sleep)
+    monkeypatch.setattr(nic_manager, "random", random.Random(1))
+    ec2_client = CeilingEc2Client(clock, ceiling, latency=0.005)
+    aws_client = AwsClient(ec2_client, "bar")
+    aws_client._rate_limiters["create_network_interface"] = AdaptiveRateLimiter(clock, clock.sleep)
+
+    for _ in range(240):
+        aws_client.create_interface("subnet-foo", "sg-12345")
+
+    # Past the initial one second burst every call is paced by the limiter
+    steady = [at for at in ec2_client.call_times if at >= 1]
+    assert len(steady) / (steady[-1] - steady[0]) >= ceiling * 0.8
+    assert ec2_client.throttled <= 20
@@ -0,0 +1,64 @@
+import pytest
+
+import corelight_sensor_asg_nic_manager as nic_manager
+from corelight_sensor_asg_nic_manager import EnvironmentVariables, get_runtime_context, reset_runtime_context
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SUBNETS.value, '{"us-east-1a": "subnet-foo"}')
+    monkeypatch.setenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "sg-12345")
+    reset_runtime_context()
+    yield monkeypatch
+    reset_runtime_context()
+
+
+def test_get_runtime_context_should_reuse_context_across_invocations():
+    first = get_runtime_context()
+    second = get_runtime_context()
+
+    assert first is second
+    assert first.aws_client.ec2_client is second.aws_client.ec2_client
+    assert first.lifecycle_event_svc.aws_client is first.aws_client
+
+
+def test_get_runtime_context_should_rebuild_when_environment_changes(environment):
+    first = get_runtime_context()
+    environment.setenv(EnvironmentVariables.TARGET_SECURITY_GROUP_ID.value, "sg-67890")
+    second = get_runtime_context()
+
+    assert first is not second
+    assert second.config.security_group_id == "sg-67890"
+
+
+def test_reset_runtime_context_should_force_a_rebuild():
+    first = get_runtime_context()
+    reset_runtime_context()
+
+    assert get_runtime_context() is not first
+
+
+def test_get_runtime_context_should_not_cache_failed_builds(environment):
+    environment.setenv(EnvironmentVariables.TARGET_SUBNETS.value, "")
+    with pytest.raises(Exception):
+        get_runtime_context()
+
+    assert nic_manager._runtime_context is None
+
+
+def test_runtime_context_clients_should_use_tuned_config():
+    ec2_config = get_runtime_context().aws_client.ec2_client.meta.config
+
+    assert ec2_config.tcp_keepalive
+    assert ec2_config.retries["total_max_attempts"] == 1  # AwsClient retries on its own
+    assert ec2_config.max_pool_connections == nic_manager.BOTO_CLIENT_CONFIG["max_pool_connections"]
+
+
+def test_idempotency_table_client_should_keep_the_sdk_retries(environment):
+    environment.setenv(EnvironmentVariables.IDEMPOTENCY_TABLE_NAME.value, "lifecycle-events")
+    store = get_runtime_context().lifecycle_event_svc.idempotency_store
+    dynamodb_config = store.shared.dynamodb_client.meta.config
+
+    # Called directly by the store rather than through AwsClient, which would retry it
+    assert dynamodb_config.retries == nic_manager.SDK_RETRIES
+    assert dynamodb_config.tcp_keepalive
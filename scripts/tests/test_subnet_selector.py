@@ -0,0 +1,73 @@
+import botocore.exceptions
+
+from corelight_sensor_asg_nic_manager import AwsClient, EnvironmentConfig, Ec2LifecycleHookEvent, \
+    run_sync, SubnetSelector
+
+event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="AutoScalingGroup",
+    lifecycle_hook_name="my-lifecycle-hook",
+    lifecycle_action_token="87654321-4321-4321-4321-210987654321"
+)
+
+cfg = EnvironmentConfig({"us-east-1a": ["subnet-small", "subnet-large"], "us-east-1b": "subnet-bar"}, "sg-12345")
+aws_client = AwsClient("foo", "bar")
+instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
+
+
+def subnets(**available) -> list:
+    return [{"SubnetId": subnet_id.replace("_", "-"), "AvailableIpAddressCount": count} for subnet_id, count in available.items()]
+
+
+def test_subnet_map_should_accept_a_subnet_or_a_list_of_subnets_per_az():
+    assert cfg.subnets_for("us-east-1a") == ["subnet-small", "subnet-large"]
+    assert cfg.subnets_for("us-east-1b") == ["subnet-bar"]
+    assert cfg.subnets_for("us-east-1c") == []
+    assert cfg.all_subnet_ids() == ["subnet-small", "subnet-large", "subnet-bar"]
+
+
+def test_candidates_should_prefer_the_subnet_with_the_most_free_addresses_and_cache_counts(mocker):
+    get_subnets_mocker = mocker.patch.object(
+        aws_client, "get_subnets", return_value=subnets(subnet_small=3, subnet_large=200)
+    )
+    selector = SubnetSelector(cfg, aws_client)
+
+    assert selector.candidates(["subnet-small", "subnet-large"]) == ["subnet-large", "subnet-small"]
+    assert selector.candidates(["subnet-small", "subnet-large"]) == ["subnet-large", "subnet-small"]
+    assert selector.candidates(["subnet-bar"]) == ["subnet-bar"]
+    get_subnets_mocker.assert_called_once_with(["subnet-small", "subnet-large"])
+
+
+def test_candidates_should_keep_the_configured_order_when_subnets_can_not_be_described(mocker):
+    mocker.patch.object(
+        aws_client,
+        "get_subnets",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "UnauthorizedOperation", "Message": "denied"}},
+            operation_name="describe_subnets")
+    )
+
+    assert SubnetSelector(cfg, aws_client).candidates(["subnet-small", "subnet-large"]) == ["subnet-small", "subnet-large"]
+
+
+def test_process_event_should_fall_over_to_the_next_subnet_when_a_subnet_is_full(mocker, service_class):
+    mocker.patch.object(aws_client, "get_subnets", return_value=subnets(subnet_small=3, subnet_large=200))
+    create_mocker = mocker.patch.object(
+        aws_client,
+        "create_interface",
+        side_effect=[
+            botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "InsufficientFreeAddressesInSubnet", "Message": "full"}},
+                operation_name="create_network_interface"),
+            "eni-12345"
+        ]
+    )
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-12345"})
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+    svc = service_class(cfg, aws_client)
+
+    run_sync(svc.process_event(event, instance_data))
+
+    assert [c.args[0] for c in create_mocker.call_args_list] == ["subnet-large", "subnet-small"]
+    assert svc.subnet_selector.candidates(["subnet-small", "subnet-large"]) == ["subnet-small", "subnet-large"]
@@ -0,0 +1,147 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+import analyze_traces
+from corelight_sensor_asg_nic_manager import AwsClient, EnvironmentConfig, Ec2LifecycleHookEvent, \
+    LifecycleActionResult, LifecycleEventService, TraceExporter, _current_trace, run_sync
+from . import test_data_dir
+
+event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="AutoScalingGroup",
+    lifecycle_hook_name="my-lifecycle-hook",
+    lifecycle_action_token="87654321-4321-4321-4321-210987654321"
+)
+
+cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345")
+
+
+def with_request_id(response: dict, request_id: str) -> dict:
+    return {**response, "ResponseMetadata": {"RequestId": request_id, "HTTPStatusCode": 200}}
+
+
+def stubbed_aws_client() -> AwsClient:
+    ec2_client = boto3.client("ec2")
+    asg_client = boto3.client("autoscaling")
+    ec2_stubber = Stubber(ec2_client)
+    asg_stubber = Stubber(asg_client)
+    with open(f"{test_data_dir}/single_nic_instance_describe_response.json") as fh:
+        ec2_stubber.add_response("describe_instances", with_request_id(json.load(fh), "req-describe"))
+    with open(f"{test_data_dir}/nic_create_response.json") as fh:
+        ec2_stubber.add_response("create_network_interface", with_request_id(json.load(fh), "req-create"))
+    ec2_stubber.add_response(
+        "attach_network_interface", with_request_id({"AttachmentId": "eni-attach-12345"}, "req-attach")
+    )
+    ec2_stubber.add_response("modify_network_interface_attribute", with_request_id({}, "req-modify"))
+    asg_stubber.add_response("complete_lifecycle_action", with_request_id({}, "req-complete"))
+    ec2_stubber.activate()
+    asg_stubber.activate()
+    return AwsClient(ec2_client, asg_client)
+
+
+def test_handle_event_should_export_a_span_per_step_with_its_calls(service_class):
+    lines = []
+    svc = service_class(cfg, stubbed_aws_client(), tracer=TraceExporter(True, emit=lines.append))
+
+    result = run_sync(svc.handle_event(event))
+
+    assert result.action == LifecycleActionResult.CONTINUE
+    assert len(lines) == 1 and "\n" not in lines[0]
+    trace = json.loads(lines[0])
+    assert trace["trace"] == "lifecycle_event" and trace["action"] == "CONTINUE"
+    assert trace["instance_id"] == event.instance_id and trace["autoscaling_group_name"] == "my-asg"
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert list(spans) == [
+        "describe_instance", "create_interface", "attach_interface", "modify_attachment", "complete_lifecycle_action"
+    ]
+    assert [call["request_id"] for call in spans["create_interface"]["calls"]] == ["req-create"]
+    assert spans["complete_lifecycle_action"]["calls"][0]["operation"] == "CompleteLifecycleAction"
+    assert all(span["duration_ms"] >= sum(call["latency_ms"] for call in span["calls"]) for span in trace["spans"])
+    assert _current_trace.get() is None
+
+
+def test_disabled_tracer_should_not_record_anything(service_class):
+    lines = []
+    svc = service_class(cfg, stubbed_aws_client(), tracer=TraceExporter(False, emit=lines.append))
+
+    run_sync(svc.handle_event(event))
+
+    assert lines == []
+
+
+class CollectorStandIn(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        self.received.append((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collector():
+    CollectorStandIn.received = []
+    server = HTTPServer(("127.0.0.1", 0), CollectorStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", CollectorStandIn.received
+    server.shutdown()
+
+
+def test_otlp_export_should_nest_calls_under_steps_under_the_event(collector):
+    endpoint, received = collector
+    svc = LifecycleEventService(cfg, stubbed_aws_client(), tracer=TraceExporter(True, otlp_endpoint=endpoint))
+
+    run_sync(svc.handle_event(event))
+
+    path, payload = received[0]
+    assert path == "/v1/traces"
+    spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_id = {span["spanId"]: span for span in spans}
+    root = next(span for span in spans if span["parentSpanId"] == "")
+    attach = next(span for span in spans if span["name"] == "AttachNetworkInterface")
+    assert root["name"] == "lifecycle_event" and len({span["traceId"] for span in spans}) == 1
+    assert by_id[attach["parentSpanId"]]["name"] == "attach_interface"
+    assert by_id[by_id[attach["parentSpanId"]]["parentSpanId"]] is root
+    assert {"key": "aws.request_id", "value": {"stringValue": "req-attach"}} in attach["attributes"]
+
+
+def test_failed_export_should_not_fail_the_event():
+    # Nothing listens on the discard port, the post is refused
+    svc = LifecycleEventService(
+        cfg, stubbed_aws_client(), tracer=TraceExporter(True, otlp_endpoint="http://127.0.0.1:9")
+    )
+
+    assert run_sync(svc.handle_event(event)).action == LifecycleActionResult.CONTINUE
+
+
+def test_analysis_should_split_step_time_between_aws_calls_and_the_lambda():
+    def trace(create_ms: float, create_call_ms: float) -> str:
+        return "2026-03-02T14:00:00Z\treq-1\t" + json.dumps({
+            "trace": "lifecycle_event", "autoscaling_group_name": "my-asg", "duration_ms": create_ms + 50,
+            "action": "CONTINUE", "calls": [],
+            "spans": [{"name": "create_interface", "duration_ms": create_ms, "calls": [
+                {"operation": "CreateNetworkInterface", "latency_ms": create_call_ms, "outcome": "Success", "retries": 0}
+            ]}]
+        })
+
+    lines = [trace(100, 90), trace(400, 100), "START RequestId: req-2", '{"_aws": {}}', trace(2000, 1900)]
+
+    report = analyze_traces.aggregate(analyze_traces.read_traces(lines))
+
+    step = report["steps"]["create_interface"]
+    assert report["events"]["count"] == 3 and report["events"]["actions"] == {"CONTINUE": 3}
+    assert step["total_ms"]["p50"] == 400 and step["lambda_ms"]["p50"] == 100
+    assert step["aws_share"] == pytest.approx(2090 / 2500, abs=1e-3)
+    assert step["histogram"][analyze_traces.HISTOGRAM_BUCKETS.index(100)] == 1
+    assert sum(step["histogram"]) == 3
+    assert report["operations"]["CreateNetworkInterface"]["latency_ms"]["count"] == 3
@@ -0,0 +1,116 @@
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from corelight_sensor_traffic_metrics_publisher import PublisherConfig, TrafficSeries, emit_metrics, fetch_series, \
+    fill_gaps, forecast_utilization, latest_complete_index, rolling_mean, rolling_slope
+from . import test_data_dir
+
+THRESHOLD = 70
+
+
+@pytest.fixture
+def cfg() -> PublisherConfig:
+    return PublisherConfig("my-asg", "gwy/my-lb/1234", "targetgroup/my-tg/5678", 500e6, 1e6)
+
+
+@pytest.fixture
+def ramp() -> TrafficSeries:
+    with open(f"{test_data_dir}/traffic_ramp_series.json") as fh:
+        return TrafficSeries.from_dict(json.load(fh))
+
+
+def naive_slope(values: list) -> float:
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x, mean_y = (n - 1) / 2, sum(values) / n
+    return sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / \
+        sum((x - mean_x) ** 2 for x in range(n))
+
+
+def test_rolling_statistics_should_match_a_full_recomputation_of_every_window():
+    values = [3.0, 7.5, 1.0, 4.0, 9.0, 2.5, 6.0, 8.0, 0.5, 5.0]
+    window = 4
+
+    means = rolling_mean(values, window)
+    slopes = rolling_slope(values, window)
+
+    for i in range(len(values)):
+        points = values[max(0, i - window + 1):i + 1]
+        assert means[i] == pytest.approx(sum(points) / len(points))
+        assert slopes[i] == pytest.approx(naive_slope(points))
+
+
+def test_fill_gaps_should_carry_the_last_known_value():
+    assert fill_gaps([None, 2.0, None, None, 5.0, None]) == [2.0, 2.0, 2.0, 2.0, 5.0, 5.0]
+
+
+def test_flat_traffic_should_predict_the_current_utilization(cfg, ramp):
+    forecast = forecast_utilization(ramp, cfg)
+
+    for current, predicted in zip(forecast.utilization[10:15], forecast.predicted[10:15]):
+        assert current == pytest.approx(30, abs=2)
+        assert predicted == pytest.approx(current, abs=2)
+
+
+def test_prediction_should_cross_the_threshold_before_the_traffic_does(cfg, ramp):
+    forecast = forecast_utilization(ramp, cfg)
+
+    raw = next(i for i, value in enumerate(forecast.utilization) if value >= THRESHOLD)
+    predicted = next(i for i, value in enumerate(forecast.predicted) if value >= THRESHOLD)
+    assert predicted <= raw - 2
+
+
+def test_falling_traffic_should_not_predict_below_the_current_utilization(cfg, ramp):
+    falling = TrafficSeries(
+        ramp.period, ramp.timestamps, ramp.processed_bytes[::-1], ramp.healthy_hosts, ramp.packets_in[::-1]
+    )
+    forecast = forecast_utilization(falling, cfg)
+
+    assert all(predicted >= current for current, predicted in zip(forecast.utilization, forecast.predicted))
+
+
+def test_fetch_series_should_align_metric_data_on_the_period(cfg):
+    cloudwatch_client = boto3.client("cloudwatch")
+    stubber = Stubber(cloudwatch_client)
+    first = datetime(2026, 3, 2, 14, 0, tzinfo=timezone.utc)
+    second = datetime(2026, 3, 2, 14, 1, tzinfo=timezone.utc)
+    stubber.add_response("get_metric_data", {
+        "MetricDataResults": [
+            {"Id": "processed_bytes", "Timestamps": [first, second], "Values": [6e9, 7e9], "StatusCode": "Complete"},
+            {"Id": "healthy_hosts", "Timestamps": [first], "Values": [2.0], "StatusCode": "Complete"},
+        ],
+        "NextToken": "page-2"
+    })
+    stubber.add_response("get_metric_data", {
+        "MetricDataResults": [
+            {"Id": "packets_in", "Timestamps": [first], "Values": [1.2e7], "StatusCode": "Complete"},
+        ]
+    })
+    stubber.activate()
+
+    series = fetch_series(cloudwatch_client, cfg, now=datetime(2026, 3, 2, 14, 2, 30, tzinfo=timezone.utc))
+
+    stubber.assert_no_pending_responses()
+    assert series.timestamps[-2:] == [first.isoformat(), second.isoformat()]
+    assert series.processed_bytes[-2:] == [6e9, 7e9]
+    assert series.healthy_hosts[-2:] == [2.0, None]
+    assert series.packets_in[-2:] == [1.2e7, None]
+    assert latest_complete_index(series) == len(series.timestamps) - 2
+
+
+def test_emit_metrics_should_publish_an_embedded_metric_format_record(cfg, ramp):
+    forecast = forecast_utilization(ramp, cfg)
+    lines = []
+
+    emit_metrics(cfg, forecast, 25, emit=lines.append)
+
+    record = json.loads(lines[0])
+    assert record["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["AutoScalingGroupName"]]
+    assert record["AutoScalingGroupName"] == "my-asg"
+    assert record["PredictedTrafficUtilization"] == forecast.predicted[25]
+    assert record["TrafficUtilization"] == forecast.utilization[25]
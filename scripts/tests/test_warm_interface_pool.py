@@ -0,0 +1,124 @@
+import time
+
+import botocore.exceptions
+import pytest
+
+from corelight_sensor_asg_nic_manager import AwsClient, EnvironmentConfig, Ec2LifecycleHookEvent, run_sync, \
+    WarmInterfacePool, CREATED_AT_TAG_KEY, MANAGED_TAG_KEY, WARM_POOL_TAG_KEY
+
+event = Ec2LifecycleHookEvent(
+    instance_id="i-1234567890abcdef0",
+    autoscaling_group_name="my-asg",
+    destination="AutoScalingGroup",
+    lifecycle_hook_name="my-lifecycle-hook",
+    lifecycle_action_token="87654321-4321-4321-4321-210987654321"
+)
+
+cfg = EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345", warm_pool_size=2, warm_pool_ttl=600)
+aws_client = AwsClient("foo", "bar")
+instance_data = {"Placement": {"AvailabilityZone": "us-east-1a"}}
+
+
+def pool_interface(interface_id: str, age: int, subnet_id: str = "subnet-foo") -> dict:
+    return {
+        "NetworkInterfaceId": interface_id,
+        "SubnetId": subnet_id,
+        "Status": "available",
+        "TagSet": [
+            {"Key": MANAGED_TAG_KEY, "Value": "true"},
+            {"Key": WARM_POOL_TAG_KEY, "Value": "true"},
+            {"Key": CREATED_AT_TAG_KEY, "Value": str(int(time.time()) - age)},
+        ]
+    }
+
+
+def attach_conflict() -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        error_response={"Error": {"Code": "InvalidNetworkInterface.InUse", "Message": "in use"}},
+        operation_name="attach_network_interface")
+
+
+def test_claim_should_skip_stale_interfaces_and_interfaces_claimed_by_another_invocation(mocker):
+    mocker.patch.object(aws_client, "get_warm_pool_interfaces", return_value=[
+        pool_interface("eni-stale", age=3600),
+        pool_interface("eni-taken", age=10),
+        pool_interface("eni-free", age=10),
+    ])
+    mocker.patch("corelight_sensor_asg_nic_manager.random.shuffle")
+    attach_mocker = mocker.patch.object(
+        aws_client,
+        "attach_interface",
+        side_effect=[attach_conflict(), {"AttachmentId": "eni-attach-free"}]
+    )
+    mocker.patch.object(aws_client, "get_interface", return_value={"Status": "in-use"})
+    untag_mocker = mocker.patch.object(aws_client, "untag_interface", return_value=None)
+
+    claimed = WarmInterfacePool(cfg, aws_client).claim("subnet-foo", event.instance_id)
+
+    assert claimed == ("eni-free", {"AttachmentId": "eni-attach-free"})
+    assert [c.args[0] for c in attach_mocker.call_args_list] == ["eni-taken", "eni-free"]
+    untag_mocker.assert_called_once_with("eni-free", [WARM_POOL_TAG_KEY])
+
+
+def test_claim_should_raise_if_attaching_an_available_interface_fails(mocker):
+    mocker.patch.object(aws_client, "get_warm_pool_interfaces", return_value=[pool_interface("eni-free", age=10)])
+    mocker.patch.object(aws_client, "attach_interface", side_effect=attach_conflict())
+    mocker.patch.object(aws_client, "get_interface", return_value={"Status": "available"})
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        WarmInterfacePool(cfg, aws_client).claim("subnet-foo", event.instance_id)
+
+
+def test_refill_should_evict_stale_and_excess_interfaces_and_top_up_each_subnet(mocker):
+    two_subnet_cfg = EnvironmentConfig(
+        {"us-east-1a": "subnet-foo", "us-east-1b": "subnet-bar"}, "sg-12345", warm_pool_size=2, warm_pool_ttl=600
+    )
+    mocker.patch.object(aws_client, "get_warm_pool_interfaces", return_value=[
+        pool_interface("eni-stale", age=3600),
+        pool_interface("eni-oldest", age=300),
+        pool_interface("eni-newer", age=200),
+        pool_interface("eni-newest", age=100),
+        pool_interface("eni-bar", age=100, subnet_id="subnet-bar"),
+    ])
+    delete_mocker = mocker.patch.object(aws_client, "delete_interface", return_value=None)
+    create_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-new")
+
+    WarmInterfacePool(two_subnet_cfg, aws_client).refill(["subnet-foo", "subnet-bar"])
+
+    assert sorted(c.args[0] for c in delete_mocker.call_args_list) == ["eni-oldest", "eni-stale"]
+    create_mocker.assert_called_once_with("subnet-bar", "sg-12345", {WARM_POOL_TAG_KEY: "true"})
+
+
+def test_process_event_should_use_a_claimed_interface_instead_of_creating_one(mocker, service_class):
+    svc = service_class(cfg, aws_client)
+    mocker.patch.object(svc.warm_pool, "claim", return_value=("eni-pool", {"AttachmentId": "eni-attach-pool"}))
+    create_mocker = mocker.patch.object(aws_client, "create_interface")
+    attach_mocker = mocker.patch.object(aws_client, "attach_interface")
+    modify_mocker = mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+
+    run_sync(svc.process_event(event, instance_data))
+
+    assert create_mocker.call_count == 0 and attach_mocker.call_count == 0
+    modify_mocker.assert_called_once_with("eni-attach-pool", "eni-pool")
+
+
+def test_process_event_should_create_an_interface_when_the_pool_is_unavailable(mocker, service_class):
+    svc = service_class(cfg, aws_client)
+    mocker.patch.object(
+        svc.warm_pool,
+        "claim",
+        side_effect=botocore.exceptions.ClientError(
+            error_response={"Error": {"Code": "RequestLimitExceeded", "Message": "slow down"}},
+            operation_name="describe_network_interfaces")
+    )
+    create_mocker = mocker.patch.object(aws_client, "create_interface", return_value="eni-new")
+    mocker.patch.object(aws_client, "attach_interface", return_value={"AttachmentId": "eni-attach-new"})
+    mocker.patch.object(aws_client, "modify_attachment_to_delete_on_termination", return_value=None)
+
+    run_sync(svc.process_event(event, instance_data))
+
+    create_mocker.assert_called_once_with("subnet-foo", "sg-12345")
+
+
+def test_warm_pool_should_be_disabled_by_default(service_class):
+    assert service_class(EnvironmentConfig({"us-east-1a": "subnet-foo"}, "sg-12345"), aws_client).warm_pool is None
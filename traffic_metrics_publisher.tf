@@ -0,0 +1,108 @@
+locals {
+  traffic_metrics_publisher_script_name   = "corelight_sensor_traffic_metrics_publisher.py"
+  traffic_metrics_publisher_function_name = "${var.lambda_function_name}-traffic-metrics"
+}
+
+# Optional Lambda publishing a per-instance traffic utilization forecast from the Gateway Load Balancer and EC2
+# metrics, so the sensor group scales on the traffic trend instead of waiting for CPU to stay high
+data "archive_file" "traffic_metrics_publisher_code" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  output_path = "traffic_metrics_publisher_payload.zip"
+  source_file = "${path.module}/scripts/${local.traffic_metrics_publisher_script_name}"
+  type        = "zip"
+}
+
+resource "aws_lambda_function" "traffic_metrics_publisher" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  function_name = local.traffic_metrics_publisher_function_name
+  role          = var.traffic_metrics_publisher_iam_role_arn
+  filename      = data.archive_file.traffic_metrics_publisher_code[0].output_path
+  handler       = "corelight_sensor_traffic_metrics_publisher.lambda_handler"
+  timeout       = 30
+  runtime       = "python3.12"
+
+  source_code_hash = data.archive_file.traffic_metrics_publisher_code[0].output_base64sha256
+
+  environment {
+    variables = {
+      AUTO_SCALING_GROUP_NAME = aws_autoscaling_group.sensor_asg.name
+      LOAD_BALANCER           = aws_lb.sensor_lb.arn_suffix
+      TARGET_GROUP            = aws_lb_target_group.health_check.arn_suffix
+      INSTANCE_CAPACITY_BPS   = var.traffic_metrics_instance_capacity_bps
+      INSTANCE_CAPACITY_PPS   = var.traffic_metrics_instance_capacity_pps
+      PERIOD                  = 60
+      WINDOW                  = var.traffic_metrics_window
+      HORIZON                 = var.traffic_metrics_horizon
+      METRICS_NAMESPACE       = var.traffic_metrics_namespace
+    }
+  }
+
+  tags = var.tags
+
+  lifecycle {
+    precondition {
+      condition     = var.traffic_metrics_publisher_iam_role_arn != ""
+      error_message = "traffic_metrics_publisher_iam_role_arn must be set when traffic_metrics_publisher_enabled is true."
+    }
+  }
+}
+
+resource "aws_cloudwatch_log_group" "traffic_metrics_publisher_log_group" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  name              = "${var.cloudwatch_log_group_prefix}/${local.traffic_metrics_publisher_function_name}"
+  retention_in_days = var.cloudwatch_log_group_retention
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_rule" "traffic_metrics_publisher_schedule" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  name                = local.traffic_metrics_publisher_function_name
+  schedule_expression = "rate(1 minute)"
+
+  tags = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "traffic_metrics_publisher_target" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  arn  = aws_lambda_function.traffic_metrics_publisher[0].arn
+  rule = aws_cloudwatch_event_rule.traffic_metrics_publisher_schedule[0].name
+}
+
+resource "aws_lambda_permission" "traffic_metrics_publisher_trigger_permission" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.traffic_metrics_publisher[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.traffic_metrics_publisher_schedule[0].arn
+}
+
+resource "aws_autoscaling_policy" "sensor_traffic_target_tracking_policy" {
+  count = var.traffic_metrics_publisher_enabled ? 1 : 0
+
+  name                   = var.sensor_asg_traffic_scaling_policy_name
+  autoscaling_group_name = aws_autoscaling_group.sensor_asg.name
+  policy_type            = "TargetTrackingScaling"
+
+  target_tracking_configuration {
+    target_value = var.traffic_metrics_target_utilization
+
+    customized_metric_specification {
+      namespace   = var.traffic_metrics_namespace
+      metric_name = "PredictedTrafficUtilization"
+      statistic   = "Maximum"
+      unit        = "Percent"
+
+      metric_dimension {
+        name  = "AutoScalingGroupName"
+        value = aws_autoscaling_group.sensor_asg.name
+      }
+    }
+  }
+}
@@ -14,7 +14,7 @@ variable "monitoring_subnet_ids" {
 }
 
 variable "management_subnet_ids" {
-  description = "List of subnet IDs used to SSH / manage Corelight sensors, one per availability zone"
+  description = "List of subnet IDs used to SSH / manage Corelight sensors, at least one per availability zone. Management interfaces are placed in the subnet of their availability zone with the most free addresses"
   type        = list(string)
 }
 
@@ -202,6 +202,271 @@ variable "asg_lifecycle_hook_name" {
   default     = "scaling-up"
 }
 
+variable "asg_terminate_lifecycle_hook_enabled" {
+  description = "(optional) Add a terminate lifecycle hook so the ENI management lambda removes management interfaces on scale-in"
+  type        = bool
+  default     = false
+}
+
+variable "asg_terminate_lifecycle_hook_name" {
+  description = "name of the lifecycle hook triggered when instances are terminated"
+  type        = string
+  default     = "scaling-down"
+}
+
+variable "asg_lifecycle_hook_timeout" {
+  description = "Seconds the launch lifecycle hook waits for the ENI management lambda before abandoning the instance"
+  type        = number
+  default     = 300
+}
+
+variable "asg_terminate_lifecycle_hook_timeout" {
+  description = "Seconds termination waits for the ENI management lambda before continuing anyway"
+  type        = number
+  default     = 60
+}
+
+variable "lambda_max_concurrency" {
+  description = "Maximum number of instances the ENI management lambda provisions in parallel within one invocation"
+  type        = number
+  default     = 8
+}
+
+variable "lambda_attachment_wait_timeout" {
+  description = "Seconds the ENI management lambda waits for a management interface attachment to complete before continuing the launch. 0 disables the wait"
+  type        = number
+  default     = 20
+}
+
+variable "lambda_metrics_enabled" {
+  description = "(optional) Emit CloudWatch Embedded Metric Format latency metrics from the ENI management lambda"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_metrics_namespace" {
+  description = "CloudWatch namespace of the ENI management lambda metrics"
+  type        = string
+  default     = "Corelight/SensorNicManager"
+}
+
+variable "lambda_latency_alarms_enabled" {
+  description = "(optional) Create p95 latency alarms on the ENI management lambda metrics"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_launch_to_continue_p95_threshold" {
+  description = "p95 LaunchToContinueLatency, in milliseconds, above which the latency alarm fires"
+  type        = number
+  default     = 60000
+}
+
+variable "lambda_aws_call_p95_threshold" {
+  description = "p95 AwsCallLatency per API operation, in milliseconds, above which the latency alarm fires"
+  type        = number
+  default     = 3000
+}
+
+variable "lambda_latency_alarm_actions" {
+  description = "(optional) ARNs notified when a latency alarm fires, e.g. SNS topics"
+  type        = list(string)
+  default     = []
+}
+
+variable "eni_warm_pool_size" {
+  description = "(optional) Number of detached management interfaces kept ready in each management subnet to speed up launches. 0 disables the warm pool"
+  type        = number
+  default     = 0
+}
+
+variable "eni_warm_pool_ttl" {
+  description = "Seconds an unclaimed warm pool interface is kept before it is replaced"
+  type        = number
+  default     = 3600
+}
+
+variable "lifecycle_event_batching_enabled" {
+  description = "(optional) Route lifecycle events through an SQS queue so the Lambda processes them in batches"
+  type        = bool
+  default     = false
+}
+
+variable "lifecycle_event_queue_name" {
+  description = "Name of the SQS queue buffering lifecycle events when batching is enabled"
+  type        = string
+  default     = "corelight-asg-sensor-lifecycle-events"
+}
+
+variable "lifecycle_event_batch_size" {
+  description = "Maximum number of lifecycle events passed to a single Lambda invocation when batching is enabled"
+  type        = number
+  default     = 10
+}
+
+variable "lifecycle_event_batch_window" {
+  description = "Maximum number of seconds SQS waits to fill a batch of lifecycle events when batching is enabled"
+  type        = number
+  default     = 2
+}
+
+variable "lambda_idempotency_table_enabled" {
+  description = "(optional) Create a DynamoDB table so replayed lifecycle events are deduplicated across Lambda containers"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_idempotency_table_name" {
+  description = "Name of the DynamoDB table used to deduplicate lifecycle events when enabled"
+  type        = string
+  default     = "corelight-asg-sensor-lifecycle-event-idempotency"
+}
+
+variable "lambda_subnet_capacity_ttl" {
+  description = "Seconds the ENI management lambda caches the free address count of the management subnets"
+  type        = number
+  default     = 30
+}
+
+variable "lambda_payload_dir" {
+  description = "Directory built by scripts/build_lambda_payload.py to deploy instead of the plain script, for faster cold starts"
+  type        = string
+  default     = ""
+}
+
+variable "lambda_preflight_ttl" {
+  description = "Seconds a warm Lambda reuses its check that the subnets and security group exist where configured, 0 disables the check"
+  type        = number
+  default     = 300
+}
+
+variable "lambda_additional_fleets" {
+  description = "(optional) Other sensor autoscaling groups, by name, whose lifecycle events this module's Lambda handles with their own subnets (availability zone => subnet IDs) and security group. lifecycle_hook_names lists the group's launch and terminate hooks, empty assumes the same names as this module's"
+  type = map(object({
+    region               = optional(string, "")
+    subnets              = map(list(string))
+    security_group_id    = string
+    vpc_id               = optional(string, "")
+    monitoring_subnets   = optional(map(string), {})
+    lifecycle_hook_names = optional(list(string), [])
+  }))
+  default = {}
+}
+
+variable "lifecycle_events_handled_by_shared_lambda" {
+  description = "(optional) Do not deliver this module's lifecycle events to its own Lambda, set when the group is listed in lambda_additional_fleets of another deployment"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_trace_enabled" {
+  description = "(optional) Log a JSON trace of the steps and API calls of every lifecycle event, see scripts/analyze_traces.py"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_trace_otlp_endpoint" {
+  description = "(optional) OTLP/HTTP endpoint, e.g. http://localhost:4318 of an OpenTelemetry collector layer, traces are posted to instead of logged"
+  type        = string
+  default     = ""
+}
+
+variable "lambda_async_pipeline" {
+  description = "Handle the lifecycle events of an invocation concurrently on one asyncio event loop instead of a thread per event"
+  type        = bool
+  default     = false
+}
+
+variable "lambda_trust_event_data" {
+  description = "Skip describe_instances when every monitoring subnet is in one availability zone, the instance is only described if provisioning from the event fails"
+  type        = bool
+  default     = false
+}
+
+variable "traffic_metrics_publisher_enabled" {
+  description = "(optional) Deploy a Lambda publishing a per-instance traffic utilization forecast and scale the sensors on it with target tracking"
+  type        = bool
+  default     = false
+}
+
+variable "traffic_metrics_publisher_iam_role_arn" {
+  description = "ARN of the traffic metrics publisher lambda role created in the `iam/traffic_metrics_publisher` sub-module, required when traffic_metrics_publisher_enabled is true"
+  type        = string
+  default     = ""
+}
+
+variable "traffic_metrics_instance_capacity_bps" {
+  description = "Bytes per second of Gateway Load Balancer traffic one sensor instance handles at 100% utilization"
+  type        = number
+  default     = 500000000
+}
+
+variable "traffic_metrics_instance_capacity_pps" {
+  description = "Packets per second one sensor instance receives at 100% utilization"
+  type        = number
+  default     = 1000000
+}
+
+variable "traffic_metrics_window" {
+  description = "Number of one minute data points the traffic trend is fitted over"
+  type        = number
+  default     = 10
+}
+
+variable "traffic_metrics_horizon" {
+  description = "Seconds ahead the traffic utilization is forecast, about the time a new sensor takes to start handling traffic"
+  type        = number
+  default     = 300
+}
+
+variable "traffic_metrics_namespace" {
+  description = "CloudWatch namespace of the traffic utilization metrics"
+  type        = string
+  default     = "Corelight/Sensor"
+}
+
+variable "traffic_metrics_target_utilization" {
+  description = "Predicted traffic utilization percentage the target tracking policy keeps each sensor at"
+  type        = number
+  default     = 60
+}
+
+variable "sensor_asg_traffic_scaling_policy_name" {
+  description = "Name of the target tracking policy scaling the sensors on predicted traffic utilization"
+  type        = string
+  default     = "corelight-sensor-traffic-target-tracking-policy"
+}
+
+variable "orphaned_interface_sweep_enabled" {
+  description = "(optional) Periodically delete managed interfaces left available by Lambda invocations that timed out"
+  type        = bool
+  default     = false
+}
+
+variable "orphaned_interface_sweep_schedule" {
+  description = "EventBridge schedule expression of the orphaned interface sweep"
+  type        = string
+  default     = "rate(1 hour)"
+}
+
+variable "orphaned_interface_min_age" {
+  description = "Seconds an available managed interface must exist before the sweep deletes it"
+  type        = number
+  default     = 900
+}
+
+variable "orphaned_interface_delete_batch_size" {
+  description = "Number of orphaned interfaces the sweep deletes in parallel"
+  type        = number
+  default     = 10
+}
+
+variable "orphaned_interface_delete_rate" {
+  description = "Maximum DeleteNetworkInterface calls per second made by the sweep"
+  type        = number
+  default     = 5
+}
+
 variable "tags" {
   description = "(optional) Any tags that should be applied to resources deployed by the module"
   type        = map(any)